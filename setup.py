@@ -22,5 +22,6 @@ setup(name='starparser',
             ],
       },
       install_requires=["numpy","pandas","matplotlib", "scipy"],
+      extras_require={"zstd": ["zstandard"]},
       python_requires='>=3.8'
      )
@@ -1,8 +1,9 @@
 import optparse
+import shlex
 import sys
 import starparser
 
-def argparse():
+def makeparser():
 
     """
     optparse is used to initialize all command-line options.
@@ -35,6 +36,10 @@ def argparse():
         action="store_true", dest="parser_countme", default=False,
         help="Count particles and display the result. Optionally, use --c and --q to count a subset of particles, otherwise counts all.")
     
+    info_opts.add_option("--info",
+        action="store_true", dest="parser_info", default=False,
+        help="Summarize the star file without reading its particles: the version, the number of rows and the columns of every table, and the optics table.")
+
     info_opts.add_option("--count_mics",
         action="store_true", dest="parser_uniquemics", default=False,
         help="Count the number of unique micrographs. Optionally, use --c and --q to count from a subset of particles, otherwise counts all.")
@@ -59,6 +64,10 @@ def argparse():
         action="store", dest="parser_exractmin", type="int", default=-1, metavar='minimum-number',
         help="Find the micrographs that have this minimum number of particles in them and extract all the particles belonging to them.")
 
+    info_opts.add_option("--mic_counts",
+        action="store_true", dest="parser_miccounts", default=False,
+        help="With --extract_min, also write the number of particles in every micrograph to Micrograph_counts.txt.")
+
     info_opts.add_option("--extract_if_nearby",
         action="store", dest="parser_findnearby", type="float", default=-1, metavar='distance',
         help="Find the nearest particle in a second star file (specified by --f); particles that have a neighbor in the second star file closer than the distance provided here will be written to particles_close.star and those that don't will be written to particles_far.star. Particles that couldn't be matched to a neighbor will be skipped (i.e. if the second star file lacks particles in that micrograph). It will also write a histogram of nearest distances to Particles_distances.png.")
@@ -122,11 +131,11 @@ def argparse():
 
     modify_opts.add_option("--remove_mics_list",
         action="store_true", dest="parser_delmics", default=False,
-        help="Remove particles that belong to micrographs that have a match in a second file provided by --f (single column list of micrographs).")
+        help="Remove particles that belong to micrographs that have a match in a second file provided by --f (single column list of micrographs). A micrograph name (with or without the path or extension) only matches that micrograph (e.g. mic1 doesn't match mic10); anything else is matched as part of the micrograph names.")
 
     modify_opts.add_option("--keep_mics_list",
         action="store_true", dest="parser_keepmics", default=False,
-        help="Keep particles that belong to micrographs that have a match in a second file provided by --f (single column list of micrographs).")
+        help="Keep particles that belong to micrographs that have a match in a second file provided by --f (single column list of micrographs). A micrograph name (with or without the path or extension) only matches that micrograph (e.g. mic1 doesn't match mic10); anything else is matched as part of the micrograph names.")
 
     modify_opts.add_option("--insert_column",
         action="store", dest="parser_insertcol", type="string", default="", metavar='column-name',
@@ -235,8 +244,22 @@ def argparse():
         action="store_true", dest="parser_optless", default=False,
         help="Pass this if the file lacks an optics group (more specifically: the star file has exactly one table), such as with Relion 3.0 files.")
 
-    
-    other_opts.add_option("--j", help="Ignore this option, multi-threading is not supported yet. The option is included so that Relion can submit starparser jobs.")
+
+    other_opts.add_option("--cache",
+        action="store_true", dest="parser_cache", default=False,
+        help="Keep a binary copy of the parsed star file so that the next commands on the same file don't have to parse it again. The copy is kept in $STARPARSER_CACHE_DIR (~/.cache/starparser by default), which is limited to $STARPARSER_CACHE_SIZE (20G by default) by removing the least recently used files first.")
+
+    other_opts.add_option("--pipeline",
+        action="store", dest="parser_pipeline", type="string", default="", metavar="recipe-file",
+        help="Read the star file once and run the options in the recipe file on it one after the other, each line being the options of one command without --i and --o (e.g. \"--limit DefocusU/lt/40000\"). Only the result of the last line is written (to --o). The time taken and number of particles left after each line are reported.")
+
+    other_opts.add_option("--stream",
+        action="store_true", dest="parser_stream", default=False,
+        help="Read the particles a chunk at a time and write the ones that are kept straight away, so that star files larger than the memory can be processed. This works with --limit, --extract, --remove_particles, --remove_mics_list, --keep_mics_list, --reset_column and --operate, and with --relegate (on its own or along with one of them). The output (--o) can't be the input file.")
+
+    other_opts.add_option("--j",
+        action="store", dest="parser_threads", type="int", default=1, metavar="number-of-threads",
+        help="Number of threads used to read large star files and to look up nearest particles (--extract_if_nearby). Default is 1. This is also passed by Relion when it submits starparser jobs.")
 
     parser.add_option_group(other_opts)
     
@@ -253,10 +276,16 @@ def argparse():
 
     parser.add_option_group(output_opts)
 
+    return(parser)
+
+def argparse():
+
     """
-    The rest of the function parses the input and generates a dictionary for use in decisiontree.py
+    This function parses the input and generates a dictionary for use in decisiontree.py
     """
 
+    parser = makeparser()
+
     #Get the passed arguments from command-line
     options,args = parser.parse_args()
 
@@ -275,4 +304,36 @@ def argparse():
         params[i[0]] = i[1]
         
     #The dictionary is the main input to decisiontree.py
-    return(params)
\ No newline at end of file
+    return(params)
+
+def parseline(line):
+
+    """
+    Parses the options in a line of a pipeline recipe file (see --pipeline) into a dictionary like argparse() does
+    for the command line.
+    """
+
+    parser = makeparser()
+
+    options,args = parser.parse_args(shlex.split(line))
+
+    if args:
+        print("\n>> Error: could not understand \"" + " ".join(args) + "\" in \"" + line + "\".\n")
+        sys.exit()
+
+    params={}
+
+    for i in options.__dict__.items():
+        params[i[0]] = i[1]
+
+    return(params)
+
+def passedoptions(params):
+
+    """
+    Returns the names (i.e. dest) of the options in params that were changed from their default values.
+    """
+
+    defaults = makeparser().defaults
+
+    return([k for k,v in params.items() if k in defaults and v != defaults[k]])
@@ -6,32 +6,23 @@ import sys
 """
 def delcolumn(particles, columns, metadata):
     
-    """
-    With dataframes, stating dataframe1 = dataframe2 only creates
-    a reference. Therefore, we must create a copy if we want to leave
-    the original dataframe unmodified.
-    """
-    nocolparticles = particles.copy()
-    
-    #Loop through each passed column to delete them
+    #Loop through each passed column to check that they exist
     for c in columns:
 
         #Check if the column doesn't exist.
         #Consider doing the check in decisiontree.py
-        if c not in nocolparticles:
+        if c not in particles:
             print("\n>> Error: the column \"" + c + "\" does not exist.\n")
             sys.exit()
 
-        """
-        The .drop can be used to drop a whole column.
-        The "1" tells .drop that it is the column axis that we want to drop
-        inplace means we want the dataframe to be modified instead of creating an assignment
-        """
-        nocolparticles.drop(c, axis=1, inplace=True)
+    """
+    .drop returns a new dataframe without the columns, leaving the original one unmodified.
+    The other columns are not copied: pandas shares them until one of the dataframes is modified (copy-on-write).
+    """
+    nocolparticles = particles.drop(columns=columns)
 
-        #We nead to remove that column header too. The heads are the third
-        #metadata (i.e. metadata[3])
-        metadata[3].remove(c)
+    #We nead to remove those column headers too. The metadata is not modified, a new one is made (see fileparser.StarFile)
+    metadata = metadata.withoutcolumns(columns)
     
     return(nocolparticles, metadata)
 
@@ -46,12 +37,8 @@ def swapcolumns(original_particles, swapfrom_particles, columns):
         print("\n>> Error: the star files don't have the same number of particles: " + str(len(original_particles.index)) + " vs " + str(len(swapfrom_particles.index)) + ".\n")
         sys.exit()
     
-    """
-    With dataframes, stating dataframe1 = dataframe2 only creates
-    a reference. Therefore, we must create a copy if we want to leave
-    the original dataframe unmodified.
-    """
-    swappedparticles = original_particles.copy()
+    #The new columns are collected first and replace the old ones all at once
+    swapped = {}
     
     #Loop through the columns
     for c in columns:
@@ -64,42 +51,32 @@ def swapcolumns(original_particles, swapfrom_particles, columns):
             sys.exit()
 
         """
-        We will remove the column then insert the new one
-        Therefore, e need to know what the index of the column
-        """
-
-        #Get the column index
-        columnindex = original_particles.columns.get_loc(c)
-
-        #Remove the column
-        """
-        The .drop can be used to drop a whole column.
-        The "1" means the column axis and inplace means the dataframe
-        should be modified instead of creating an assignment
+        The values are taken by position, so the index of the second file is not used
         """
-        swappedparticles.drop(c,axis=1,inplace=True)
+        swapped[c] = swapfrom_particles[c].to_numpy()
 
-        """
-        Insert the new column in the right index using .insert()
-        The function takes a list, so we generate a list of values of
-        the new column with .values.tolist()
-        """
-        swappedparticles.insert(columnindex, c, swapfrom_particles[c].values.tolist())
+    """
+    .assign replaces the columns where they are and returns a new dataframe. The other columns are
+    shared with the original dataframe rather than copied (copy-on-write), and the original is left unmodified.
+    """
+    swappedparticles = original_particles.assign(**swapped)
     
     return(swappedparticles)
 
 """
 --operate
 """
-def operate(particles,column,operator,value):
+def operate(particles,column,operator,value,quiet=False,downcast="float"):
 
     """
     If we are applying operations, the column must contain numbers.
     We can check that this is the case with a try/except.
+    downcast is passed to pd.to_numeric(). With None, the values are always float64, which --stream uses
+    so that the result doesn't depend on which rows are converted together.
     """
     try:
         #to_numeric allows us to change all values of a column to floats
-        particles[column] = pd.to_numeric(particles[column], downcast="float")
+        values = pd.to_numeric(particles[column], downcast=downcast)
     #If this didn't work, then they probably weren't numbers
     except ValueError:
         print("\n>> Error: Could not interpret the values in " + column + " as numbers.\n")
@@ -110,22 +87,27 @@ def operate(particles,column,operator,value):
     """
 
     if operator == "multiply":
-        print("\n>> Multiplying all values in " + column + " by " + str(value) + ".")
-        particles[column] = particles[column] * value
+        if not quiet:
+            print("\n>> Multiplying all values in " + column + " by " + str(value) + ".")
+        values = values * value
 
     elif operator == "divide":
-        print("\n>> Dividing all values in " + column + " by " + str(value) + ".")
-        particles[column] = particles[column] / value
+        if not quiet:
+            print("\n>> Dividing all values in " + column + " by " + str(value) + ".")
+        values = values / value
 
     elif operator == "add":
-        print("\n>> Adding " + str(value) + " to all values in " + column + ".")
-        particles[column] = particles[column] + value
+        if not quiet:
+            print("\n>> Adding " + str(value) + " to all values in " + column + ".")
+        values = values + value
 
     elif operator == "subtract":
-        print("\n>> Subtracting " + str(value) + " from all values in " + column + ".")
-        particles[column] = particles[column] - value
+        if not quiet:
+            print("\n>> Subtracting " + str(value) + " from all values in " + column + ".")
+        values = values - value
 
-    return(particles)
+    #The particles that were passed are left unmodified, and the other columns are shared with them (copy-on-write)
+    return(particles.assign(**{column: values}))
 
 """
 --operate_columns
@@ -138,7 +120,7 @@ def operatecolumns(particles,column1,column2,newcolumn,operator,metadata):
     """
     try:
         #to_numeric allows us to change all values of a column to floats
-        particles[column1] = pd.to_numeric(particles[column1], downcast="float")
+        values1 = pd.to_numeric(particles[column1], downcast="float")
 
     #If this didn't work, then they probably weren't numbers
     except ValueError:
@@ -147,7 +129,7 @@ def operatecolumns(particles,column1,column2,newcolumn,operator,metadata):
 
     #Repeat for the second column
     try:
-        particles[column2] = pd.to_numeric(particles[column2], downcast="float")
+        values2 = pd.to_numeric(particles[column2], downcast="float")
     except ValueError:
         print("\n>> Error: Could not interpret the values in " + column2 + " as numbers.\n")
         sys.exit()
@@ -159,25 +141,26 @@ def operatecolumns(particles,column1,column2,newcolumn,operator,metadata):
 
     if operator == "multiply":
         print("\n>> Multiplying " + column1 + " by " + column2 + " and storing the result in " + newcolumn + ".")
-        particles[newcolumn] = particles[column1] * particles[column2]
+        newvalues = values1 * values2
 
     elif operator == "divide":
         print("\n>> Dividing  all values in " + column1 + " by " + column2 + " and storing the result in " + newcolumn + ".")
-        particles[newcolumn] = particles[column1] / particles[column2]
+        newvalues = values1 / values2
 
     elif operator == "add":
         print("\n>> Adding " + column2 + " to all values in " + column1 + " and storing the result in " + newcolumn + ".")
-        particles[newcolumn] = particles[column1] + particles[column2]
+        newvalues = values1 + values2
 
     elif operator == "subtract":
         print("\n>> Subtracting " + column2 + " from all values in " + column1 + " and storing the result in " + newcolumn + ".")
-        particles[newcolumn] = particles[column1] - particles[column2]
+        newvalues = values1 - values2
 
     #Since the new column is added to the end of the dataframe
-    #We need to make a new header, which is in metadata[3]
-    metadata[3].append(newcolumn)
+    #We need to make a new header, which is in the headers of a new metadata
+    metadata = metadata.withcolumn(newcolumn)
 
-    return(particles, metadata)
+    #The columns that were operated on are left as they were
+    return(particles.assign(**{newcolumn: newvalues}), metadata)
 
 """
 --list_column
@@ -224,26 +207,11 @@ def writecol(particles, columns):
 def replacecolumn(particles,replacecol,newcol):
 
     """
-    We will remove the column then insert the new one
-    Therefore, e need to know what the index of the column
-    """
-
-    #Get the column index
-    columnindex = particles.columns.get_loc(replacecol)
-
-    #Remove the column
-    """
-    The .drop can be used to drop a whole column.
-    The "1" means the column axis and inplace means the dataframe
-    should be modified instead of creating an assignment
+    .assign replaces the column where it is and returns a new dataframe that shares the
+    other columns with the original one (copy-on-write), which is left unmodified.
+    Since newcol comes in as a list, we don't have to modify it
     """
-    particles.drop(replacecol, axis=1, inplace=True)
-
-    #Insert the new column in the right index using .insert()
-    #Since newcol comes in as a list, we don't have to modify it
-    particles.insert(columnindex, replacecol, newcol)
-
-    return(particles)
+    return(particles.assign(**{replacecol: newcol}))
 
 """
 --copy_column
@@ -257,28 +225,24 @@ def copycolumn(particles,sourcecol,targetcol,metadata):
         """
         Here we are just telling the user that a new column will be made
         and making a new metadata header. We don't have to create the new column
-        since pandas will make it for if it doesn't exist in the line below
-        particles[targetcol] = particles[sourecol]
+        since .assign will make it if it doesn't exist in the line below
         """
         print("\n>> Creating a new column: " + targetcol + ".")
-        metadata[3].append(targetcol)
+        metadata = metadata.withcolumn(targetcol)
 
     else:
         print("\n>> Replacing values in " + targetcol + " with " + sourcecol + ".")
 
     #Copy the values. It will overwrite if the column exists
     #or create a new one if it doesn't
-    particles[targetcol] = particles[sourcecol]
-
-    return(particles)
+    return(particles.assign(**{targetcol: particles[sourcecol]}), metadata)
 
 """
 --reset_column
 """
-def resetcolumn(particles,column,value):
-
-    print("\n>> Replacing all values in " + column + " with " + value + ".")
+def resetcolumn(particles,column,value,quiet=False):
 
-    particles[column]=value
+    if not quiet:
+        print("\n>> Replacing all values in " + column + " with " + value + ".")
 
-    return(particles)
\ No newline at end of file
+    return(particles.assign(**{column: value}))
\ No newline at end of file
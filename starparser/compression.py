@@ -0,0 +1,263 @@
+import sys
+import io
+import gzip
+import shutil
+import subprocess
+
+"""
+Support for star files compressed with gzip (e.g. particles.star.gz) or zstd (e.g. particles.star.zst).
+Compressed star files are recognized by their first bytes rather than by their names, and are read by
+fileparser.mapstar() through a StreamWindow, which decompresses them as they are read instead of to a file.
+A star file is compressed when it is written if its name ends with .gz or .zst (see openwrite()).
+zstd needs the zstandard package (pip install zstandard).
+"""
+
+"""
+The first bytes of gzip and zstd files
+"""
+GZIPMAGIC = b"\x1f\x8b"
+ZSTDMAGIC = b"\x28\xb5\x2f\xfd"
+
+"""
+The size of the pieces that are decompressed at a time
+"""
+CHUNKSIZE = 1 << 22
+
+"""
+The number of decompressed bytes that are kept before the current position of a StreamWindow,
+so that parsestar() can step back over the lines before a data block without decompressing the file again
+"""
+LOOKBACK = 1 << 20
+
+def compression(filename):
+
+    """
+    Returns "gzip" or "zstd" if the file is compressed with either of them, otherwise None.
+    """
+
+    with open(filename,mode='rb') as file:
+        magic = file.read(4)
+
+    if magic.startswith(GZIPMAGIC):
+        return("gzip")
+    elif magic.startswith(ZSTDMAGIC):
+        return("zstd")
+
+    return(None)
+
+def importzstd():
+
+    """
+    zstandard is only needed for zstd files, so it is imported when one is used.
+    """
+
+    try:
+        import zstandard
+    except ImportError:
+        print("\n>> Error: the zstandard package is needed for zstd-compressed star files (pip install zstandard).\n")
+        sys.exit()
+
+    return(zstandard)
+
+def openread(filename, kind):
+
+    """
+    Returns a binary stream of the decompressed contents of a file compressed with kind (see compression()).
+    """
+
+    if kind == "gzip":
+        return(gzip.open(filename, mode='rb'))
+
+    zstandard = importzstd()
+
+    return(zstandard.ZstdDecompressor().stream_reader(open(filename,mode='rb'), read_size=CHUNKSIZE, closefd=True))
+
+class StreamWindow:
+
+    """
+    The decompressed contents of a compressed star file, with the parts of the interface of bytes that
+    fileparser.parsestar() and fileparser.readblock() use (len(), slicing, find() and rfind()).
+    Only a window of the contents is kept in memory: it is decompressed as it is needed and discarded once it is
+    more than LOOKBACK bytes behind what was asked for. Asking for anything before the window starts the
+    decompression over from the beginning of the file, so the contents should be read in order.
+    """
+
+    def __init__(self, filename, kind):
+        self.filename = filename
+        self.kind = kind
+        self.stream = None
+        self.size = None
+        self.rewind()
+
+    def rewind(self):
+
+        if self.stream is not None:
+            self.stream.close()
+
+        self.stream = openread(self.filename, self.kind)
+        self.buffer = bytearray()
+        self.base = 0
+        self.eof = False
+
+    def close(self):
+        self.stream.close()
+
+    def ensure(self, start, stop):
+
+        """
+        Makes sure that the window holds the contents from start up to stop (or the end of the file)
+        and returns where the window ends, which is stop unless the file ended before it.
+        """
+
+        if start < self.base:
+            self.rewind()
+
+        while True:
+
+            #What is no longer needed is dropped, a large piece at a time
+            drop = min(start - LOOKBACK - self.base, len(self.buffer))
+            if drop > CHUNKSIZE:
+                del self.buffer[:drop]
+                self.base += drop
+
+            if self.base + len(self.buffer) >= stop or self.eof:
+                break
+
+            chunk = self.stream.read(CHUNKSIZE)
+            if not chunk:
+                self.eof = True
+                self.size = self.base + len(self.buffer)
+                break
+            self.buffer += chunk
+
+        return(min(stop, self.base + len(self.buffer)))
+
+    def __len__(self):
+
+        #The size is only known once the whole file has been decompressed
+        while self.size is None:
+            end = self.base + len(self.buffer)
+            self.ensure(end, end + CHUNKSIZE)
+
+        return(self.size)
+
+    def __getitem__(self, key):
+
+        start, stop = key.start, key.stop
+        stop = self.ensure(start, stop)
+
+        return(bytes(self.buffer[start-self.base:stop-self.base]))
+
+    def find(self, sub, start, end=None):
+
+        position = start
+
+        while True:
+
+            available = self.ensure(position, position + CHUNKSIZE)
+            stop = available if end is None else min(end, available)
+
+            found = self.buffer.find(sub, position - self.base, stop - self.base)
+            if found != -1:
+                return(found + self.base)
+
+            #Stop at the end of the search or of the file
+            if stop == end or available < position + CHUNKSIZE:
+                return(-1)
+
+            #The next search overlaps with this one in case sub was cut in two
+            position = max(position, stop - len(sub) + 1)
+
+    def rfind(self, sub, start, end):
+
+        #This is only used to look a few lines back, so the window is searched first
+        windowstart = max(start, end - LOOKBACK)
+        self.ensure(windowstart, end)
+        found = self.buffer.rfind(sub, windowstart - self.base, end - self.base)
+
+        if found != -1 or windowstart == start:
+            return(found + self.base if found != -1 else -1)
+
+        self.ensure(start, end)
+        found = self.buffer.rfind(sub, start - self.base, end - self.base)
+
+        return(found + self.base if found != -1 else -1)
+
+class StreamRange(io.RawIOBase):
+
+    """
+    A read-only stream of the decompressed bytes between start and end of a StreamWindow,
+    which is what fileparser.BlockReader is for uncompressed star files.
+    """
+
+    def __init__(self, window, start, end):
+        self.window = window
+        self.position = start
+        self.end = end
+
+    def readable(self):
+        return(True)
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.end - self.position)
+        if size <= 0:
+            return(0)
+        stop = self.window.ensure(self.position, self.position + size)
+        size = stop - self.position
+        start = self.position - self.window.base
+        memoryview(buffer).cast("B")[:size] = self.window.buffer[start:start+size]
+        self.position += size
+        return(size)
+
+class ProcessWriter(io.RawIOBase):
+
+    """
+    A binary stream that writes to the input of a compression program (see openwrite()).
+    Closing it waits for the program to finish writing the file.
+    """
+
+    def __init__(self, process):
+        self.process = process
+
+    def writable(self):
+        return(True)
+
+    def write(self, data):
+        self.process.stdin.write(data)
+        return(len(data))
+
+    def close(self):
+        if not self.closed:
+            self.process.stdin.close()
+            if self.process.wait() != 0:
+                print("\n>> Error: could not compress the output star file.\n")
+                sys.exit()
+        super().close()
+
+def openwrite(outputname, buffersize):
+
+    """
+    Opens a star file for writing text. If its name ends with .zst or .gz, the text is compressed as it is written.
+    zstd compresses on all cores, and so does gzip if pigz is installed, so that compressing keeps up with writing.
+    """
+
+    if outputname.endswith(".zst"):
+        zstandard = importzstd()
+        compressor = zstandard.ZstdCompressor(level=3, threads=-1)
+        raw = compressor.stream_writer(open(outputname,mode='wb'), closefd=True)
+
+    elif outputname.endswith(".gz"):
+
+        pigz = shutil.which("pigz")
+
+        #Without pigz, gzip only compresses on one core, so the fastest level is used
+        if pigz is None:
+            return(io.TextIOWrapper(gzip.open(outputname, mode='wb', compresslevel=1), encoding="utf-8"))
+
+        with open(outputname,mode='wb') as file:
+            raw = ProcessWriter(subprocess.Popen([pigz, "-c", "-6"], stdin=subprocess.PIPE, stdout=file))
+
+    else:
+        return(open(outputname,"w",buffering=buffersize))
+
+    return(io.TextIOWrapper(io.BufferedWriter(raw, buffersize), encoding="utf-8"))
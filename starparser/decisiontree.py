@@ -1,5 +1,6 @@
 import sys
 import os.path
+import time
 import pandas as pd
 import matplotlib.pyplot as plt
 
@@ -7,6 +8,7 @@ from starparser import argparser
 from starparser import columnplay
 from starparser import fileparser
 from starparser import particleplay
+from starparser.particleplay import makefullname
 from starparser import plots
 from starparser import specialparticles
 from starparser import splits
@@ -32,25 +34,10 @@ def decide():
         print("\n>> Error: no filename entered. See the help page (-h).\n")
         sys.exit()
 
-    #Modify column name to be _rlnXXX regardless of the format input by the user (rln, _rln or no prefix)
-    if params["parser_column"] != "":
-        tempsplit = params["parser_column"].split("/")
-        for i,c in enumerate(tempsplit):
-            tempsplit[i] = makefullname(c)
-        params["parser_column"]='/'.join(tempsplit)
+    checkparams(params)
 
     print(params["parser_column"])
         
-    #This is a rare ocurance, but it's possible that the user asks to delete the _rlnOpticsGroup column as well as pass the --relegate option, which is redundant.
-    if "_rlnOpticsGroup" in params["parser_column"] and params["parser_relegate"]:
-        print("\n>> Error: cannot have the relegate option and the delete OpticsGroup column at the same time (the former will do the latter already).\n")
-        sys.exit()
-
-    #The output file types (--t) for plots are listed below, so any other file type will not work.
-    if params["parser_outtype"] not in ["png", "pdf", "jpg", "svg"]:
-        print("\n>> Error: choose between png, pdf, svg, and jpg for the plot filetype.\n")
-        sys.exit()
-        
     ##################################
     """
     The variables below are essential for all functions
@@ -90,6 +77,22 @@ def decide():
     are checked and the proper functions are called.
     """
     ##################################
+
+    """
+    --pipeline reads the star file once and runs the options in the recipe file on it one after the other.
+    """
+
+    if params["parser_pipeline"] != "":
+        runpipeline(params)
+        sys.exit()
+
+    """
+    --stream reads the particles a chunk at a time for the options that only need one row at a time.
+    """
+
+    if params["parser_stream"]:
+        runstream(params)
+        sys.exit()
     
     """
     --plot_class_iterations is checked first since the plotclassparts() function can be called
@@ -111,19 +114,56 @@ def decide():
 
     print("\n>> Reading " + filename)
 
+    """
+    --info and --count (without a query) only need the headers of the star file and the number of rows,
+    so the particles are counted without being read.
+    """
+
+    if params["parser_info"]:
+        printinfo(filename)
+        sys.exit()
+
+    if params["parser_countme"] and params["parser_column"] == "" and params["parser_query"] == "" and not params["parser_extractoptics"]:
+        totalparticles, metadata = fileparser.countparticles(filename, params["parser_optless"])
+        print('\n>> There are ' + str(totalparticles) + ' particles in total.\n')
+        sys.exit()
+
+    #Some options only need a few columns, in which case the others are not read (None means all columns are read)
+    projection = neededcolumns(params)
+
     #The --opticsless option requires the getparticles_dummyoptics function to insert
     #a fake optics table before moving on
     if params["parser_optless"]:
 
-        allparticles, metadata = fileparser.getparticles_dummyoptics(filename)
+        allparticles, metadata = fileparser.getparticles_dummyoptics(filename, columns=projection, cache=params["parser_cache"], workers=params["parser_threads"])
 
     ####
     #Most of the time, particles will be parsed normally below
     #The allparticles dataframe will be used in all main functions below
     else:
-        allparticles, metadata = fileparser.getparticles(filename)
+        allparticles, metadata = fileparser.getparticles(filename, columns=projection, cache=params["parser_cache"], workers=params["parser_threads"])
     ####
 
+    #Options that write a single star file return it to be written here
+    newparticles, newmetadata, relegateflag = runoperation(params, filename, allparticles, metadata)
+
+    fileparser.writestar(newparticles, newmetadata, params["parser_outname"], relegateflag)
+
+def runoperation(params, filename, allparticles, metadata):
+
+    """
+    Runs the option that was passed on the particles that were read from filename. Options that make a single star file
+    return its particles, metadata and whether it should be written without the optics table (relegateflag), so that
+    they can be chained by runpipeline(). The other options write their own outputs (or plots) and exit.
+    """
+
+    outtype = params["parser_outtype"]
+
+    #In the cases below, a subset of particles are generated from a query that must be exact, so the queryexact variable is forced to be True.
+    queryexact = params["parser_exact"] or params["parser_splitoptics"] or params["parser_splitclasses"]
+
+    #The query (--c/--q) is parsed once here and passed to the functions that make a subset from it (None if there is none)
+    subsetquery = particleplay.parsequery(params["parser_column"], params["parser_query"], queryexact)
 
     ##########
     """
@@ -138,10 +178,9 @@ def decide():
         if params["parser_column"] == "" or params["parser_query"] == "":
             print("\n>> Error: enter a column (--c) and query (--q) to extract.\n")
             sys.exit()
-        particles_extractedoptics, newmetadata, extractednumber = particleplay.extractoptics(allparticles, metadata, queryexact)
+        particles_extractedoptics, newmetadata, extractednumber = particleplay.extractoptics(allparticles, metadata, subsetquery)
         print(f"\n>> Extracted {extractednumber} out of {len(allparticles.index)} ({round(100*extractednumber/len(allparticles.index),1)}%) that matched the optics query.")
-        fileparser.writestar(particles_extractedoptics, newmetadata, params["parser_outname"], False)
-        sys.exit()
+        return(particles_extractedoptics, newmetadata, False)
 
     ##########
 
@@ -149,16 +188,10 @@ def decide():
     #various things later.
     totalparticles = len(allparticles.index)
     
-    #If a query was passed, then turn it into a list. Since queries are split by a slash, .split("/") creates the list for us
+    #If a query was passed, then turn it into a list. Since queries are split by a slash, splitquery() creates the list for us
     #Escape a / with a , preceding it (i.e. ,/).
-    #!!This needs to be updated in particleplay if change here!!
     if params["parser_query"] != "":
-        query = params["parser_query"]
-        escape = ",/"
-        query = str.replace(params["parser_query"],escape, ",")
-        query = query.split("/")
-        for i,q in enumerate(query):
-            query[i] = str.replace(q,",", "/")
+        query = particleplay.splitquery(params["parser_query"])
 
         #If no column was passed, the query can't be checked.
         if params["parser_column"] == "":
@@ -217,8 +250,7 @@ def decide():
             columns[i] = makefullname(c)
         newparticles, metadata = columnplay.delcolumn(allparticles, columns, metadata)
         print("\n>> Removed the columns " + str(columns))
-        fileparser.writestar(newparticles, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        return(newparticles, metadata, relegateflag)
 
     """
     --remove_particles
@@ -231,8 +263,7 @@ def decide():
         newparticles = particleplay.delparticles(allparticles, columns, query, queryexact)
         purgednumber = totalparticles - len(newparticles.index)
         print("\n>> Removed " + str(purgednumber) + " particles (out of " + str(totalparticles) + ", " + str(round(purgednumber*100/totalparticles,1)) + "%) that matched " + str(query) + " in the column " + params["parser_column"] + ".")
-        fileparser.writestar(newparticles, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        return(newparticles, metadata, relegateflag)
 
     """
     --remove_duplicates
@@ -248,54 +279,31 @@ def decide():
         newtotal = len(newparticles.index)
         print("\n>> Removed " + str(purgednumber) + " particles (out of " + str(totalparticles) + ", " + str(round(purgednumber*100/totalparticles,1)) + "%) that were duplicates based on the " + column + " column.")
         print(">> The new total is " + str(newtotal) + " particles.")
-        fileparser.writestar(newparticles, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        return(newparticles, metadata, relegateflag)
 
     """
     --remove_mics_list
     """
 
     if params["parser_delmics"]:
-        if params["parser_query"] != "" or params["parser_column"] != "":
-            print("\n>> Error: you cannot provide a query to the --remove_mics_fromlist option.\n")
-            sys.exit()
-        if params["parser_file2"] == "":
-            print("\n>> Error: provide a second file with --f to match micrographs.\n")
-            sys.exit()
         file2 = params["parser_file2"]
-        if not os.path.isfile(file2):
-            print("\n>> Error: \"" + file2 + "\" does not exist.\n")
-            sys.exit()
-        with open(file2) as f:
-            micstodelete = [line.split()[0] for line in f]
+        micstodelete = readmics(params, "--remove_mics_fromlist")
         newparticles = particleplay.delmics(allparticles,micstodelete)
         purgednumber = totalparticles - len(newparticles.index)
         print("\n>> Removed " + str(purgednumber) + " particles (out of " + str(totalparticles) + ", " + str(round(purgednumber*100/totalparticles,1)) + "%) that matched the micrographs in " + file2 + ".")
-        fileparser.writestar(newparticles, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        return(newparticles, metadata, relegateflag)
 
     """
     --keep_mics_list
     """
 
     if params["parser_keepmics"]:
-        if params["parser_query"] != "" or params["parser_column"] != "":
-            print("\n>> Error: you cannot provide a query to the --keep_mics_fromlist option.\n")
-            sys.exit()
-        if params["parser_file2"] == "":
-            print("\n>> Error: provide a second file with --f to match micrographs.\n")
-            sys.exit()
         file2 = params["parser_file2"]
-        if not os.path.isfile(file2):
-            print("\n>> Error: \"" + file2 + "\" does not exist.\n")
-            sys.exit()
-        with open(file2) as f:
-            micstokeep = [line.split()[0] for line in f]
+        micstokeep = readmics(params, "--keep_mics_fromlist")
         newparticles = particleplay.keepmics(allparticles,micstokeep)
         keptnumber = len(newparticles.index)
         print("\n>> Kept " + str(keptnumber) + " particles (out of " + str(totalparticles) + ", " + str(round(keptnumber*100/totalparticles,1)) + "%) that matched the micrographs in " + file2 + ".")
-        fileparser.writestar(newparticles, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        return(newparticles, metadata, relegateflag)
         
     """
     --swap_columns
@@ -314,13 +322,12 @@ def decide():
             sys.exit();
         print("\n>> Reading " + file2)
         if not params["parser_optless"]:
-            otherparticles, metadata2 = fileparser.getparticles(file2)
+            otherparticles, metadata2 = fileparser.getparticles(file2, workers=params["parser_threads"])
         else:
-            otherparticles, metadata2 = fileparser.getparticles_dummyoptics(file2)
+            otherparticles, metadata2 = fileparser.getparticles_dummyoptics(file2, workers=params["parser_threads"])
         swappedparticles = columnplay.swapcolumns(allparticles, otherparticles, columnstoswap)
         print("\n>> Swapped in " + str(columnstoswap) + " from " + file2)
-        fileparser.writestar(swappedparticles, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        return(swappedparticles, metadata, relegateflag)
 
     """
     --import_mic_values
@@ -336,9 +343,9 @@ def decide():
             sys.exit();
         print("\n>> Reading " + file2)
         if not params["parser_optless"]:
-            otherparticles, metadata2 = fileparser.getparticles(file2)
+            otherparticles, metadata2 = fileparser.getparticles(file2, workers=params["parser_threads"])
         else:
-            otherparticles, metadata2 = fileparser.getparticles_dummyoptics(file2)
+            otherparticles, metadata2 = fileparser.getparticles_dummyoptics(file2, workers=params["parser_threads"])
         columnstoimport = params["parser_importmicvalues"].split("/")
         for i,c in enumerate(columnstoimport):
             columnstoimport[i]=makefullname(c)
@@ -360,16 +367,9 @@ def decide():
 
         print("\n>> Importing " + str(columnstoimport) + " from " + file2)
 
-        """
-        It is inefficient to update the dataframe one column at a time
-        instead of doing them all at the same time. Consider revising.
-        """
-        importedparticles = allparticles.copy()
-        for column in columnstoimport:
-            importedparticles = particleplay.importmicvalues(importedparticles, otherparticles, column)
+        importedparticles = particleplay.importmicvalues(allparticles, otherparticles, columnstoimport)
 
-        fileparser.writestar(importedparticles, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        return(importedparticles, metadata, relegateflag)
 
     """
     --expand_optics
@@ -391,16 +391,15 @@ def decide():
             sys.exit();
         print("\n>> Reading " + file2)
         if not params["parser_optless"]:
-            newdata, newdata_metadata = fileparser.getparticles(file2)
+            newdata, newdata_metadata = fileparser.getparticles(file2, workers=params["parser_threads"])
         else:
-            newdata, newdata_metadata = fileparser.getparticles_dummyoptics(file2)
+            newdata, newdata_metadata = fileparser.getparticles_dummyoptics(file2, workers=params["parser_threads"])
 
         print("\n>> Expanding the optics group " + opticsgrouptoexpand + " based on the micrograph optics in " + file2)
         
         expandedparticles, newmetadata = particleplay.expandoptics(allparticles,metadata,newdata,newdata_metadata,opticsgrouptoexpand)
 
-        fileparser.writestar(expandedparticles, newmetadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        return(expandedparticles, newmetadata, relegateflag)
 
     """
     --import_particle_values
@@ -416,9 +415,9 @@ def decide():
             sys.exit();
         print("\n>> Reading " + file2)
         if not params["parser_optless"]:
-            otherparticles, metadata2 = fileparser.getparticles(file2)
+            otherparticles, metadata2 = fileparser.getparticles(file2, workers=params["parser_threads"])
         else:
-            otherparticles, metadata2 = fileparser.getparticles_dummyoptics(file2)
+            otherparticles, metadata2 = fileparser.getparticles_dummyoptics(file2, workers=params["parser_threads"])
         columnstoimport = params["parser_importpartvalues"].split("/")
         for i,c in enumerate(columnstoimport):
             columnstoimport[i] = makefullname(c)
@@ -442,9 +441,7 @@ def decide():
 
         importedparticles = particleplay.importpartvalues(allparticles, otherparticles, columnstoimport)
 
-        fileparser.writestar(importedparticles, metadata, params["parser_outname"], relegateflag)
-
-        sys.exit()
+        return(importedparticles, metadata, relegateflag)
 
     """
     --operate
@@ -452,38 +449,15 @@ def decide():
 
     if params["parser_operate"] != "":
 
-        #Check which operation is required by splitting, if the result is 2, then that was the operation
-        if len(params["parser_operate"].split("*")) == 2:
-            arguments = params["parser_operate"].split("*")
-            operator = "multiply"
-        elif len(params["parser_operate"].split("/")) == 2:
-            arguments = params["parser_operate"].split("/")
-            operator = "divide"
-        elif len(params["parser_operate"].split("+")) == 2:
-            arguments = params["parser_operate"].split("+")
-            operator = "add"
-        elif len(params["parser_operate"].split("-")) == 2:
-            arguments = params["parser_operate"].split("-")
-            operator = "subtract"
-        else:
-            print("\n>> Error: the argument to pass is column[operator]value (e.g. _rlnHelicalTrackLength*0.25).\n")
-            sys.exit()
-        column, value = arguments
-        column = makefullname(column)
-        try:    
-            value = float(value)
-        except ValueError:
-            print("\n>> Error: Could not interpret \"" + value + "\" as numeric.\n")
-            sys.exit()
+        column, operator, value = parseoperate(params)
+
         if column not in allparticles:
             print("\n>> Error: Could not find the column " + column + " in the star file.\n")
             sys.exit()
 
         operatedparticles = columnplay.operate(allparticles,column,operator,value)
 
-        fileparser.writestar(operatedparticles, metadata, params["parser_outname"], relegateflag)
-
-        sys.exit()
+        return(operatedparticles, metadata, relegateflag)
 
     """
     --operate_columns
@@ -531,9 +505,7 @@ def decide():
 
         operatedparticles, newmetadata = columnplay.operatecolumns(allparticles,column1,column2,newcolumn,operator,metadata)
 
-        fileparser.writestar(operatedparticles, newmetadata, params["parser_outname"], relegateflag)
-
-        sys.exit()
+        return(operatedparticles, newmetadata, relegateflag)
 
     """
     --find_shared
@@ -553,9 +525,9 @@ def decide():
             sys.exit();
         print("\n>> Reading " + file2)
         if not params["parser_optless"]:
-            otherparticles, f2metadata = fileparser.getparticles(file2)
+            otherparticles, f2metadata = fileparser.getparticles(file2, workers=params["parser_threads"])
         else:
-            otherparticles, f2metadata = fileparser.getparticles_dummyoptics(file2)
+            otherparticles, f2metadata = fileparser.getparticles_dummyoptics(file2, workers=params["parser_threads"])
         unsharedparticles = allparticles[~allparticles[columntocheckunique].isin(otherparticles[columntocheckunique])]
         sharedparticles = allparticles[allparticles[columntocheckunique].isin(otherparticles[columntocheckunique])]
         
@@ -583,13 +555,12 @@ def decide():
             sys.exit();
         print("\n>> Reading " + file2)
         if not params["parser_optless"]:
-            otherparticles, f2metadata = fileparser.getparticles(file2)
+            otherparticles, f2metadata = fileparser.getparticles(file2, workers=params["parser_threads"])
         else:
-            otherparticles, f2metadata = fileparser.getparticles_dummyoptics(file2)
+            otherparticles, f2metadata = fileparser.getparticles_dummyoptics(file2, workers=params["parser_threads"])
         matchedparticles = allparticles[allparticles["_rlnMicrographName"].isin(otherparticles["_rlnMicrographName"])]
         print("\n>> Kept " + str(len(set(matchedparticles["_rlnMicrographName"].tolist()))) + " micrographs that matched the second file (out of " + str(len(set(allparticles["_rlnMicrographName"].tolist()))) + ").\n")
-        fileparser.writestar(matchedparticles, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        return(matchedparticles, metadata, relegateflag)
 
     """
     --extract_if_nearby
@@ -609,13 +580,13 @@ def decide():
 
         print("\n>> Reading " + params["parser_file2"])
         if not params["parser_optless"]:
-            nearparticles, nearmetadata = fileparser.getparticles(params["parser_file2"])
+            nearparticles, nearmetadata = fileparser.getparticles(params["parser_file2"], workers=params["parser_threads"])
         else:
-            nearparticles, nearmetadata = fileparser.getparticles_dummyoptics(params["parser_file2"])
+            nearparticles, nearmetadata = fileparser.getparticles_dummyoptics(params["parser_file2"], workers=params["parser_threads"])
 
         print("\n>> Creating subsets with particles that are closer/further than " + str(threshdist) + " pixels from the closest particle in the second star file.")
 
-        farparticles, closeparticles, distances = specialparticles.findnearby(allparticles, nearparticles, threshdist)
+        farparticles, closeparticles, distances = specialparticles.findnearby(allparticles, nearparticles, threshdist, params["parser_threads"])
 
         fig = plt.figure()
         plt.hist(distances, bins='fd', color = 'k', alpha=0.5)
@@ -660,17 +631,16 @@ def decide():
             sys.exit();
         print("\n>> Reading " + params["parser_file2"])
         if not params["parser_optless"]:
-            nearparticles, nearmetadata = fileparser.getparticles(params["parser_file2"])
+            nearparticles, nearmetadata = fileparser.getparticles(params["parser_file2"], workers=params["parser_threads"])
         else:
-            nearparticles, nearmetadata = fileparser.getparticles_dummyoptics(params["parser_file2"])
+            nearparticles, nearmetadata = fileparser.getparticles_dummyoptics(params["parser_file2"], workers=params["parser_threads"])
         for c in columnstoretrieve:
             if c not in nearparticles:
                 print("\n>> Error: " + c + " does not exist in the second star file.\n")
                 sys.exit()
         print("\n>> Fetching " + str(columnstoretrieve) + " values from particles within " + str(threshdist) + " pixels.\n")
-        stolenparticles = specialparticles.fetchnearby(allparticles, nearparticles, threshdist, columnstoretrieve)
-        fileparser.writestar(stolenparticles, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        stolenparticles = specialparticles.fetchnearby(allparticles, nearparticles, threshdist, columnstoretrieve, params["parser_threads"])
+        return(stolenparticles, metadata, relegateflag)
 
     """
     --extract_cluster
@@ -684,10 +654,9 @@ def decide():
         threshold = float(retrieveparams[0])
         minimum = int(retrieveparams[1])
         print("\n>> Extracting particles that have at least " + str(minimum) + " neighbors within " + str(threshold) + " pixels.\n")
-        clusterparticles = specialparticles.getcluster(allparticles, threshold,minimum)
+        clusterparticles = specialparticles.getcluster(allparticles, threshold, minimum, params["parser_threads"])
         print(">> Removed " + str(len(allparticles.index)-len(clusterparticles.index)) + " that did not match the criteria (" + str(len(clusterparticles.index)) + " remaining out of " + str(len(allparticles.index)) + ").")
-        fileparser.writestar(clusterparticles, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        return(clusterparticles, metadata, relegateflag)
 
 
     """
@@ -697,10 +666,10 @@ def decide():
     if params["parser_exractmin"] != -1:
         extractmin = params["parser_exractmin"]
         print("\n>> Extracting particles that belong to micrographs with at least " + str(extractmin) + " particles.\n")
-        particlesfrommin = specialparticles.extractwithmin(allparticles, extractmin)
+        countsname = "Micrograph_counts.txt" if params["parser_miccounts"] else None
+        particlesfrommin = specialparticles.extractwithmin(allparticles, extractmin, countsname)
         print(">> Removed " + str(len(allparticles.index)-len(particlesfrommin.index)) + " that did not match the criteria (" + str(len(particlesfrommin.index)) + " remaining out of " + str(len(allparticles.index)) + ").")
-        fileparser.writestar(particlesfrommin, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        return(particlesfrommin, metadata, relegateflag)
 
 
 
@@ -724,30 +693,20 @@ def decide():
     if params["parser_newoptics"] !="":
         newgroup = params["parser_newoptics"]
         newoptics, opticsnumber = particleplay.makeopticsgroup(allparticles,metadata,newgroup)
-        metadata[2] = newoptics
+        metadata = metadata.replace(optics=newoptics)
         if params["parser_column"] == "" or params["parser_query"] == "":
             print("\n>> Error: you did not enter either an optics group name, column name, or query(ies).\n")
             sys.exit()
         particlesnewoptics, newopticsnumber = particleplay.setparticleoptics(allparticles,columns,query,queryexact,str(opticsnumber))
         print("\n>> Created optics group called " + newgroup + " (optics group " + str(opticsnumber)+") for the " + str(newopticsnumber) + " particles that match " + str(query) + " in the column " + str(columns))
-        fileparser.writestar(particlesnewoptics,metadata,params["parser_outname"],False)
-        sys.exit()
+        return(particlesnewoptics,metadata, False)
 
     """
     --limit
     """
 
     if params["parser_limitparticles"] != "":
-        parsedinput = params["parser_limitparticles"].split("/")
-        if len(parsedinput) != 3:
-            print("\n>> Error: provide argument in this format: column/operator/value (e.g. _rlnDefocusU/lt/40000).\n")
-            sys.exit()
-        columntocheck = makefullname(parsedinput[0])
-        operator = parsedinput[1]
-        limit = float(parsedinput[2])
-        if operator not in ["lt", "gt", "le", "ge"]:
-            print("\n>> Error: use \"lt\" (less than), \"gt\" (greater than), \"le\" (less than or equal to), or \"ge\" (greater than or equal to) as the operator.\n")
-            sys.exit()
+        columntocheck, operator, limit = parselimit(params)
         limitedparticles = particleplay.limitparticles(allparticles, columntocheck, limit, operator)
         if operator == "lt":
             print("\n>> Extracted " + str(len(limitedparticles.index)) + " particles (out of " + str(totalparticles) + ", " + str(round(len(limitedparticles.index)*100/totalparticles,1)) + "%) that have " + str(columntocheck) + " values less than " + str(limit))
@@ -757,8 +716,7 @@ def decide():
             print("\n>> Extracted " + str(len(limitedparticles.index)) + " particles (out of " + str(totalparticles) + ", " + str(round(len(limitedparticles.index)*100/totalparticles,1)) + "%) that have " + str(columntocheck) + " values less than or equal to " + str(limit))
         elif operator == "ge":
             print("\n>> Extracted " + str(len(limitedparticles.index)) + " particles (out of " + str(totalparticles) + ", " + str(round(len(limitedparticles.index)*100/totalparticles,1)) + "%) that have " + str(columntocheck) + " values greater than or equal to " + str(limit))
-        fileparser.writestar(limitedparticles, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        return(limitedparticles, metadata, relegateflag)
 
     """
     --extract_random
@@ -772,7 +730,7 @@ def decide():
             print("\n>> Error: the number of particles you want to randomly extract cannot be greater than the total number of particles (" + str(totalparticles) + ").\n")
         if params["parser_column"] == "" and params["parser_query"] == "":
             print("\n>> Creating a random set of " + str(numrandom) + " particles.")
-            fileparser.writestar(allparticles.sample(n = numrandom), metadata, params["parser_outname"], relegateflag)
+            return(allparticles.sample(n = numrandom), metadata, relegateflag)
         elif params["parser_column"] == "" or params["parser_query"] == "":
             print("\n>> Error: check that you have passed the column and query arguments correctly.\n")
         else:
@@ -804,7 +762,9 @@ def decide():
         fill = len(str(len(splitstars)))
         for i,s in enumerate(splitstars):
             print(">> There are " + str(len(s.index)) + " particles in file " + str(i+1))
-            fileparser.writestar(s, metadata, filename[:-5]+"_split-"+str(i+1).zfill(fill)+".star", relegateflag)
+        print("")
+        outputnames = [filename[:-5]+"_split-"+str(i+1).zfill(fill)+".star" for i in range(len(splitstars))]
+        splits.writeparts(splitstars, metadata, outputnames, relegateflag, params["parser_threads"])
         sys.exit()
 
     """
@@ -840,7 +800,7 @@ def decide():
             print("\n>> Error: the index " + str(max(indicestoget)+1) + " is out of bounds (the last index in your star file is " + str(totalparticles) + ").\n")
             sys.exit()
         print("\n>> Extracting " + str(len(indicestoget)) + " particles (" + str(round(100*len(indicestoget)/totalparticles,1)) + "%) that match the indices.")
-        fileparser.writestar(allparticles.iloc[indicestoget], metadata, params["parser_outname"], relegateflag)
+        return(allparticles.iloc[indicestoget], metadata, relegateflag)
         sys.exit()   
 
     """
@@ -862,10 +822,8 @@ def decide():
             print("\n>> Error: your star file has " + str(totalparticles) + " values while your second file has " + str(len(newcolvalues)) + " values.\n")
             sys.exit()
         print("\n>> Creating the column " + insertcol + " with the values in " + newcolfile + ".")
-        allparticles[insertcol]=newcolvalues
-        metadata[3].append(insertcol)
-        fileparser.writestar(allparticles, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        metadata = metadata.withcolumn(insertcol)
+        return(allparticles.assign(**{insertcol: newcolvalues}), metadata, relegateflag)
 
     """
     --insert_optics_column
@@ -880,10 +838,8 @@ def decide():
         new_header = makefullname(new_header)
         print("\n Creating the column " + new_header + " in the optics table with the value " + value)
 
-        metadata[2][new_header]=value
-        metadata[1].append(new_header)
-        fileparser.writestar(allparticles, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        metadata = metadata.replace(optics=metadata.optics.assign(**{new_header: value}), opticsheaders=metadata.opticsheaders + [new_header])
+        return(allparticles, metadata, relegateflag)
 
     """
     --remove_poses
@@ -903,9 +859,9 @@ def decide():
         else:
             print("\n>> Reading " + params["parser_file2"])
             if not params["parser_optless"]:
-                file2particles, metadata = fileparser.getparticles(params["parser_file2"])
+                file2particles, metadata = fileparser.getparticles(params["parser_file2"], workers=params["parser_threads"])
             else:
-                file2particles, metadata = fileparser.getparticles_dummyoptics(params["parser_file2"])
+                file2particles, metadata = fileparser.getparticles_dummyoptics(params["parser_file2"], workers=params["parser_threads"])
         currentparams = params["parser_comparecoords"].split("/")
         numtoplot = currentparams[0]
         if numtoplot in ["all", "All", "ALL"]:
@@ -960,8 +916,7 @@ def decide():
             sys.exit()
         print("\n>> Replacing values in the column " + replacecol + " with those in " + newcolfile + ".")
         replacedstar = columnplay.replacecolumn(allparticles,replacecol,newcol)
-        fileparser.writestar(replacedstar, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        return(replacedstar, metadata, relegateflag)
 
     """
     --copy_column
@@ -979,9 +934,8 @@ def decide():
         if sourcecol not in allparticles:
             print("\n>> Error: " + sourcecol + " does not exist in the star file.\n")
             sys.exit()
-        copiedstar = columnplay.copycolumn(allparticles,sourcecol,targetcol,metadata)
-        fileparser.writestar(copiedstar, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        copiedstar, metadata = columnplay.copycolumn(allparticles,sourcecol,targetcol,metadata)
+        return(copiedstar, metadata, relegateflag)
 
     """
     --reset_column
@@ -989,18 +943,12 @@ def decide():
 
     if params["parser_resetcol"] != "":
 
-        inputparams = params["parser_resetcol"].split("/")
-        if len(inputparams) != 2:
-            print("\n>> Error: the input should be column-name/value.\n")
-            sys.exit()
-        columntoreset, value = inputparams
-        columntoreset = makefullname(columntoreset)
+        columntoreset, value = parsereset(params)
         if columntoreset not in allparticles:
             print("\n>> Error: " + columntoreset + " does not exist in the star file.\n")
             sys.exit()
         resetstar = columnplay.resetcolumn(allparticles,columntoreset,value)
-        fileparser.writestar(resetstar, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        return(resetstar, metadata, relegateflag)
 
     """
     --sort_by
@@ -1022,7 +970,7 @@ def decide():
             except ValueError:
                 pass
             print("\n>> Sorted particles by the column " + sortcol + " assuming the column contains text.")
-            fileparser.writestar(allparticles.sort_values(by=sortcol), metadata, params["parser_outname"], relegateflag)
+            return(allparticles.sort_values(by=sortcol), metadata, relegateflag)
 
         elif inputparams[1] == "s":
             try:
@@ -1033,7 +981,7 @@ def decide():
             except ValueError:
                 pass
             print("\n>> Sorted particles by the column " + sortcol + " assuming the column contains text.")
-            fileparser.writestar(allparticles.sort_values(by=sortcol), metadata, params["parser_outname"], relegateflag)
+            return(allparticles.sort_values(by=sortcol), metadata, relegateflag)
 
         elif inputparams[1] == "n":
             try:
@@ -1041,9 +989,8 @@ def decide():
             except ValueError:
                 print("\n>> Error: it looks like this column is NOT numeric but you specified that it is.\n")
                 sys.exit()
-            allparticles[sortcol] = allparticles[sortcol].apply(pd.to_numeric)
             print("\n>> Sorted particles by the column " + sortcol + " assuming the column contains numeric values.")
-            fileparser.writestar(allparticles.sort_values(by=sortcol), metadata, params["parser_outname"], relegateflag)
+            return(allparticles.sort_values(by=sortcol, key=pd.to_numeric), metadata, relegateflag)
 
         else:
             print("\n>> Error: type \"n\" after the slash to specify that it is numeric.\n")
@@ -1064,11 +1011,10 @@ def decide():
             sys.exit()
         print("\n>> Reading " + file2)
         if not params["parser_optless"]:
-            otherparticles, newmetadata = fileparser.getparticles(file2)
+            otherparticles, newmetadata = fileparser.getparticles(file2, workers=params["parser_threads"])
         else:
-            otherparticles, newmetadata = fileparser.getparticles_dummyoptics(file2)
-        fileparser.writestar(allparticles, [metadata[0],newmetadata[1],newmetadata[2],metadata[3],metadata[4]], params["parser_outname"], relegateflag)
-        sys.exit()
+            otherparticles, newmetadata = fileparser.getparticles_dummyoptics(file2, workers=params["parser_threads"])
+        return(allparticles, metadata.replace(opticsheaders=newmetadata.opticsheaders, optics=newmetadata.optics), relegateflag)
 
 
     ############
@@ -1079,10 +1025,7 @@ def decide():
     ############
 
     """
-    Create the subset of particles particles2use from allparticles
-    At the moment, checksubset() only takes in the particles and the queryexact variable,
-    while the column and queries are re-processed within checksubset(). This is inefficient
-    and should be revised.
+    Create the subset of particles particles2use from allparticles with the query that was parsed above.
     checksubset() returns the original particles if no query exists, so sometimes particles2use
     will be equivalent to allparticles
     """
@@ -1092,13 +1035,13 @@ def decide():
     if relegateflag and not params["parser_optless"]:
         if "_rlnOpticsGroup" in allparticles.columns:
                 newparticles, metadata = columnplay.delcolumn(allparticles, ["_rlnOpticsGroup"], metadata)
-                metadata[0] = ["#","version","30000"]
+                metadata = metadata.replace(version=["#","version","30000"])
                 print("\n>> Removed the _rlnOpticsGroup column and Optics table.")
-                particles2use = particleplay.checksubset(newparticles, queryexact)
+                particles2use = particleplay.checksubset(newparticles, subsetquery)
         else:
-            particles2use = particleplay.checksubset(allparticles, queryexact)
+            particles2use = particleplay.checksubset(allparticles, subsetquery)
     else:      
-        particles2use = particleplay.checksubset(allparticles, queryexact)
+        particles2use = particleplay.checksubset(allparticles, subsetquery)
     
     """
     --extract
@@ -1108,8 +1051,7 @@ def decide():
         if params["parser_column"] == "" or params["parser_query"] == "":
             print("\n>> Error: enter a column (--c) and query (--q) to extract.\n")
             sys.exit()
-        fileparser.writestar(particles2use, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        return(particles2use, metadata, relegateflag)
 
     """
     --count_mics
@@ -1176,8 +1118,7 @@ def decide():
         numpergroup = params["parser_regroup"]
         regroupedparticles, numgroups = particleplay.regroup(particles2use, numpergroup)
         print("\n>> Regrouped: " + str(numpergroup) + " particles per group with similar defocus values (" + str(numgroups) + " groups in total).")
-        fileparser.writestar(regroupedparticles, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        return(regroupedparticles, metadata, relegateflag)
 
 
     """
@@ -1187,24 +1128,459 @@ def decide():
 
     #This has to be at the end so it only runs if it is the only passed argument.
     if relegateflag and not params["parser_optless"]:
-        fileparser.writestar(particles2use, metadata, params["parser_outname"], relegateflag)
-        sys.exit()
+        return(particles2use, metadata, relegateflag)
 
     #The end.
     print("\n>> Error: either the options weren't passed correctly or none were passed at all. See the help page (-h).\n")
+    sys.exit()
+
+
+def readmics(params, option):
+
+    """
+    Returns the micrographs listed in the file passed with --f (the first word of every line) for --remove_mics_list
+    and --keep_mics_list, which are named option in the errors.
+    """
+
+    if params["parser_query"] != "" or params["parser_column"] != "":
+        print("\n>> Error: you cannot provide a query to the " + option + " option.\n")
+        sys.exit()
+    if params["parser_file2"] == "":
+        print("\n>> Error: provide a second file with --f to match micrographs.\n")
+        sys.exit()
+    file2 = params["parser_file2"]
+    if not os.path.isfile(file2):
+        print("\n>> Error: \"" + file2 + "\" does not exist.\n")
+        sys.exit()
+    with open(file2) as f:
+        mics = [line.split()[0] for line in f]
+
+    return(mics)
+
+def parseoperate(params):
+
+    """
+    Returns the column, the operator (multiply, divide, add or subtract) and the value passed with --operate.
+    """
+
+    #Check which operation is required by splitting, if the result is 2, then that was the operation
+    if len(params["parser_operate"].split("*")) == 2:
+        arguments = params["parser_operate"].split("*")
+        operator = "multiply"
+    elif len(params["parser_operate"].split("/")) == 2:
+        arguments = params["parser_operate"].split("/")
+        operator = "divide"
+    elif len(params["parser_operate"].split("+")) == 2:
+        arguments = params["parser_operate"].split("+")
+        operator = "add"
+    elif len(params["parser_operate"].split("-")) == 2:
+        arguments = params["parser_operate"].split("-")
+        operator = "subtract"
+    else:
+        print("\n>> Error: the argument to pass is column[operator]value (e.g. _rlnHelicalTrackLength*0.25).\n")
+        sys.exit()
+    column, value = arguments
+    column = makefullname(column)
+    try:    
+        value = float(value)
+    except ValueError:
+        print("\n>> Error: Could not interpret \"" + value + "\" as numeric.\n")
+        sys.exit()
+
+    return(column, operator, value)
+
+def parselimit(params):
+
+    """
+    Returns the column, the operator (lt, gt, le or ge) and the limit passed with --limit.
+    """
+
+    parsedinput = params["parser_limitparticles"].split("/")
+    if len(parsedinput) != 3:
+        print("\n>> Error: provide argument in this format: column/operator/value (e.g. _rlnDefocusU/lt/40000).\n")
+        sys.exit()
+    columntocheck = makefullname(parsedinput[0])
+    operator = parsedinput[1]
+    limit = float(parsedinput[2])
+    if operator not in ["lt", "gt", "le", "ge"]:
+        print("\n>> Error: use \"lt\" (less than), \"gt\" (greater than), \"le\" (less than or equal to), or \"ge\" (greater than or equal to) as the operator.\n")
+        sys.exit()
+
+    return(columntocheck, operator, limit)
+
+def parsereset(params):
+
+    """
+    Returns the column and the value passed with --reset_column.
+    """
 
+    inputparams = params["parser_resetcol"].split("/")
+    if len(inputparams) != 2:
+        print("\n>> Error: the input should be column-name/value.\n")
+        sys.exit()
+    columntoreset, value = inputparams
+
+    return(makefullname(columntoreset), value)
+
+def checkparams(params):
 
-def makefullname(col):
-    if col.startswith("_rln"):
-        return(col)
-    elif col.startswith("rln"):
-        return("_"+col)
-    elif col.startswith("_rn") or col.startswith("rn"):
-        print(f"\n>> Error: check the column name {col}.\n")
+    """
+    Checks the options that every operation relies on and turns the column names passed with --c into full names.
+    This is done for the command line and for every stage of a pipeline (see runpipeline()).
+    """
+
+    #Modify column name to be _rlnXXX regardless of the format input by the user (rln, _rln or no prefix)
+    if params["parser_column"] != "":
+        tempsplit = params["parser_column"].split("/")
+        for i,c in enumerate(tempsplit):
+            tempsplit[i] = makefullname(c)
+        params["parser_column"]='/'.join(tempsplit)
+
+    #This is a rare ocurance, but it's possible that the user asks to delete the _rlnOpticsGroup column as well as pass the --relegate option, which is redundant.
+    if "_rlnOpticsGroup" in params["parser_column"] and params["parser_relegate"]:
+        print("\n>> Error: cannot have the relegate option and the delete OpticsGroup column at the same time (the former will do the latter already).\n")
         sys.exit()
-    elif col.startswith("rn") and not col.startswith("rln"):
-        print(f"\n>> Error: check the column name {col}.\n")
+
+    #At least one thread is needed to read the star file (--j)
+    if params["parser_threads"] < 1:
+        print("\n>> Error: the number of threads (--j) has to be at least 1.\n")
+        sys.exit()
+
+    #The output file types (--t) for plots are listed below, so any other file type will not work.
+    if params["parser_outtype"] not in ["png", "pdf", "jpg", "svg"]:
+        print("\n>> Error: choose between png, pdf, svg, and jpg for the plot filetype.\n")
+        sys.exit()
+
+"""
+The options that can be passed with --pipeline on the command line (the others go in the recipe file), the options
+that can be passed along with an option in a line of the recipe file, and the options that make a single star file
+(see runoperation()), which are the only ones that can be followed by another line
+"""
+PIPELINEGLOBALS = ["file", "parser_outname", "parser_outtype", "parser_optless", "parser_cache", "parser_threads", "parser_pipeline"]
+STAGEMODIFIERS = ["parser_file2", "parser_column", "parser_query", "parser_exact", "parser_relegate", "parser_miccounts"]
+PIPELINEOPTIONS = ["parser_delcolumn", "parser_delparticles", "parser_delduplicates", "parser_delmics", "parser_keepmics",
+    "parser_swapcolumns", "parser_importmicvalues", "parser_expandoptics", "parser_importpartvalues", "parser_operate",
+    "parser_operatecolumns", "parser_matchmics", "parser_fetchnearby", "parser_cluster", "parser_exractmin",
+    "parser_newoptics", "parser_limitparticles", "parser_randomset", "parser_getindex", "parser_insertcol",
+    "parser_insertopticscol", "parser_replacecol", "parser_copycol", "parser_resetcol", "parser_sort",
+    "parser_swapoptics", "parser_regroup", "parser_relegate", "parser_extractparticles", "parser_extractoptics"]
+
+"""
+Options that can't be in a recipe file since they don't read the particles
+"""
+NOPIPELINEOPTIONS = ["parser_classiterations", "parser_info"]
+
+def runpipeline(params):
+
+    """
+    Runs the lines of the recipe file passed with --pipeline on the star file one after the other, so that it is only
+    read and written once. Every line has the options of one command (see argparser.parseline()), and every line but the
+    last has to make a single star file that is passed on to the next one. The last line can be any option (e.g. --split).
+    """
+
+    recipe = params["parser_pipeline"]
+
+    if not os.path.isfile(recipe):
+        print("\n>> Error: \"" + recipe + "\" does not exist.\n")
+        sys.exit()
+
+    for o in argparser.passedoptions(params):
+        if o not in PIPELINEGLOBALS:
+            print("\n>> Error: only --i, --o, --t, --j, --cache and --opticsless can be passed with --pipeline. The other options go in the recipe file.\n")
+            sys.exit()
+
+    with open(recipe) as f:
+        lines = [line.strip() for line in f]
+    lines = [line for line in lines if line != "" and not line.startswith("#")]
+
+    if not lines:
+        print("\n>> Error: there are no options in " + recipe + ".\n")
         sys.exit()
+
+    #Every line is checked before the star file is read
+    stages = []
+
+    for i,line in enumerate(lines):
+
+        stage = argparser.parseline(line)
+        passed = argparser.passedoptions(stage)
+
+        for o in passed:
+            if o in PIPELINEGLOBALS:
+                print("\n>> Error: pass --i, --o, --t, --j, --cache and --opticsless on the command line rather than in the recipe file (\"" + line + "\").\n")
+                sys.exit()
+
+        for o in PIPELINEGLOBALS:
+            stage[o] = params[o]
+
+        checkparams(stage)
+
+        operations = [o for o in passed if o not in STAGEMODIFIERS]
+        if not operations and "parser_relegate" in passed:
+            operations = ["parser_relegate"]
+
+        if len(operations) != 1:
+            print("\n>> Error: every line of the recipe file should have one option (\"" + line + "\").\n")
+            sys.exit()
+
+        operation = operations[0]
+
+        if operation in NOPIPELINEOPTIONS:
+            print("\n>> Error: \"" + line + "\" can't be used in a pipeline.\n")
+            sys.exit()
+
+        if i != len(lines)-1 and (operation not in PIPELINEOPTIONS or (operation == "parser_randomset" and stage["parser_query"] != "")):
+            print("\n>> Error: \"" + line + "\" doesn't make a single star file, so it can only be the last line of the recipe file.\n")
+            sys.exit()
+
+        stages.append(stage)
+
+    filename = params["file"]
+
+    print("\n>> Reading " + filename)
+
+    start = time.perf_counter()
+
+    if params["parser_optless"]:
+        particles, metadata = fileparser.getparticles_dummyoptics(filename, cache=params["parser_cache"], workers=params["parser_threads"])
     else:
-        return("_rln"+col)
+        particles, metadata = fileparser.getparticles(filename, cache=params["parser_cache"], workers=params["parser_threads"])
+
+    timings = [("Read " + filename, time.perf_counter() - start, len(particles.index))]
+
+    #The optics table is left out if any of the lines asked for it (or if there was none)
+    relegated = params["parser_optless"]
+
+    for i,(line,stage) in enumerate(zip(lines, stages)):
+
+        print("\n>> Line " + str(i+1) + " of " + str(len(lines)) + ": " + line)
+
+        before = len(particles.index)
+        start = time.perf_counter()
+
+        #Options that write their own output (e.g. --split) end the run, which can only happen on the last line.
+        #The time it took is reported along with the earlier lines before the run ends (also if a line ends with an error).
+        try:
+            particles, metadata, relegateflag = runoperation(stage, filename, particles, metadata)
+        except SystemExit:
+            timings.append((line, time.perf_counter() - start, None))
+            print(">> Line " + str(i+1) + " took " + f"{timings[-1][1]:.2f}" + " s.\n")
+            printtimings(timings)
+            raise
+
+        relegated = relegated or relegateflag
+
+        timings.append((line, time.perf_counter() - start, len(particles.index)))
+
+        print(">> Line " + str(i+1) + " took " + f"{timings[-1][1]:.2f}" + " s (" + str(before) + " -> " + str(len(particles.index)) + " particles).")
+
+    print("")
+
+    start = time.perf_counter()
+    fileparser.writestar(particles, metadata, params["parser_outname"], relegated)
+    timings.append(("Write " + params["parser_outname"], time.perf_counter() - start, len(particles.index)))
+
+    printtimings(timings)
+
+def printtimings(timings):
+
+    """
+    Prints the summary of a pipeline (see runpipeline()) from the name, the time taken and the number of particles
+    left after every step. The number of particles is None for a last line that wrote its own output.
+    """
+
+    print(">> Pipeline summary:\n")
+    for name, seconds, total in timings:
+        total = "-" if total is None else total
+        print(f"   {seconds:8.2f} s {total:>12} particles   {name}")
+    print("")
+
+"""
+The options that only need one row at a time and can be run with --stream, and the options that can be passed along with them
+"""
+STREAMOPTIONS = ["parser_limitparticles", "parser_extractparticles", "parser_delparticles", "parser_delmics", "parser_keepmics",
+    "parser_resetcol", "parser_operate"]
+STREAMEXTRAS = ["file", "parser_column", "parser_query", "parser_exact", "parser_file2", "parser_relegate", "parser_outname",
+    "parser_optless", "parser_threads", "parser_stream"]
+
+def runstream(params, rows=fileparser.STREAMROWS):
+
+    """
+    Runs one of the STREAMOPTIONS, or --relegate on its own, with fileparser.streamstar() (see --stream). The particles are
+    read rows at a time and the ones that are kept are written straight away, so the memory that is used doesn't grow
+    with the size of the star file. The star file that is written is the same as without --stream, except that
+    --operate and --limit always use float64 values. Without --stream, a column whose values all fit in float32 is
+    converted to float32, but that can't be known for the whole column from a chunk of it.
+    """
+
+    filename = params["file"]
+    outname = params["parser_outname"]
+
+    passed = argparser.passedoptions(params)
+
+    for o in passed:
+        if o not in STREAMOPTIONS and o not in STREAMEXTRAS:
+            print("\n>> Error: only --limit, --extract, --remove_particles, --remove_mics_list, --keep_mics_list, --reset_column, --operate and --relegate can be used with --stream.\n")
+            sys.exit()
+
+    operations = [o for o in passed if o in STREAMOPTIONS]
+
+    if len(operations) > 1 or (not operations and (not params["parser_relegate"] or params["parser_optless"])):
+        print("\n>> Error: pass one of the options that can be used with --stream. See the help page (-h).\n")
+        sys.exit()
+
+    operation = operations[0] if operations else "parser_relegate"
+
+    #The star file is still being read while the output is written, so it can't be written over
+    if os.path.exists(outname) and os.path.samefile(filename, outname):
+        print("\n>> Error: the output star file (--o) has to be different from the input with --stream.\n")
+        sys.exit()
+
+    if params["parser_query"] != "" and params["parser_column"] == "":
+        print("\n>> Error: pass a column with --c for the query to be checked.\n")
+        sys.exit()
+
+    subsetquery = particleplay.parsequery(params["parser_column"], params["parser_query"], params["parser_exact"])
+
+    #The columns that have to be in the star file
+    needed = subsetquery.columns if subsetquery is not None else []
+
+    if operation in ["parser_extractparticles", "parser_delparticles"] and subsetquery is None:
+        print("\n>> Error: provide a column (--c) and query (--q) to find the particles.\n")
+        sys.exit()
+    elif operation == "parser_limitparticles":
+        column, operator, value = parselimit(params)
+        needed = [column]
+    elif operation == "parser_operate":
+        column, operator, value = parseoperate(params)
+        needed = [column]
+    elif operation == "parser_resetcol":
+        column, value = parsereset(params)
+        needed = [column]
+    elif operation == "parser_delmics":
+        mics = readmics(params, "--remove_mics_fromlist")
+        needed = ["_rlnMicrographName"]
+    elif operation == "parser_keepmics":
+        mics = readmics(params, "--keep_mics_fromlist")
+        needed = ["_rlnMicrographName"]
+
+    relegateflag = params["parser_optless"] or params["parser_relegate"]
+
+    #Like runoperation(), --extract and --relegate on its own also remove the _rlnOpticsGroup column when relegating
+    dropoptics = params["parser_relegate"] and not params["parser_optless"] and operation in ["parser_extractparticles", "parser_relegate"]
+
+    def prepare(metadata):
+
+        for c in needed:
+            if c not in metadata.headers:
+                print("\n>> Error: the column [" + str(c) + "] does not exist in your star file.\n")
+                sys.exit()
+
+        if dropoptics and "_rlnOpticsGroup" in metadata.headers:
+            print("\n>> Removed the _rlnOpticsGroup column and Optics table.")
+            return(metadata.withoutcolumns(["_rlnOpticsGroup"]).replace(version=["#","version","30000"]))
+
+        return(metadata)
+
+    def transform(chunk):
+
+        #Messages and warnings are only printed for the first chunk, which starts at the first row
+        first = chunk.index[0] == 0
+
+        if dropoptics and "_rlnOpticsGroup" in chunk.columns:
+            chunk = chunk.drop(columns=["_rlnOpticsGroup"])
+
+        if operation == "parser_limitparticles":
+            return(chunk[particleplay.limitmask(chunk, column, value, operator, downcast=None)])
+        elif operation == "parser_delparticles":
+            return(particleplay.delparticles(chunk, subsetquery.columns, subsetquery.values, subsetquery.exact, warn=first))
+        elif operation == "parser_delmics":
+            return(particleplay.delmics(chunk, mics))
+        elif operation == "parser_keepmics":
+            return(particleplay.keepmics(chunk, mics))
+        elif operation == "parser_resetcol":
+            return(columnplay.resetcolumn(chunk, column, value, quiet=not first))
+        elif operation == "parser_operate":
+            return(columnplay.operate(chunk, column, operator, value, quiet=not first, downcast=None))
+
+        #--extract, and --relegate with a query, write the particles that match the query
+        if subsetquery is not None:
+            return(particleplay.extractparticles(chunk, subsetquery.columns, subsetquery.values, subsetquery.exact, warn=first)[0])
+
+        return(chunk)
+
+    print("\n>> Streaming " + filename + " (" + str(rows) + " particles at a time)")
+
+    total, written = fileparser.streamstar(filename, outname, transform, prepare, params["parser_optless"], relegateflag, rows)
+
+    print("\n>> Wrote " + str(written) + " particles (out of " + str(total) + ", " + str(round(written*100/total,1)) + "%).")
+    print("-->> Output star file: " + outname + "\n")
+
+"""
+The options that only need a few columns of the star file, and the options that can be passed along with them
+without needing any other columns. Options that write a star file are left out, since the columns that weren't read
+would have to be read from the file again to write it (see neededcolumns()).
+"""
+PROJECTIONOPTIONS = ["parser_countme", "parser_uniquemics", "parser_plot", "parser_plotangledist", "parser_writecol"]
+PROJECTIONEXTRAS = ["file", "parser_column", "parser_query", "parser_exact", "parser_outname", "parser_outtype", "parser_optless", "parser_cache", "parser_threads"]
+
+def printinfo(filename):
+
+    """
+    Prints a summary of a star file (see --info) from fileparser.starinfo().
+    """
+
+    blocks, optics = fileparser.starinfo(filename)
+
+    #The version header is not always present
+    if any(b["version"] is not None for b in blocks):
+        print("\n>> Version: " + fileparser.getversion(blocks)[2])
+
+    for b in blocks:
+
+        if b["kind"] == "loop":
+            print("\n>> " + b["name"] + ": " + str(b["rows"]) + " rows and " + str(len(b["headers"])) + " columns")
+        else:
+            print("\n>> " + b["name"] + ": " + str(len(b["headers"])) + " labels")
+
+        for h in b["headers"]:
+            print("   " + h)
+
+    if optics is not None:
+        print("\n>> Optics table:\n")
+        print(optics.to_string(index=False))
+
+    print("")
+
+def neededcolumns(params):
+
+    """
+    Returns the columns needed by the option that was passed if it only needs a few of them, or None if all
+    the columns should be read. These options only print or plot, since fileparser.writestar() would fetch the
+    columns that were not read from the file again.
+    """
+
+    passed = argparser.passedoptions(params)
+    operations = [o for o in passed if o in PROJECTIONOPTIONS]
+
+    #Only one of these options can be run, and any other option might need the other columns
+    if len(operations) != 1 or any(o not in PROJECTIONOPTIONS and o not in PROJECTIONEXTRAS for o in passed):
+        return(None)
+
+    operation = operations[0]
+
+    #The query columns (--c) are already full names by now
+    querycolumns = [c for c in params["parser_column"].split("/") if c != ""]
 
+    if operation == "parser_countme":
+        if not querycolumns or params["parser_query"] == "":
+            return(None)
+        return(querycolumns)
+    elif operation == "parser_uniquemics":
+        return(["_rlnMicrographName"] + querycolumns)
+    elif operation == "parser_plot":
+        return([makefullname(params["parser_plot"])] + querycolumns)
+    elif operation == "parser_plotangledist":
+        return(["_rlnAngleRot", "_rlnAngleTilt"] + querycolumns)
+    elif operation == "parser_writecol":
+        return([makefullname(c) for c in params["parser_writecol"].split("/")] + querycolumns)
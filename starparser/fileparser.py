@@ -1,237 +1,932 @@
 import sys
+import os
+import csv
+import io
+import mmap
+import contextlib
+import numpy as np
 import pandas as pd
-import time
+from concurrent.futures import ThreadPoolExecutor
+from starparser import labels
+from starparser import starcache
+from starparser import compression
 
-def getparticles(filename):
+def getparticles(filename, typed=False, columns=None, cache=False, workers=1):
 
     """
-    This is the entry point. The file is read, passed to parsestar() to figure out where the tables are,
-    and that information is passed to makepandas() to generate dataframes.
+    This is the entry point. The file is indexed by parsestar() to figure out where the tables are,
+    and the optics and particles tables are read from their locations with readblock() to generate dataframes.
+    The file is memory-mapped with mapstar() rather than read into memory, so it is tokenized straight from the OS page cache.
+    If typed is True, the particle columns are converted to native types with maketyped().
+    If columns is a list of column names, only those particle columns are read (names that aren't in the file
+    are ignored). The headers in the metadata still list every column, and the rest are read with fetchcolumns()
+    when they are needed, e.g. by writestar().
+    If cache is True, the particles are read from the cache in starcache.py if the file was cached before, and
+    cached otherwise.
+    If workers is more than 1, large particle tables are read by that many threads (see readparallel()).
+    The particles are returned as a dataframe along with the metadata, which is a StarFile with the rest of the star file.
     """
-    
-    #Get the data from the star file.
-    file = open(filename,mode='r')
-    starfile = file.read()
-    file.close()
 
-    #The commented timer lines below are used to test different ways of parsing the star file to eventually find the fastest method.
-    #tic = time.perf_counter()
+    if cache:
+        allparticles, metadata = getcached(filename, False, columns, workers)
+    else:
+        allparticles, metadata = readparticles(filename, False, columns, workers)
+
+    if typed:
+        maketyped(allparticles)
 
-    #The file is parsed by parsestar() to figure out where the relevant information lies.
-    version, opticsheaders, optics, particlesheaders, particles, tablename = parsestar(starfile)
+    return(allparticles, metadata)
 
-    #toc = time.perf_counter()
-    #print(f"\nparsestar took {toc - tic:0.4f} seconds")
+class StarFile:
 
-    #Make a dataframe out of the values and headers.
-    alloptics = makepandas(opticsheaders, optics)
-    allparticles = makepandas(particlesheaders, particles)
-    
-    #Check that the number of columns in the generated dataframe matches the number of headers, otherwise something must have gone wrong.
-    if len(particlesheaders) != len(allparticles.columns):
+    """
+    Everything in a star file that was read by getparticles() but the particles: the version, the headers and rows of
+    the optics table (opticsheaders and optics), the headers of the particles table and its name (e.g. data_particles).
+    readstarfile() also keeps the particles in it. It can be indexed and unpacked like the metadata list it replaced,
+    i.e. [version, opticsheaders, optics, headers, tablename].
+    A StarFile is not modified once it is made. Changes are made with replace(), withcolumn() and withoutcolumns(), which
+    return a new StarFile that shares everything that did not change, so one StarFile can be used by several operations
+    (or threads) at the same time without copying it first.
+    """
+
+    __slots__ = ("version", "opticsheaders", "optics", "headers", "tablename", "particles")
+
+    FIELDS = ("version", "opticsheaders", "optics", "headers", "tablename")
+
+    def __init__(self, version, opticsheaders, optics, headers, tablename, particles=None):
+        self.version = version
+        self.opticsheaders = opticsheaders
+        self.optics = optics
+        self.headers = headers
+        self.tablename = tablename
+        self.particles = particles
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return([getattr(self, f) for f in self.FIELDS[key]])
+        return(getattr(self, self.FIELDS[key]))
+
+    def __len__(self):
+        return(len(self.FIELDS))
+
+    def replace(self, **changes):
+
+        """
+        Returns a new StarFile with the fields in changes (e.g. optics=newoptics) and the others shared with this one.
+        """
+
+        fields = {f: getattr(self, f) for f in self.__slots__}
+        fields.update(changes)
+
+        return(StarFile(**fields))
+
+    def withcolumn(self, column, values=None):
+
+        """
+        Returns a new StarFile with column at the end of the headers if it wasn't there yet, and
+        with its values set in the particles if they are kept in it.
+        """
+
+        headers = self.headers if column in self.headers else self.headers + [column]
+
+        if values is None or self.particles is None:
+            return(self.replace(headers=headers))
+
+        return(self.replace(headers=headers, particles=self.particles.assign(**{column: values})))
+
+    def withoutcolumns(self, columns):
+
+        """
+        Returns a new StarFile without the columns in the headers (and in the particles if they are kept in it).
+        """
+
+        headers = [h for h in self.headers if h not in columns]
+
+        if self.particles is None:
+            return(self.replace(headers=headers))
+
+        return(self.replace(headers=headers, particles=self.particles.drop(columns=[c for c in columns if c in self.particles.columns])))
+
+def readheader(data, filename, opticsless):
+
+    """
+    This is a helper function for getparticles() and getparticles_dummyoptics(). It indexes a star file that was
+    mapped with mapstar() with parsestar() and reads everything but the particles. It returns the StarFile
+    with the metadata (see getparticles()) and the block that the particles are in.
+    """
+
+    #The file is indexed by parsestar() to figure out where the relevant information lies.
+    blocks = parsestar(data)
+    opticsblock, particlesblock = findtables(blocks, opticsless)
+
+    if opticsless:
+
+        #The first table is the particles table in this case
+        if particlesblock is None:
+            print("\n>> Error: could not find a data table in " + filename + ".\n")
+            sys.exit()
+
+        alloptics = pd.DataFrame([DUMMYOPTICS], columns=DUMMYOPTICSHEADERS, dtype=str)
+
+        #The original version and table name are replaced since the table that is written after the optics table holds images
+        metadata = StarFile(["#", "version", "30000"],list(DUMMYOPTICSHEADERS),alloptics,list(particlesblock["headers"]),"data_images")
+
+    else:
+
+        if opticsblock is None or particlesblock is None:
+            print("\n>> Error: could not parse the star file. If it does not have an optics table, add --opticsless.\n")
+            sys.exit()
+
+        alloptics = readblock(data, opticsblock)
+
+        #Aggregate the non-particles data into a StarFile for simplicity.
+        metadata = StarFile(getversion(blocks),list(opticsblock["headers"]),alloptics,list(particlesblock["headers"]),particlesblock["name"])
+
+    return(metadata, particlesblock)
+
+def readparticles(filename, opticsless, columns, workers):
+
+    """
+    This is a helper function for getparticles() and getparticles_dummyoptics() that reads the particles from the text of
+    the star file. See getparticles() for the arguments.
+    """
+
+    #Map the star file. It is unmapped and closed automatically once the tables have been read.
+    with mapstar(filename) as data:
+
+        metadata, particlesblock = readheader(data, filename, opticsless)
+
+        #Make a dataframe out of the values and headers.
+        allparticles = readblock(data, particlesblock, projectcolumns(particlesblock["headers"], columns), workers)
+
+    #Check that every row had as many values as there are headers, otherwise something must have gone wrong.
+    if not checkpandas(allparticles):
 
         print("\n>> Error: something went wrong when parsing " + filename + ".\n")
         sys.exit()
-    
-    #Aggregate the non-particles data into a metadata list for simplicity.
-    metadata = [version,opticsheaders,alloptics,particlesheaders,tablename]
+
+    #The last column is only read for the check above if it wasn't asked for
+    if columns is not None and particlesblock["headers"][-1] not in columns:
+        allparticles = allparticles.drop(columns=particlesblock["headers"][-1])
+
+    #Keep track of where the particles came from so that columns can be fetched later
+    allparticles.attrs["starsource"] = StarSource(len(allparticles.index), filename, particlesblock, workers=workers)
 
     return(allparticles, metadata)
 
+def getcached(filename, opticsless, columns, workers):
 
-def parsestar(starfile):
+    """
+    This is a helper function for getparticles() and getparticles_dummyoptics() that reads the particles from the cache
+    (see starcache.py). If the file isn't cached yet, it is indexed and the particles are read from its text and cached.
+    Columns that were not cached yet (e.g. after a read with columns) are read from the text and added to the cache.
+    """
+
+    mode = "opticsless" if opticsless else "optics"
+    entry = starcache.lookup(filename, mode)
+
+    if entry is None:
+        with mapstar(filename) as data:
+            metadata, particlesblock = readheader(data, filename, opticsless)
+        entry = starcache.newentry(filename, mode, metadata, particlesblock)
+    else:
+        metadata = StarFile(*starcache.getmetadata(entry))
+
+    headers = entry["block"]["headers"]
+    allparticles = cachedcolumns(filename, entry, [h for h in headers if columns is None or h in columns], workers)
+
+    allparticles.attrs["starsource"] = StarSource(len(allparticles.index), filename, entry["block"], entry, workers)
+
+    return(allparticles, metadata)
+
+def cachedcolumns(filename, entry, columns, workers=1):
 
     """
-    Assumption: there are two tables with data; the first is assumed to be the optics table.
-    This function gets the star file information from getparticles() and the result is passed to makepandas().
+    Returns a dataframe of columns from the cache entry of a star file (see starcache.py). The columns that
+    are not in the cache yet are read from the text of the star file and added to it first.
     """
 
-    #Generate a list of lines from the star file. Anything that is tab or space delimited will occupy different indices in the list
-    starfilesplit = starfile.split()
+    missing = [c for c in columns if c not in entry["columns"]]
+
+    if missing:
+
+        with mapstar(filename) as data:
+            items = readblock(data, entry["block"], projectcolumns(entry["block"]["headers"], missing), workers)
+
+        if not checkpandas(items):
+            print("\n>> Error: something went wrong when parsing " + filename + ".\n")
+            sys.exit()
+
+        #If the cache couldn't be written, all of the columns are read from the text instead
+        if not starcache.store(entry, items):
+            if len(missing) != len(columns):
+                with mapstar(filename) as data:
+                    items = readblock(data, entry["block"], columns, workers)
+            return(items[columns])
+
+    return(starcache.readcolumns(entry, columns))
+
+@contextlib.contextmanager
+def mapstar(filename):
 
     """
-    We will make a short version of starfilesplit to use while figuring out the headers
-    This increases the speed of parsing significantly, especially for large files
-    The first 10000 lines should be enough.
+    Memory-maps a star file for reading, for use in a with statement:
+        with mapstar("particles.star") as data:
+            blocks = parsestar(data)
+    The mapped file behaves like a bytes object, but the OS only loads the parts of it that are used
+    and nothing is copied into memory. An empty file can't be mapped, so it is returned as empty bytes.
+    Compressed star files (see compression.py) can't be mapped either, so they are decompressed as they are read
+    by a compression.StreamWindow, which behaves the same way as long as the file is read in order.
     """
-    if len(starfilesplit) > 10000:
-        starfilesplit_test = starfilesplit[0:10000]
-    else:
-        starfilesplit_test = starfilesplit
+
+    kind = compression.compression(filename)
+
+    if kind is not None:
+        window = compression.StreamWindow(filename, kind)
+        try:
+            yield(window)
+        finally:
+            window.close()
+        return
+
+    with open(filename,mode='rb') as file:
+
+        if os.fstat(file.fileno()).st_size == 0:
+            yield(b"")
+            return
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield(data)
+
+def parsestar(data):
 
     """
-    #Version
-    The version header is not always present
+    This function indexes a star file that was mapped with mapstar() (or any bytes). It goes through the file once and returns
+    a list of all of its data blocks, in order. Each block is a dictionary with:
+        name: the name of the block (e.g. data_particles)
+        kind: "loop" for tables and "pairs" for blocks of label/value lines (e.g. data_general)
+        offset: the byte offset of the data_ line
+        start, end: the byte offsets of the first row (or label) of the block and just past the last one
+        headers: the column names of a table, or the labels of a pairs block
+        version: the "# version" line before the block split into its words (e.g. ["#", "version", "30001"]), or None
+    Only the lines around the headers are tokenized; the rows of tables are skipped over with skiploop().
+    Any block can then be read with readblock() without going through the file again.
     """
 
-    #Check if "# version xxxx" exists
-    try:
-        
-        #Try getting the index for the word "version"
-        versionindex = starfilesplit_test.index("version")
-        
-        #If no exception was thrown, the index was found, so there is a version header
-        #This flag will be useful later
-        versionexist = True
+    blocks = []
+    block = None
+
+    #The most recent "# version" line, which belongs to the next block
+    version = None
+
+    size = len(data)
+    offset = 0
+
+    while offset < size:
+
+        linestart = offset
+        offset = data.find(b"\n", linestart) + 1
+        if offset == 0:
+            offset = size
+
+        tokens = data[linestart:offset].split()
+
+        #Blank lines carry no information
+        if not tokens:
+            continue
+
+        first = tokens[0]
 
-        #We want the "#" before "version" up to the "30001" after
-        version = starfilesplit_test[versionindex-1:versionindex+2]
+        #Check if "# version xxxx" exists. We want the "#" up to the "30001" after
+        if first[:1] == b"#":
+            if len(tokens) > 2 and tokens[1] == b"version":
+                version = [t.decode() for t in tokens[0:3]]
+            continue
 
-    #If "version" doesn't exist, a ValueError exception will be thrown
-    except ValueError:
+        #Data blocks start with data_ (e.g. data_particles), which is the only thing on the line
+        if first.startswith(b"data_") and len(tokens) == 1:
+            block = {"name": first.decode(), "kind": "pairs", "offset": linestart, "start": offset, "end": offset, "headers": [], "version": version}
+            blocks.append(block)
+            version = None
+            continue
 
-        #This flag will be useful later
-        versionexist = False
+        #Anything before the first data block is ignored
+        if block is None:
+            continue
 
-        #We'll make up a version header in this case
-        version = ["#", "version", "30001"]
+        #Tables start with "loop_"
+        if first == b"loop_":
+            block["kind"] = "loop"
+            block["headers"] = []
+            block["start"] = offset
+            block["end"] = offset
+            continue
+
+        #Column names (i.e. table headers) and labels start with an underscore
+        #The rows of a table start after its last column name, while the labels of a pairs block are its rows
+        if first[:1] == b"_":
+            if block["kind"] == "loop":
+                block["start"] = offset
+            elif not block["headers"]:
+                block["start"] = linestart
+            block["headers"].append(first.decode())
+            block["end"] = offset
+            continue
+
+        #Anything else is a row of values. The rest of the rows of the table are skipped in one go.
+        if block["kind"] == "loop":
+            block["start"] = linestart
+            block["end"], offset, version = skiploop(data, linestart)
+
+    return(blocks)
+
+def skiploop(data, start):
 
     """
-    #Optics table headers
+    This is a helper function for parsestar() to skip over the rows of a table without tokenizing them.
+    The mapped file is searched for the next line that starts a data block.
+    It returns the byte offset just past the last row, the byte offset of the next data block (or of the
+    end of the file), and the "# version" line before the next data block (or None).
     """
 
-    #Data tables start with "loop_". The first data table is the optics table
-    opticsstart = starfilesplit_test.index("loop_") + 1
+    size = len(data)
+    nextblock = size
+
+    found = data.find(b"\ndata_", start)
+    while found != -1:
 
-    #The column names (i.e. table headers) for the optics table are stored here
-    opticstableheaders = []
+        #A data block line has nothing else on it, unlike a row whose first value happens to start with data_
+        lineend = data.find(b"\n", found + 1)
+        if lineend == -1:
+            lineend = size
 
-    #Loop through every other value from loop_ onwards, since the values will be
-    #"[#X, _rlnColumnName, #Y, _rlnNextColumnName,...]"
-    for i,n in enumerate(starfilesplit_test[opticsstart::2]):
-        
-        #Once you hit a value that doesn't start with an underscore, the headers have ended
-        if n[0] != "_":
+        if len(data[found+1:lineend].split()) == 1:
+            nextblock = found + 1
+            break
 
-            #since "i" comes from an enumerate variable, it must be multiplied by two
-            #to accomodate the fact that we were looping every two values
-            opticsheaderend = opticsstart + i*2
+        found = data.find(b"\ndata_", lineend)
 
-            #We can get out of the for loop now
+    #Step back over the blank lines and comments between the last row and the next data block
+    end = nextblock
+    version = None
+
+    while end > start:
+
+        linestart = data.rfind(b"\n", start, end - 1) + 1
+        if linestart == 0:
+            linestart = start
+        line = data[linestart:end].strip()
+
+        if line[:1] == b"#":
+            tokens = line.split()
+            if version is None and len(tokens) > 2 and tokens[1] == b"version":
+                version = [t.decode() for t in tokens[0:3]]
+        elif line != b"":
             break
 
-        #Keep adding the header names as long as one is found
-        opticstableheaders.append(n)
+        end = linestart
+
+    return(end, nextblock, version)
+
+def findtables(blocks, opticsless=False):
 
     """
-    #Version
+    Picks the optics and particles tables out of the blocks found by parsestar().
+    The optics table is the data_optics table and the particles table is the first table that isn't it.
+    If opticsless is True, the first table is the particles table and no optics table is looked for.
+    Either is None if it wasn't found.
     """
 
-    #The same logic as above
+    tables = [b for b in blocks if b["kind"] == "loop" and b["headers"]]
 
-    try:
-        starfilesplit_test[opticsheaderend:].index("version")
-        versionexist = True
-    except ValueError:
-        versionexist = False
+    if opticsless:
+        return(None, tables[0] if tables else None)
+
+    opticsblock = None
+    for b in tables:
+        if b["name"] == "data_optics":
+            opticsblock = b
+            break
+
+    particlesblock = None
+    for b in tables:
+        if b is not opticsblock:
+            particlesblock = b
+            break
+
+    return(opticsblock, particlesblock)
+
+def getversion(blocks):
+
+    """
+    The version header is not always present. The first one in the file is used, otherwise one is made up.
+    """
+
+    for b in blocks:
+        if b["version"] is not None:
+            return(list(b["version"]))
+
+    return(["#", "version", "30001"])
+
+"""
+The size of the pieces that makepandas() is given to tokenize at a time
+"""
+CHUNKSIZE = 1 << 22
+
+class BlockReader(io.RawIOBase):
 
     """
-    #Table Name
+    A read-only stream of the bytes between start and end of a star file mapped with mapstar(), so that makepandas()
+    stops at the end of a block instead of carrying on to the end of the file. The bytes are copied straight
+    from the mapped file into the buffer of the tokenizer. Any number of them can read the same mapped file at once.
     """
 
+    def __init__(self, data, start, end):
+        self.view = memoryview(data)[start:end]
+        self.position = 0
+
+    def readable(self):
+        return(True)
+
+    def readinto(self, buffer):
+        size = min(len(buffer), len(self.view) - self.position)
+        if size <= 0:
+            return(0)
+        memoryview(buffer).cast("B")[:size] = self.view[self.position:self.position+size]
+        self.position += size
+        return(size)
+
+    #The mapped file can't be closed while a view of it exists
+    def close(self):
+        if not self.closed:
+            self.view.release()
+        super().close()
+
+def blockstream(data, start, end):
+
     """
-    For the second data table, we want to know what kind of table it is
-    e.g. data_particles
+    Returns a buffered BlockReader (or compression.StreamRange for compressed files) for makepandas(),
+    to be used in a with statement so that it is released.
     """
-    try:
-        starfilesplit_test[opticsheaderend:].index("loop_")
-    except ValueError:
-        print("\n>> Error: could not parse the star file. If it does not have an optics table, add --opticsless.\n")
-        sys.exit()
 
-    if versionexist:
-        opticsdataend = starfilesplit_test[opticsheaderend:].index("#") + opticsheaderend
-        tablename = starfilesplit_test[opticsdataend+3]
-    else:
-        opticsdataend = starfilesplit_test[opticsheaderend:].index("loop_") + opticsheaderend - 1
-        tablename = starfilesplit_test[opticsdataend]
+    if isinstance(data, compression.StreamWindow):
+        return(io.BufferedReader(compression.StreamRange(data, start, end), CHUNKSIZE))
+
+    return(io.BufferedReader(BlockReader(data, start, end), CHUNKSIZE))
+
+def projectcolumns(headers, columns):
+
+    """
+    Returns the columns to read for a projected read (see getparticles()) in the order they are in the file, or None
+    to read all of them. The last column is always included so that checkpandas() can still catch rows that are short.
+    """
+
+    if columns is None:
+        return(None)
+
+    return([h for h in headers if h in columns or h == headers[-1]])
 
-    optics = starfilesplit_test[opticsheaderend:opticsdataend]
+def readblock(data, block, columns=None, workers=1):
 
     """
-    #Particles Header
+    Reads one of the blocks found by parsestar() from a star file that was mapped with mapstar().
+    Tables are returned as a dataframe from makepandas() and pairs blocks as a dictionary of label: value.
+    If columns is a list of column names, only those columns of a table are stored.
+    Large tables are read in parallel by readparallel() if workers is more than 1, unless the file is compressed
+    since it can only be decompressed in order.
     """
 
-    #Same logic as above
+    if block["kind"] == "pairs":
+
+        pairs = {}
+        for line in data[block["start"]:block["end"]].decode().splitlines():
+            tokens = line.split(None, 1)
+            if tokens and tokens[0][0] == "_":
+                pairs[tokens[0]] = tokens[1].strip() if len(tokens) > 1 else ""
+
+        return(pairs)
 
-    particlesstart = starfilesplit_test[opticsdataend:].index("loop_") + 1 + opticsdataend
+    if workers > 1 and block["end"] - block["start"] > PARALLELSIZE and not isinstance(data, compression.StreamWindow):
+        return(readparallel(data, block, columns, workers))
 
-    particlestableheaders = []
-    for i,n in enumerate(starfilesplit_test[particlesstart::2]):
-        if n[0] != "_":
-            particlesheaderend = particlesstart + i*2
+    with blockstream(data, block["start"], block["end"]) as stream:
+        return(makepandas(block["headers"], stream, columns))
+
+"""
+Tables smaller than this (in bytes) are always read in one piece, since they are read quickly anyway
+"""
+PARALLELSIZE = 1 << 24
+
+def splitblock(data, start, end, parts):
+
+    """
+    Splits the rows between the byte offsets start and end of a mapped star file into at most
+    the given number of parts of about the same size. Each part starts at the beginning of a row.
+    Returns a list of (start, end) byte offsets.
+    """
+
+    size = (end - start) // parts
+    bounds = [start]
+
+    for i in range(1, parts):
+
+        #Each part starts after the end of the row that the even split falls in
+        position = data.find(b"\n", max(start + i*size, bounds[-1]), end) + 1
+
+        if position == 0 or position >= end:
             break
-        particlestableheaders.append(n)
+
+        bounds.append(position)
+
+    bounds.append(end)
+
+    return(list(zip(bounds[:-1], bounds[1:])))
+
+def readparallel(data, block, columns, workers):
 
     """
-    #Particles
+    Reads a table by splitting its rows with splitblock() and reading the parts in as many threads as workers.
+    The tokenizer of makepandas() doesn't hold the GIL, so the parts are tokenized at the same time.
+    The parts are then put back together in order.
     """
 
-    #The remainder of the data is the particles
-    #They will get parsed properly in makepandas()
+    def readpart(part):
+        with blockstream(data, part[0], part[1]) as stream:
+            return(makepandas(block["headers"], stream, columns))
+
+    parts = splitblock(data, block["start"], block["end"], workers)
 
-    particles = starfilesplit[particlesheaderend:]
+    with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+        items = list(executor.map(readpart, parts))
 
-    return(version,opticstableheaders,optics,particlestableheaders,particles,tablename)
+    return(pd.concat(items, ignore_index=True))
 
-def makepandas(headers,items):
+"""
+The number of rows that are read at a time by readchunks()
+"""
+STREAMROWS = 20000
+
+def readchunks(data, block, rows=STREAMROWS):
 
     """
-    The star file data is initially parsed with parsestar() before this function can generate a dataframe.
+    Reads a table found by parsestar() from a star file that was mapped with mapstar() as dataframes of up to rows rows,
+    one at a time, so that only one of them is in memory at once. The labels of the rows carry on from one dataframe
+    to the next, so they are still the row numbers of the table like with readblock(). This is a generator:
+        for chunk in readchunks(data, block):
+            ...
     """
-    #tic = time.perf_counter()
-    #If there is another data table, then _rln will be found improperly in the particles data, which will not work.
-    #TOO SLOW, REMOVED
-    #if any("_rln" in i for i in items):
-    #    print("\n>> Error: something went wrong during parsing. Are there more than two data tables?\n")
-    #    sys.exit()
-    #toc = time.perf_counter()
-    #print(f"\ncheck took {toc - tic:0.4f} seconds")
 
-    #Calculate the number of columns, since this will be used to properly split the data into lines that belong to each particle.
-    totalcolumns = len(headers)
+    with blockstream(data, block["start"], block["end"]) as stream:
+        with makepandas(block["headers"], stream, rows=rows) as reader:
+            for chunk in reader:
+                yield(chunk)
+
+def indexstar(filename):
 
-    #Split the list given the number of columns expected for each particle
-    items_lst = [items[x:x+totalcolumns] for x in range(0, len(items), totalcolumns)]
+    """
+    Returns the list of blocks in a star file (see parsestar()). This is useful for star files
+    that have more than an optics and a particles table, such as *_model.star files. For example:
+        blocks = indexstar("run_model.star")
+        with mapstar("run_model.star") as data:
+            classes = readblock(data, blocks[1])
+    """
+
+    with mapstar(filename) as data:
+        return(parsestar(data))
 
-    #tic = time.perf_counter()
+def countrows(data, block):
 
-    #Generate a pandas dataframe
-    itemspd = pd.DataFrame(items_lst, columns = headers)
+    """
+    Counts the rows of a table found by parsestar() without tokenizing them, by counting the lines between its start and end
+    a chunk at a time. Empty lines are not counted, like in makepandas(), but lines with only spaces in them are.
+    For the labels of a pairs block, the number of labels is returned.
+    """
+
+    if block["kind"] == "pairs":
+        return(len(block["headers"]))
+
+    rows = 0
+    last = True
+    position = block["start"]
+
+    while position < block["end"]:
+
+        size = min(CHUNKSIZE, block["end"] - position)
+
+        #The bytes of a mapped file are looked at where they are, while a compressed file has to be decompressed
+        if isinstance(data, compression.StreamWindow):
+            chunk = np.frombuffer(data[position:position+size], dtype=np.uint8)
+        else:
+            chunk = np.frombuffer(data, dtype=np.uint8, count=size, offset=position)
+
+        newlines = chunk == ord("\n")
+        rows += np.count_nonzero(newlines)
+
+        #A newline right after another one (including the last one of the previous chunk) ends an empty line
+        rows -= np.count_nonzero(newlines[1:] & newlines[:-1]) + int(last and newlines[0])
+
+        last = bool(newlines[-1])
+        position += size
+
+    #The last row might not end with a newline at the end of the file
+    if not last:
+        rows += 1
+
+    return(rows)
+
+def countparticles(filename, opticsless=False):
+
+    """
+    Returns the number of particles in a star file along with its metadata (see getparticles()),
+    without reading the particles. If opticsless is True, the star file is read like getparticles_dummyoptics() does.
+    """
+
+    with mapstar(filename) as data:
+        metadata, particlesblock = readheader(data, filename, opticsless)
+        rows = countrows(data, particlesblock)
+
+    return(rows, metadata)
+
+def starinfo(filename):
+
+    """
+    Returns the list of blocks in a star file (see parsestar()) with the number of rows of each (see countrows())
+    in "rows", and the optics table as a dataframe (or None if there isn't one), without reading the other tables.
+    """
 
-    #toc = time.perf_counter()
-    #print(f"\nitemspd took {toc - tic:0.4f} seconds")
+    with mapstar(filename) as data:
+
+        blocks = parsestar(data)
+        optics = None
+
+        for b in blocks:
+            b["rows"] = countrows(data, b)
+            if b["name"] == "data_optics" and b["kind"] == "loop" and b["headers"] and optics is None:
+                optics = readblock(data, b)
+
+    return(blocks, optics)
+
+def makepandas(headers,items,columns=None,rows=None):
+
+    """
+    The star file is initially indexed with parsestar() before this function can generate a dataframe.
+    items is a stream (e.g. from readblock()) positioned at the first row of the table. The rows are tokenized
+    on whitespace and stored column by column, so no intermediate list of values is made.
+    All values are kept as text. If columns is a list of column names, the values of the other columns are skipped.
+    If rows is a number, an iterator over dataframes of that many rows is returned instead (see readchunks()).
+    """
+
+    #The values are read as text and nothing is interpreted as missing or quoted
+    itemspd = pd.read_csv(items, sep=r"\s+", header=None, names=headers, index_col=False, usecols=columns,
+                          dtype=str, na_filter=False, quoting=csv.QUOTE_NONE, engine="c", chunksize=rows)
 
     return itemspd
 
+def checkpandas(items):
+
+    """
+    Rows that had fewer values than there are headers end up with empty values in the last column,
+    which would otherwise be written out silently.
+    """
+
+    if len(items.columns) == 0:
+        return(False)
+
+    return(not (items[items.columns[-1]] == "").any())
+
+class StarSource:
+
+    """
+    Information about where a particles dataframe came from. It is stored in the dataframe's attrs
+    so that every dataframe derived from it (subsets, sorted copies, etc.) shares the same instance.
+    rows is the number of rows that were read, filename and block are the file and the block (see parsestar())
+    they were read from, and cache is the cache entry they were read from (see starcache.py), if any.
+    workers is the number of threads that columns are read with by fetchcolumns(). typed is whether the columns were converted with maketyped(), and text holds the original text
+    of the columns it converted in the order they were read.
+    micindex is the index of the micrographs that particleplay.micindex() keeps so that it isn't made again for every subset.
+    """
+
+    def __init__(self, rows, filename=None, block=None, cache=None, workers=1):
+        self.rows = rows
+        self.filename = filename
+        self.block = block
+        self.cache = cache
+        self.workers = workers
+        self.typed = False
+        self.text = {}
+        self.micindex = None
+
+        #The file is checked before fetching columns from it, in case it was overwritten in the meantime
+        self.stat = None
+        if filename is not None:
+            stat = os.stat(filename)
+            self.stat = (stat.st_size, stat.st_mtime_ns)
+
+    #pandas deep-copies attrs whenever a new dataframe is derived, which would duplicate the text every time
+    def __deepcopy__(self, memo):
+        return(self)
+
+def getsource(items):
 
-def getparticles_dummyoptics(filename):
+    """
+    Returns the StarSource of a dataframe, or None if it was not made by getparticles().
+    """
+
+    return(items.attrs.get("starsource"))
+
+def filerows(items, source):
+
+    """
+    Returns the row numbers in the file of the rows of a dataframe, which are its labels (see fetchcolumns()),
+    or None if the labels can't be row numbers of the file that source was read from.
+    """
+
+    rowlabels = items.index.to_numpy()
+
+    if len(rowlabels) > 0 and (not pd.api.types.is_integer_dtype(rowlabels) or rowlabels.min() < 0 or rowlabels.max() >= source.rows):
+        return(None)
+
+    return(rowlabels.astype(np.intp, copy=False))
+
+def maketyped(items):
 
     """
-    This is similar to getparticles(), but inserts a fake optics table so that parsing downstream is unchanged.
+    Converts the columns of a dataframe made by makepandas() in place according to the value types in labels.py:
+    integers are stored as int32, decimals as float32 and text as categories. Unknown columns, and columns whose
+    values don't match the expected type, are left as text.
+    The original text of converted numeric columns is kept in the StarSource so that writestar() can write back
+    the values that were not modified exactly as they were read.
     """
 
-    file = open(filename,mode='r')
-    starfile = file.read()
-    file.close()
+    text = {}
+
+    for c in items.columns:
+
+        kind = labels.RELIONLABELS.get(c)
+
+        if kind is None:
+            continue
+
+        if kind == "str":
+            items[c] = items[c].astype(labels.LABELDTYPES[kind])
+            continue
+
+        original = items[c].to_numpy(dtype=object)
+
+        try:
+            numeric = pd.to_numeric(items[c])
+        except (ValueError, TypeError):
+            continue
+
+        #An integer column with decimals in it can't be stored as integers without losing information
+        if kind == "int" and not pd.api.types.is_integer_dtype(numeric):
+            continue
+
+        converted = numeric.astype(labels.LABELDTYPES[kind])
+
+        #Integers are usually written exactly as they would be formatted again, in which case the text isn't needed
+        if kind == "float" or not (converted.astype(str).to_numpy(dtype=object) == original).all():
+            text[c] = original
+
+        items[c] = converted
 
-    #This is the fake optics table
-    tempinsertion = "\n# version 30000\n\ndata_optics\n\nloop_\n_rlnOpticsGroupName #1\n_rlnOpticsGroup #2\n_rlnVoltage #3\n_rlnImagePixelSize #4\nopticsGroup1\t1\t300.000000\t1.000000\n\n\n# version 30000\n\ndata_images\n\n"
+    source = getsource(items)
 
-    #The fake optics table must be inserted just before loop_.
-    looploc = starfile.find("loop_")
+    if source is None:
+        source = StarSource(len(items.index))
+        items.attrs["starsource"] = source
 
-    #Append the optics table
-    starfile = tempinsertion + starfile[looploc:]
+    source.typed = True
+    source.text.update(text)
 
-    #Parse the file now as with getparticles() and generate dataframes.
-    version, opticsheaders, optics, particlesheaders, particles, tablename = parsestar(starfile)
-    alloptics = makepandas(opticsheaders, optics)
-    allparticles = makepandas(particlesheaders, particles)
-    metadata = [version,opticsheaders,alloptics,particlesheaders,tablename]
+    return(items)
+
+def fetchcolumns(items, columns):
+
+    """
+    Returns the dataframe with the columns that were left out of a projected read (see getparticles()) added
+    from the original file. The rows are matched by their labels, which are still the row numbers from when
+    the file was read for subsets and sorted dataframes. The columns are added at the end of the dataframe.
+    """
+
+    columns = [c for c in columns if c not in items.columns]
+
+    if not columns:
+        return(items)
+
+    source = getsource(items)
+
+    if source is None or source.filename is None:
+        print("\n>> Error: the columns " + ", ".join(columns) + " were not read and there is no file to read them from.\n")
+        sys.exit()
+
+    try:
+        stat = os.stat(source.filename)
+    except OSError:
+        stat = None
+
+    if stat is None or (stat.st_size, stat.st_mtime_ns) != source.stat:
+        print("\n>> Error: " + source.filename + " has changed since it was read, so the columns " + ", ".join(columns) + " can't be read from it.\n")
+        sys.exit()
+
+    rowlabels = filerows(items, source)
+
+    if rowlabels is None:
+        print("\n>> Error: the rows no longer match " + source.filename + ", so the columns " + ", ".join(columns) + " can't be read from it.\n")
+        sys.exit()
+
+    #The columns are read from the cache if the particles came from it
+    if source.cache is not None:
+        fetched = cachedcolumns(source.filename, source.cache, columns, source.workers)
+    else:
+        with mapstar(source.filename) as data:
+            fetched = readblock(data, source.block, projectcolumns(source.block["headers"], columns), source.workers)
+
+    #The fetched columns are converted the same way as the rest and share the same StarSource
+    if source.typed:
+        maketyped(fetched)
+        source.text.update(getsource(fetched).text)
+
+    fetched = fetched.iloc[rowlabels]
+    fetched.index = items.index
+
+    return(items.assign(**{c: fetched[c] for c in columns}))
+
+def restoretext(items):
+
+    """
+    Returns the dataframe with its typed columns (see maketyped()) turned back into text, using the
+    original text for every value that was not modified since it was read. This relies on the row labels
+    of the dataframe still being the row numbers from when the file was read, which is the case for subsets
+    and sorted dataframes. Values that no longer match the original text are formatted from their current value.
+    """
+
+    source = getsource(items)
+
+    if source is None or not source.text:
+        return(items)
+
+    rowlabels = items.index.to_numpy()
+
+    if len(rowlabels) == 0 or not pd.api.types.is_integer_dtype(rowlabels) or rowlabels.min() < 0 or rowlabels.max() >= source.rows:
+        return(items)
+
+    restored = {}
+
+    for c, original in source.text.items():
+
+        if c not in items.columns or not pd.api.types.is_numeric_dtype(items[c]):
+            continue
+
+        current = items[c].to_numpy()
+        original = original[rowlabels]
+
+        #The original text is converted the same way it was in maketyped(), so unmodified values compare as equal
+        reparsed = pd.to_numeric(original).astype(current.dtype, copy=False)
+        unchanged = reparsed == current
+
+        restored[c] = np.where(unchanged, original, items[c].astype(str).to_numpy(dtype=object))
+
+    if not restored:
+        return(items)
+
+    return(items.assign(**restored))
+
+"""
+This is the fake optics table used by getparticles_dummyoptics()
+"""
+DUMMYOPTICSHEADERS = ["_rlnOpticsGroupName", "_rlnOpticsGroup", "_rlnVoltage", "_rlnImagePixelSize"]
+DUMMYOPTICS = ["opticsGroup1", "1", "300.000000", "1.000000"]
+
+def getparticles_dummyoptics(filename, typed=False, columns=None, cache=False, workers=1):
+
+    """
+    This is similar to getparticles(), but makes up a fake optics table so that parsing downstream is unchanged.
+    """
+
+    if cache:
+        allparticles, metadata = getcached(filename, True, columns, workers)
+    else:
+        allparticles, metadata = readparticles(filename, True, columns, workers)
+
+    if typed:
+        maketyped(allparticles)
 
     return(allparticles, metadata)
 
+def readstarfile(filename, typed=False, columns=None, cache=False, opticsless=False, workers=1):
+
+    """
+    Returns the StarFile of a star file with its particles kept in it (StarFile.particles), for use in scripts.
+    See getparticles() for the arguments; opticsless is the same as using getparticles_dummyoptics().
+    """
+
+    if opticsless:
+        allparticles, metadata = getparticles_dummyoptics(filename, typed, columns, cache, workers)
+    else:
+        allparticles, metadata = getparticles(filename, typed, columns, cache, workers)
+
+    return(metadata.replace(particles=allparticles))
 
 def writestar(particles, metadata, outputname, relegate=False):
 
@@ -244,10 +939,41 @@ def writestar(particles, metadata, outputname, relegate=False):
     if len(particles.index) == 0:
         print("\n>> Error: no particles to output.\n")
         sys.exit()
-    
+
+    #Get the particle headers from the metadata aggregate list.
+    headers = metadata[3]
+
+    #Columns that were left out of a projected read (see getparticles()) are read now, in the order of the headers.
+    missing = [h for h in headers if h not in particles.columns]
+    if missing and getsource(particles) is not None:
+        particles = fetchcolumns(particles, missing)
+        particles = particles[[h for h in headers] + [c for c in particles.columns if c not in headers]]
+
+    #Typed columns get their original text back where the values were not modified.
+    particles = restoretext(particles)
+
     #Open the file to write to. This is closed once all the data has been written (with output.close()).
-    output = open(outputname,"w")
-    
+    #The rows are written in large pieces, so a large buffer is used. Names ending with .gz or .zst are compressed.
+    output = compression.openwrite(outputname, CHUNKSIZE)
+
+    #Write everything up to the rows of the particles table
+    writemetadata(output, metadata, relegate)
+
+    #Write out the particles data from the dataframe.
+    writetable(output, particles)
+
+    #Close the file
+    output.close()
+
+    print("-->> Output star file: " + outputname + "\n")
+
+def writemetadata(output, metadata, relegate=False):
+
+    """
+    Writes the version, the optics table (unless relegate is True) and the headers of the particles table of a StarFile
+    to an open file, so that the rows of the particles can be written after them with writetable().
+    """
+
     #Start with an empty line
     output.write('\n')
 
@@ -263,29 +989,12 @@ def writestar(particles, metadata, outputname, relegate=False):
     #For Relion >3.0, the optics table should be written (i.e. relegate=False).
     if not relegate:
 
-        #Write the generic headers for the optics data
+        #Write the generic headers for the optics data, followed by the optics headers from the metadata aggregate list
         output.write('data_optics\n\n')
-        output.write('loop_')
-        
-        #Get the optics headers from the metadata aggregate list
-        opticsheaders = metadata[1]
-
-        #Initialize a count variable to increment the column numbers
-        count=1
-
-        #Write out the optics header information, interspersing #N given the column number
-        for p in opticsheaders:
-            output.write('\n')
-            output.write(p)
-            output.write(" #"+str(count))
-            count += 1
-        output.write('\n')
+        writeheaders(output, metadata[1])
 
-        #Get the optics data from the metadata aggregate list
-        optics = metadata[2]
-
-        #Since the optics data is a dataframe, the to_csv function can be used to write out the data.
-        optics.to_csv(output, header=None, index=None, sep='\t', mode='a')
+        #Get the optics data from the metadata aggregate list and write it out.
+        writetable(output, metadata[2])
 
         #Write the version values again before the next table
         output.write('\n\n')
@@ -295,13 +1004,85 @@ def writestar(particles, metadata, outputname, relegate=False):
             
         output.write('\n\n')
 
-    #Get the table name from the metadata aggregate list (e.g. data_particles) and write it.
+    #Get the table name from the metadata aggregate list (e.g. data_particles) and write it, followed by the headers.
     output.write(metadata[4])
     output.write('\n\n')
+    writeheaders(output, metadata[3])
+
+def streamstar(filename, outputname, transform, prepare=None, opticsless=False, relegate=False, rows=STREAMROWS):
+
+    """
+    Reads the particles of a star file rows rows at a time with readchunks(), passes each chunk to transform()
+    and writes the dataframe it returns to outputname straight away, so that star files larger than the memory can be
+    filtered. Only options that need one row at a time can be run this way (see --stream).
+    If prepare is given, it is called with the metadata (see getparticles()) before anything is read, and returns
+    the metadata to write, e.g. with a column removed. The columns of the dataframes that transform() returns
+    have to be the headers of that metadata, in order. relegate is the same as for writestar().
+    Returns the number of particles that were read and the number that were written.
+    """
+
+    with mapstar(filename) as data:
+
+        metadata, particlesblock = readheader(data, filename, opticsless)
+
+        if prepare is not None:
+            metadata = prepare(metadata)
+
+        output = compression.openwrite(outputname, CHUNKSIZE)
+
+        total = 0
+        written = 0
+
+        #If anything goes wrong part way through (or it is interrupted), the partly written file is removed
+        try:
+
+            writemetadata(output, metadata, relegate)
+
+            for chunk in readchunks(data, particlesblock, rows):
+
+                if not checkpandas(chunk):
+                    print("\n>> Error: something went wrong when parsing " + filename + ".\n")
+                    sys.exit()
+
+                total += len(chunk.index)
+
+                chunk = transform(chunk)
+
+                if len(chunk.index) > 0:
+                    writetable(output, chunk)
+                    written += len(chunk.index)
+
+            output.close()
+
+        except BaseException:
+            output.close()
+            os.remove(outputname)
+            raise
+
+    #Like writestar(), an empty star file is not kept
+    if written == 0:
+        os.remove(outputname)
+        print("\n>> Error: no particles to output.\n")
+        sys.exit()
+
+    return(total, written)
+
+def writestarfile(starfile, outputname, relegate=False):
+
+    """
+    Writes out a StarFile that has its particles in it (see readstarfile()) with writestar().
+    """
+
+    writestar(starfile.particles, starfile, outputname, relegate)
+
+def writeheaders(output, headers):
+
+    """
+    Writes the loop_ line and the headers of a table to an open file, interspersing #N given the column number.
+    """
+
     output.write('loop_')
 
-    #Get the paritlce headers from the metadata aggregate list and write them as above.
-    headers = metadata[3]
     count=1
     for p in headers:
         output.write('\n')
@@ -311,10 +1092,55 @@ def writestar(particles, metadata, outputname, relegate=False):
 
     output.write('\n')
 
-    #Write out the particles data from the dataframe as above.
-    particles.to_csv(output, header=None, index=None, sep='\t', mode='a')
+"""
+The number of rows that are joined at a time by writetable()
+"""
+WRITECHUNK = 100000
 
-    #Close the file
-    output.close()
+def writetable(output, items):
+
+    """
+    Writes the rows of a dataframe to an open file with the values separated by tabs. This gives the same result as
+    items.to_csv(output, header=None, index=None, sep='\t') for the values of star files, which have no whitespace
+    or quotes in them, but is several times faster. Each column is turned into text in one go by columntext()
+    and the rows are then joined and written a chunk at a time.
+    """
+
+    columns = [columntext(items.iloc[:, i]) for i in range(len(items.columns))]
+
+    for start in range(0, len(items.index), WRITECHUNK):
+
+        chunk = [c[start:start+WRITECHUNK] for c in columns]
+
+        try:
+            text = "\n".join(map("\t".join, zip(*chunk)))
+
+        #Text columns can have missing values, which are left empty like to_csv() does.
+        #They are rare, so they are only looked for if the rows couldn't be joined.
+        except TypeError:
+            chunk = [np.where(pd.isna(c), "", c) for c in chunk]
+            text = "\n".join(map("\t".join, zip(*chunk)))
+
+        output.write(text)
+        output.write("\n")
+
+def columntext(column):
+
+    """
+    Returns the values of a column as an array of text, formatted the same way as DataFrame.to_csv() would.
+    Columns that are already text are returned as they are, without copying them.
+    """
+
+    values = np.asarray(column.array)
+
+    if values.dtype == object and pd.api.types.infer_dtype(values, skipna=True) in ["string", "empty"]:
+        return(values)
+
+    #Anything else (e.g. numbers) is formatted as text, leaving missing values empty
+    text = column.astype(str).to_numpy(dtype=object)
+
+    missing = column.isna().to_numpy()
+    if missing.any():
+        text[missing] = ""
 
-    print("-->> Output star file: " + outputname + "\n")
\ No newline at end of file
+    return(text)
@@ -0,0 +1,139 @@
+"""
+The value types of known Relion labels. These are used by fileparser.maketyped() to decide
+how each column should be stored when a star file is read with typed=True.
+Labels that are not listed here are kept as text.
+"""
+
+RELIONLABELS = {
+
+    #Particles
+    "_rlnImageName" : "str",
+    "_rlnImageOriginalName" : "str",
+    "_rlnOriginalParticleName" : "str",
+    "_rlnImageId" : "int",
+    "_rlnCoordinateX" : "float",
+    "_rlnCoordinateY" : "float",
+    "_rlnCoordinateZ" : "float",
+    "_rlnOriginX" : "float",
+    "_rlnOriginY" : "float",
+    "_rlnOriginZ" : "float",
+    "_rlnOriginXAngst" : "float",
+    "_rlnOriginYAngst" : "float",
+    "_rlnOriginZAngst" : "float",
+    "_rlnOriginXPrior" : "float",
+    "_rlnOriginYPrior" : "float",
+    "_rlnOriginXPriorAngst" : "float",
+    "_rlnOriginYPriorAngst" : "float",
+    "_rlnAngleRot" : "float",
+    "_rlnAngleTilt" : "float",
+    "_rlnAnglePsi" : "float",
+    "_rlnAngleRotPrior" : "float",
+    "_rlnAngleTiltPrior" : "float",
+    "_rlnAnglePsiPrior" : "float",
+    "_rlnAnglePsiFlipRatio" : "float",
+    "_rlnAnglePsiFlip" : "int",
+    "_rlnAutopickFigureOfMerit" : "float",
+    "_rlnClassNumber" : "int",
+    "_rlnGroupNumber" : "int",
+    "_rlnGroupName" : "str",
+    "_rlnRandomSubset" : "int",
+    "_rlnNormCorrection" : "float",
+    "_rlnLogLikeliContribution" : "float",
+    "_rlnMaxValueProbDistribution" : "float",
+    "_rlnNrOfSignificantSamples" : "int",
+    "_rlnNrOfFrames" : "int",
+    "_rlnAverageNrOfFrames" : "int",
+    "_rlnParticleFigureOfMerit" : "float",
+    "_rlnHelicalTubeID" : "int",
+    "_rlnHelicalTrackLength" : "float",
+    "_rlnHelicalTrackLengthAngst" : "float",
+    "_rlnBeamTiltClass" : "int",
+    "_rlnTomoName" : "str",
+    "_rlnTomoParticleName" : "str",
+    "_rlnTomoParticleId" : "int",
+
+    #Micrographs and movies
+    "_rlnMicrographName" : "str",
+    "_rlnMicrographNameNoDW" : "str",
+    "_rlnMicrographMovieName" : "str",
+    "_rlnMicrographGainName" : "str",
+    "_rlnMicrographDefectFile" : "str",
+    "_rlnMicrographMetadata" : "str",
+    "_rlnMicrographId" : "int",
+    "_rlnMicrographPixelSize" : "float",
+    "_rlnMicrographOriginalPixelSize" : "float",
+    "_rlnMicrographBinning" : "float",
+    "_rlnMicrographDoseRate" : "float",
+    "_rlnMicrographPreExposure" : "float",
+    "_rlnMicrographFrameNumber" : "int",
+    "_rlnMicrographStartFrame" : "int",
+    "_rlnMicrographEndFrame" : "int",
+    "_rlnMotionModelVersion" : "int",
+    "_rlnAccumMotionTotal" : "float",
+    "_rlnAccumMotionEarly" : "float",
+    "_rlnAccumMotionLate" : "float",
+    "_rlnEERUpsampling" : "int",
+    "_rlnEERGrouping" : "int",
+
+    #CTF
+    "_rlnDefocusU" : "float",
+    "_rlnDefocusV" : "float",
+    "_rlnDefocusAngle" : "float",
+    "_rlnCtfAstigmatism" : "float",
+    "_rlnCtfBfactor" : "float",
+    "_rlnCtfScalefactor" : "float",
+    "_rlnCtfMaxResolution" : "float",
+    "_rlnCtfFigureOfMerit" : "float",
+    "_rlnCtfIceRingDensity" : "float",
+    "_rlnCtfImage" : "str",
+    "_rlnCtfPowerSpectrum" : "str",
+    "_rlnCtfDataAreCtfPremultiplied" : "int",
+    "_rlnPhaseShift" : "float",
+
+    #Optics
+    "_rlnOpticsGroup" : "int",
+    "_rlnOpticsGroupName" : "str",
+    "_rlnVoltage" : "float",
+    "_rlnSphericalAberration" : "float",
+    "_rlnAmplitudeContrast" : "float",
+    "_rlnImagePixelSize" : "float",
+    "_rlnImageSize" : "int",
+    "_rlnImageDimensionality" : "int",
+    "_rlnDetectorPixelSize" : "float",
+    "_rlnMagnification" : "float",
+    "_rlnBeamTiltX" : "float",
+    "_rlnBeamTiltY" : "float",
+    "_rlnOddZernike" : "str",
+    "_rlnEvenZernike" : "str",
+    "_rlnMagMat00" : "float",
+    "_rlnMagMat01" : "float",
+    "_rlnMagMat10" : "float",
+    "_rlnMagMat11" : "float",
+    "_rlnMtfFileName" : "str",
+
+    #Models and classes
+    "_rlnReferenceImage" : "str",
+    "_rlnReferenceDimensionality" : "int",
+    "_rlnNrClasses" : "int",
+    "_rlnNrBodies" : "int",
+    "_rlnNrGroups" : "int",
+    "_rlnClassDistribution" : "float",
+    "_rlnAccuracyRotations" : "float",
+    "_rlnAccuracyTranslations" : "float",
+    "_rlnAccuracyTranslationsAngst" : "float",
+    "_rlnEstimatedResolution" : "float",
+    "_rlnOverallFourierCompleteness" : "float",
+    "_rlnSpectralIndex" : "int",
+    "_rlnResolution" : "float",
+    "_rlnAngstromResolution" : "float",
+    "_rlnGroupScaleCorrection" : "float",
+}
+
+"""
+The dtypes that each value type is stored as
+"""
+LABELDTYPES = {
+    "int" : "int32",
+    "float" : "float32",
+    "str" : "category",
+}
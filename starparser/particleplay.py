@@ -1,7 +1,6 @@
 import sys
 import pandas as pd
 import numpy as np
-from starparser import argparser
 from starparser import columnplay
 from starparser import fileparser
 
@@ -18,66 +17,125 @@ import warnings
 These functions still require explanations.
 """
 
+class Query:
+
+    """
+    A query on the particles: the columns (full names) and the values to look for in them (--c and --q), and whether
+    the values have to match exactly (--e). It is made from the command-line options by parsequery(), and is passed to the
+    functions that make a subset from it (e.g. checksubset()) so that they don't read the command line again.
+    """
+
+    def __init__(self, columns, values, exact=False):
+        self.columns = columns
+        self.values = values
+        self.exact = exact
+
+def splitquery(query):
+
+    """
+    Returns the list of queries passed with --q, which are separated by slashes. A slash in a query is escaped with a comma (,/).
+    """
+
+    query = str.replace(query, ",/", ",")
+    query = query.split("/")
+
+    return([str.replace(q, ",", "/") for q in query])
+
+def parsequery(column, query, queryexact):
+
+    """
+    Returns the Query for the text passed with --c and --q, or None if either of them is empty.
+    """
+
+    if column == "" or query == "":
+        return(None)
+
+    return(Query([makefullname(c) for c in column.split("/")], splitquery(query), queryexact))
+
+def querymask(values, query, queryexact):
+
+    """
+    Returns a boolean mask of the values (a column of the particles dataframe) that match any of the queries,
+    in the same order as the values. With queryexact, the values are looked up in the set of queries all at once,
+    so the time it takes doesn't grow with the number of queries. Otherwise, the queries are regular expressions
+    that the values have to contain.
+    """
+
+    if queryexact:
+        return(values.isin(query))
+
+    return(values.str.contains("|".join(query)))
+
+def isnumeric(values):
+
+    """
+    Checks whether a column looks like it has numbers, to warn that a query without --e might match more than intended.
+    """
+
+    try:
+        pd.to_numeric(values, downcast="float")
+    except ValueError:
+        return(False)
+
+    return(True)
+
 """
 --limit
 """
 def limitparticles(particles, column, limit, operator):
+
+    limitedparticles = particles[limitmask(particles, column, limit, operator)]
+
+    if len(limitedparticles.index) == 0:
+        print("\n>> Error: there are no particles that match the criterion.\n")
+        sys.exit()
     
-    tempcolumnname = column + "_float"
-    particles[tempcolumnname] = particles[column]
+    return(limitedparticles)
+
+def limitmask(particles, column, limit, operator, downcast="float"):
+
+    """
+    Returns a boolean mask of the particles whose values in the column are less than (lt), greater than (gt),
+    less than or equal to (le) or greater than or equal to (ge) the limit.
+    downcast is passed to pd.to_numeric() (see columnplay.operate()).
+    """
+
+    #The values are compared as numbers without adding them to the particles, so only the matching rows are copied
     try:
-        particles[tempcolumnname] = pd.to_numeric(particles[tempcolumnname], downcast="float")
+        values = pd.to_numeric(particles[column], downcast=downcast)
     except ValueError:
         print("\n>> Error: this column doesn't seem to contain numbers.\n")
         sys.exit()
-    limitedparticles = particles.copy()
 
     if operator == "lt":
-        limitedparticles = limitedparticles[limitedparticles[tempcolumnname]<limit]
+        return(values<limit)
     elif operator == "gt":
-        limitedparticles = limitedparticles[limitedparticles[tempcolumnname]>limit]
+        return(values>limit)
     elif operator == "ge":
-        limitedparticles = limitedparticles[limitedparticles[tempcolumnname]>=limit]
+        return(values>=limit)
     elif operator == "le":
-        limitedparticles = limitedparticles[limitedparticles[tempcolumnname]<=limit]
-
-    particles.drop(tempcolumnname, axis=1, inplace=True)
-    limitedparticles.drop(tempcolumnname, axis=1, inplace=True)
-
-    if len(limitedparticles.index) == 0:
-        print("\n>> Error: there are no particles that match the criterion.\n")
-        sys.exit()
-    
-    return(limitedparticles)
+        return(values<=limit)
 
 """
 --remove_particles
 """
-def delparticles(particles, columns, query, queryexact):
-    
-    purgedparticles = particles.copy()
+def delparticles(particles, columns, query, queryexact, warn=True):
+
+    """
+    Returns the particles that don't match any of the queries in the column (only one column can be passed).
+    Unless warn is False, this warns if the column looks like it has numbers and the queries don't have to match exactly.
+    """
     
     if len(columns)>1:
         print("\n>> Error: you have specified two columns. You can't if you're querying to delete.\n")
         sys.exit()
 
-    itisnumeric = True
-    try:
-        pd.to_numeric(particles[columns[0]], downcast="float")
-    except ValueError:
-        itisnumeric = False
-
-    if not queryexact and itisnumeric:
+    if warn and not queryexact and isnumeric(particles[columns[0]]):
         print("\n----------------------------------------------------------------------")        
         print("\n>> Warning: it looks like this column has numbers but you haven't specified the exact option (--e).\n   Make sure that this is the behavior you intended.\n")
         print("----------------------------------------------------------------------")
 
-    if not queryexact:
-        q = "|".join(query)
-        purgedparticles.drop(purgedparticles[purgedparticles[columns[0]].str.contains(q)].index , axis=0,inplace=True)
-    else:
-        for q in query:
-            purgedparticles.drop(purgedparticles[purgedparticles[columns[0]]==q].index , axis=0,inplace=True)
+    purgedparticles = particles[~querymask(particles[columns[0]], query, queryexact)]
     
     return(purgedparticles)
 
@@ -88,116 +146,215 @@ def delduplicates(particles, column):
 
     return(particles.drop_duplicates(subset=[column]))
 
+def micindex(particles):
+
+    """
+    Returns an index of the micrographs of the particles as a dictionary with:
+        mics: the unique micrograph names, sorted
+        codes: the position of every particle's micrograph in mics
+        names: the unique file names of the micrographs (i.e. without the path), sorted, which is how micrographs
+               are matched between star files
+        namecodes: the position of every micrograph's file name in names (so names[namecodes[codes]] is the file name
+                   of the micrograph of every particle)
+    Only the micrographs that the particles are in are listed, so every micrograph in the index has particles.
+    The index is kept in the StarSource of the particles (see fileparser.py), by row of the star file, so that
+    subsets of the same particles don't have to make it again (see subindex()). It is only reused if the micrograph
+    names still match. Use micgroups() to go through the particles micrograph by micrograph.
+    """
+
+    values = np.asarray(particles["_rlnMicrographName"].array, dtype=object)
+
+    source = fileparser.getsource(particles)
+    rows = fileparser.filerows(particles, source) if source is not None else None
+    cached = source.micindex if rows is not None else None
+
+    if cached is not None:
+        codes = cached["filecodes"][rows]
+        if (codes >= 0).all() and (cached["mics"][codes] == values).all():
+            return(subindex(cached, codes))
+
+    codes, mics = pd.factorize(values, sort=True)
+    namecodes, names = pd.factorize(np.array([m.rsplit("/",1)[-1] for m in mics], dtype=object), sort=True)
+
+    cached = {"filecodes": None, "mics": mics, "names": names, "namecodes": namecodes, "keys": None}
+
+    if rows is not None:
+        cached["filecodes"] = np.full(source.rows, -1, dtype=np.intp)
+        cached["filecodes"][rows] = codes
+        source.micindex = cached
+
+    return({"mics": mics, "codes": codes, "names": names, "namecodes": namecodes, "cached": cached})
+
+def subindex(cached, codes):
+
+    """
+    This is a helper function for micindex() that returns the index of a subset of the particles from the index that was
+    kept for all of them, given the positions of the micrographs of the subset in it. The micrographs that have no particles
+    left in the subset are left out, and the positions are renumbered to match.
+    """
+
+    used = np.zeros(len(cached["mics"]), dtype=bool)
+    used[codes] = True
+
+    if used.all():
+        return({"mics": cached["mics"], "codes": codes, "names": cached["names"], "namecodes": cached["namecodes"], "cached": cached})
+
+    #The micrographs and file names stay sorted since they are only left out
+    micpositions = np.cumsum(used) - 1
+    mics = cached["mics"][used]
+
+    usednames = np.zeros(len(cached["names"]), dtype=bool)
+    usednames[cached["namecodes"][used]] = True
+    namepositions = np.cumsum(usednames) - 1
+
+    names = cached["names"][usednames]
+    namecodes = namepositions[cached["namecodes"][used]]
+
+    #The dictionary of mickeys() is made again for the subset, since it gives positions in mics
+    subset = {"filecodes": None, "mics": mics, "names": names, "namecodes": namecodes, "keys": None}
+
+    return({"mics": mics, "codes": micpositions[codes], "names": names, "namecodes": namecodes, "cached": subset})
+
+def micgroups(codes, groups):
+
+    """
+    Returns the positions of the particles sorted by micrograph (keeping their order within each micrograph) and where
+    each micrograph starts in them, given the codes of the particles from micindex() (either codes, or namecodes[codes]
+    to group by file name) and the number of micrographs. The particles of micrograph i are order[offsets[i]:offsets[i+1]].
+    """
+
+    order = np.argsort(codes, kind="stable")
+    offsets = np.zeros(groups + 1, dtype=np.intp)
+    np.cumsum(np.bincount(codes, minlength=groups), out=offsets[1:])
+
+    return(order, offsets)
+
+def mickeys(index):
+
+    """
+    Returns a dictionary from the full name, the file name, and the file name without extension of the micrographs
+    in a micindex() to their positions in mics. It is made once per index.
+    """
+
+    cached = index["cached"]
+
+    if cached["keys"] is None:
+        keys = {}
+        for i, name in enumerate(cached["mics"]):
+            filename = name.rsplit("/",1)[-1]
+            for k in {name, filename, filename.rsplit(".",1)[0]}:
+                keys.setdefault(k, []).append(i)
+        cached["keys"] = keys
+
+    return(cached["keys"])
+
+def micmask(particles, mics):
+
+    """
+    Returns a boolean mask of the particles that belong to the micrographs in the list mics, which can be given by
+    their full names, their file names, or their file names without extension. Those are looked up in mickeys().
+    Anything else in the list is searched for as part of the micrograph names, like the whole list used to be.
+    A name that is found in mickeys() is not also searched for, so e.g. mic1 doesn't select mic10, which it used to.
+    """
+
+    index = micindex(particles)
+    names = index["mics"]
+    keys = mickeys(index)
+
+    selected = np.zeros(len(names), dtype=bool)
+    unmatched = []
+
+    for m in mics:
+        found = keys.get(m)
+        if found is None:
+            unmatched.append(m)
+        else:
+            selected[found] = True
+
+    #The unique names are joined into one string so that each of these is only searched for once
+    if unmatched:
+
+        text = "\n".join(names)
+        starts = np.cumsum([0] + [len(n) + 1 for n in names[:-1]])
+
+        for m in unmatched:
+            position = text.find(m)
+            while position != -1:
+                i = np.searchsorted(starts, position, side="right") - 1
+                selected[i] = True
+                position = text.find(m, starts[i] + len(names[i]) + 1)
+
+    return(selected[index["codes"]])
+
 """
 --remove_mics_list
 """
 def delmics(particles, micstodelete):
-    purgedparticles = particles.copy()
-    m = "|".join(micstodelete)
-    purgedparticles.drop(purgedparticles[purgedparticles["_rlnMicrographName"].str.contains(m)].index , axis=0,inplace=True)    
+    purgedparticles = particles[~micmask(particles, micstodelete)]
     return(purgedparticles)
 
 """
 --keep_mics_list
 """
 def keepmics(particles, micstokeep):
-    keptparticles = particles.copy()
-    m = "|".join(micstokeep)
-    keptparticles = keptparticles[keptparticles["_rlnMicrographName"].str.contains(m)]
+    keptparticles = particles[micmask(particles, micstokeep)]
     return(keptparticles)
 
 """
 --extract
 """
-def extractparticles(particles, columns, query, queryexact):
+def extractparticles(particles, columns, query, queryexact, warn=True):
+
+    """
+    Returns the particles that match any of the queries in the column (only one column can be passed), and how many there are.
+    Unless warn is False, this warns if the column looks like it has numbers and the queries don't have to match exactly.
+    """
     
     if len(columns)>1:
         print("\n>> Error: you have specified two columns. Only specify one if you're extracting from a subset of the data using a query.\n")
         sys.exit()
 
-    itisnumeric = True
-    try:
-        pd.to_numeric(particles[columns[0]], downcast="float")
-    except ValueError:
-        itisnumeric = False
-
-    params = argparser.argparse()
-
-    if not queryexact and itisnumeric and not params["parser_splitoptics"] and not params["parser_classproportion"]:
+    if warn and not queryexact and isnumeric(particles[columns[0]]):
         print("\n----------------------------------------------------------------------")        
         print("\n>> Warning: it looks like this column has numbers but you haven't specified the exact option (--e).\n   Make sure that this is the behavior you intended.\n")
         print("----------------------------------------------------------------------")
 
-    if not queryexact:
-        extractedparticles = particles.copy()
-        q = "|".join(query)
-        extractedparticles.drop(extractedparticles[~extractedparticles[columns[0]].str.contains(q)].index, axis=0,inplace=True)
-    else:
-        toconcat = [particles[particles[columns[0]] == q] for q in query]
-        extractedparticles = pd.concat(toconcat)
+    extractedparticles = particles[querymask(particles[columns[0]], query, queryexact)]
 
     extractednumber = len(extractedparticles.index)
     
     return(extractedparticles, extractednumber)
 
-def checksubset(particles, queryexact):
+def checksubset(particles, query):
     
     """
-    Re-processing the columns/queries is inefficient since it was
-    already processed in decision tree. This also makes it so that
-    you can't use checksubset in scripts. Consider revising.
+    Returns the subset of particles that match the query (a Query, see parsequery()),
+    or the particles as they are if there is no query (None).
     """
 
-    params = argparser.argparse()
-    if params["parser_column"] != "" and params["parser_query"] != "":
-
-        query = params["parser_query"]
-        escape = ",/"
-        query = str.replace(params["parser_query"],escape, ",")
-        query = query.split("/")
-        for i,q in enumerate(query):
-            query[i] = str.replace(q,",", "/")
+    if query is None:
+        return(particles)
 
-        columns = params["parser_column"].split("/")
-        for i,c in enumerate(columns):
-            columns[i] = makefullname(c)
-        
-        subsetparticles, extractednumber = extractparticles(particles, columns, query, queryexact)
-        
-        print("\n>> Created a subset of " + str(extractednumber) + " particles (out of " + str(len(particles.index)) + ", " + str(round(extractednumber*100/len(particles.index),1)) + "%) that match " + str(query) +               " in the columns " + str(columns) + ".")
-        
-        return(subsetparticles)
+    subsetparticles, extractednumber = extractparticles(particles, query.columns, query.values, query.exact)
     
-    else:
-        return(particles)
+    print("\n>> Created a subset of " + str(extractednumber) + " particles (out of " + str(len(particles.index)) + ", " + str(round(extractednumber*100/len(particles.index),1)) + "%) that match " + str(query.values) +               " in the columns " + str(query.columns) + ".")
+    
+    return(subsetparticles)
 
 def countqueryparticles(particles,columns,query,queryexact,quiet):
 
     totalparticles = len(particles.index)
     
-    totalquery = 0
-    
     if len(columns)>1:
         print("\n>> Error: you have specified two different columns.\n")
         sys.exit()
 
-    itisnumeric = True
-    try:
-        pd.to_numeric(particles[columns[0]], downcast="float")
-    except ValueError:
-        itisnumeric = False
-
-    if not queryexact and itisnumeric:
+    if not queryexact and isnumeric(particles[columns[0]]):
         print("\n----------------------------------------------------------------------")        
         print("\n>> Warning: it looks like this column has numbers but you haven't specified the \"exact\" option (--e, see documentation).\n   Make sure that this is the behavior you intended.\n")
         print("----------------------------------------------------------------------")
 
-    if not queryexact:
-        q = "|".join(query)
-        totalquery += len(particles[particles[columns[0]].str.contains(q)].index)
-    else:
-        for q in query:
-            totalquery += len(particles[particles[columns[0]]==q].index)
+    totalquery = int(querymask(particles[columns[0]], query, queryexact).sum())
         
     percentparticles = round(totalquery*100/totalparticles,1)
 
@@ -210,29 +367,34 @@ def countqueryparticles(particles,columns,query,queryexact,quiet):
 --regroup
 """
 def regroup(particles, numpergroup):
+
+    """
+    Returns the particles with new group numbers (and names) so that every group has numpergroup particles
+    with similar defocus values, and the number of groups. The particles left over go in the last group.
+    """
     
-    newgroups = []
     roundtotal = int(len(particles.index)/numpergroup)
-    leftover = (len(particles.index)) - roundtotal*numpergroup
-    for i in range(roundtotal):
-        newgroups.append([i+1 for j in range(numpergroup)])
-    newgroups.append([newgroups[-1][-1] for i in range(leftover)])
-    newgroups = [item for sublist in newgroups for item in sublist]
-
-    regroupedparticles = particles.copy()
-    regroupedparticles.sort_values("_rlnDefocusU", inplace=True)
-
-    if "_rlnGroupNumber" in regroupedparticles.columns:
-        regroupedparticles.drop("_rlnGroupNumber", axis=1, inplace=True)
-        regroupedparticles["_rlnGroupNumber"] = newgroups
-
-    if "_rlnGroupName" in regroupedparticles.columns:
-        regroupedparticles.drop("_rlnGroupName", axis=1, inplace=True)
-        newgroups = [("group_"+str(i).zfill(4)) for i in newgroups]
-        regroupedparticles["_rlnGroupName"] = newgroups
-    
-    regroupedparticles.sort_index(inplace = True)
-    regroupedparticles = regroupedparticles[particles.columns]
+
+    if roundtotal == 0:
+        print("\n>> Error: there are fewer particles than the number of particles per group.\n")
+        sys.exit()
+
+    #Only the defocus values are sorted (as they are sorted in the star file), and the groups are given out in that order
+    order = pd.Series(particles["_rlnDefocusU"].array).sort_values().index.to_numpy()
+
+    newgroups = np.empty(len(order), dtype=np.int64)
+    newgroups[order] = np.minimum(np.arange(len(order))//numpergroup + 1, roundtotal)
+
+    #The new columns replace the old ones where they are, and the others are shared with the original particles (copy-on-write)
+    regrouped = {}
+
+    if "_rlnGroupNumber" in particles.columns:
+        regrouped["_rlnGroupNumber"] = newgroups
+
+    if "_rlnGroupName" in particles.columns:
+        regrouped["_rlnGroupName"] = [("group_"+str(i).zfill(4)) for i in newgroups]
+
+    regroupedparticles = particles.assign(**regrouped)
 
     return(regroupedparticles, roundtotal)
 
@@ -258,16 +420,11 @@ def makeopticsgroup(particles,metadata,newgroup):
 """
 def setparticleoptics(particles,column,query,queryexact,opticsnumber):
     
-    particlesnewoptics = particles.copy()
-
     numchanged = countqueryparticles(particles, column, query, queryexact, True)
-    
-    if not queryexact:
-        q = "|".join(query)
-        particlesnewoptics.loc[particles[column[0]].str.contains(q), "_rlnOpticsGroup"] = opticsnumber
-    else:
-        for q in query:
-            particlesnewoptics.loc[particles[column[0]]==q, "_rlnOpticsGroup"] = opticsnumber
+
+    #Only the optics group column is new, the others are shared with the original particles (copy-on-write)
+    newoptics = particles["_rlnOpticsGroup"].where(~querymask(particles[column[0]], query, queryexact), opticsnumber)
+    particlesnewoptics = particles.assign(_rlnOpticsGroup=newoptics)
         
     return(particlesnewoptics, numchanged)
 
@@ -275,25 +432,29 @@ def setparticleoptics(particles,column,query,queryexact,opticsnumber):
 --import_particle_values
 """
 def importpartvalues(original_particles, importfrom_particles, columnstoswap):
-    
+
+    """
+    Returns the particles with the values of the columns in columnstoswap taken from the particles in importfrom_particles
+    that have the same _rlnImageName. If an image name is there more than once, the first one is used.
+    """
+
+    # The image names of importfrom_particles are hashed once to look up those of the particles
+    names = pd.Index(importfrom_particles['_rlnImageName'].to_numpy(dtype=object))
+    firstrows = None
+
     # Check for duplicates in importfrom_particles
-    if importfrom_particles['_rlnImageName'].duplicated().any():
-        importfrom_particles_unique = importfrom_particles.drop_duplicates(subset=['_rlnImageName'], keep='first')
-        newlen = len(importfrom_particles_unique.index)
-        oldlen = len(importfrom_particles.index)
-        duplicates = oldlen - newlen
-        print(f"\n!! Warning: {duplicates} duplicate entries found in the original star file (--f)! Only considering first instance.")
-
-        # Create a dictionary for fast lookup from importfrom_particles
-        lookup_dict = importfrom_particles_unique.set_index('_rlnImageName')[columnstoswap].to_dict('index')
-        
-    else:
-        # Create a dictionary for fast lookup from importfrom_particles
-        lookup_dict = importfrom_particles.set_index('_rlnImageName')[columnstoswap].to_dict('index')
+    if not names.is_unique:
+        duplicated = names.duplicated(keep="first")
+        print(f"\n!! Warning: {int(duplicated.sum())} duplicate entries found in the original star file (--f)! Only considering first instance.")
+        firstrows = np.flatnonzero(~duplicated)
+        names = names[firstrows]
+
+    rows = names.get_indexer(original_particles['_rlnImageName'].to_numpy(dtype=object))
 
-    original_particles['_rlnMatched'] = original_particles['_rlnImageName'].apply(lambda x: x in lookup_dict)
+    if firstrows is not None:
+        rows = np.where(rows != -1, firstrows[rows], -1)
 
-    matched_count = original_particles['_rlnMatched'].sum()    
+    matched_count = int((rows != -1).sum())
 
     if matched_count == 0:
         print("\n>> Error: could not match any particles to the second file.\n")
@@ -302,55 +463,60 @@ def importpartvalues(original_particles, importfrom_particles, columnstoswap):
     if matched_count != len(original_particles.index):
         print(f"\n!! Warning: Could not match {len(original_particles.index)-matched_count} particles. Their original values have been kept.\n")
 
+    return(joinvalues(original_particles, importfrom_particles, rows, columnstoswap))
 
-    # Perform the swap
-    for c in columnstoswap:
-        original_particles[c] = original_particles.apply(
-            lambda row: lookup_dict[row['_rlnImageName']][c] if row['_rlnMatched'] else row[c], axis=1
-        )
+def joinvalues(particles, fromparticles, rows, columns):
 
-    original_particles.drop("_rlnMatched", axis=1, inplace=True)
+    """
+    Returns the particles with the values of the columns taken from the rows of fromparticles at the positions in rows,
+    one per particle. Particles with a row of -1 keep their original values.
+    """
+
+    matched = rows != -1
+    fromrows = np.where(matched, rows, 0)
 
-    return(original_particles)
+    joined = {}
+    for c in columns:
+        imported = pd.Series(fromparticles[c].array.take(fromrows), index=particles.index)
+        joined[c] = particles[c].where(~matched, imported)
+
+    return(particles.assign(**joined))
 
 """
 --import_mic_values
 """
-def importmicvalues(importedparticles, importfrom_particles, column):
-    # Extract the simple micrograph name if necessary
-    if "/" in importedparticles['_rlnMicrographName'][0]:
-        importedparticles["_rlnMicrographNameSimple"] = importedparticles['_rlnMicrographName'].str.split('/').str[-1]
-    else:
-        importedparticles["_rlnMicrographNameSimple"] = importedparticles['_rlnMicrographName']
+def importmicvalues(importedparticles, importfrom_particles, columns):
 
-    if "/" in importfrom_particles['_rlnMicrographName'][0]:
-        importfrom_particles["_rlnMicrographNameSimple"] = importfrom_particles['_rlnMicrographName'].str.split('/').str[-1]
-    else:
-        importfrom_particles["_rlnMicrographNameSimple"] = importfrom_particles['_rlnMicrographName']
+    """
+    Returns the particles with the values of the columns taken from the particles in importfrom_particles that are
+    in the micrograph with the same name (without the path, see micindex()). If there are several particles in a micrograph,
+    the values of the last one are used.
+    """
+
+    coreindex = micindex(importedparticles)
+    fromindex = micindex(importfrom_particles)
 
-    # Create a lookup dictionary from importfrom_particles
-    lookup_dict = importfrom_particles.set_index('_rlnMicrographNameSimple')[column].to_dict()
+    # The last particle of every micrograph in importfrom_particles (-1 for a micrograph without particles)
+    fromcodes = fromindex["namecodes"][fromindex["codes"]]
+    lastrows = np.full(len(fromindex["names"]), -1, dtype=np.intp)
+    #The largest row of each micrograph is taken explicitly, since the order of repeated assignments isn't guaranteed
+    np.maximum.at(lastrows, fromcodes, np.arange(len(fromcodes)))
 
-    importedparticles['_rlnMatched'] = importedparticles['_rlnMicrographNameSimple'].apply(lambda x: x in lookup_dict)
-    matched_count = importedparticles['_rlnMatched'].sum() 
+    # Look up the micrographs, and then their particles
+    positions = pd.Index(fromindex["names"]).get_indexer(coreindex["names"])
+    microws = np.where(positions != -1, lastrows[positions], -1)
+    rows = microws[coreindex["namecodes"][coreindex["codes"]]]
+
+    matched_count = int((rows != -1).sum())
 
     if matched_count == 0:
         print("\n>> Error: could not match any micrographs to the second file.\n")
         sys.exit()
 
     if matched_count != len(importedparticles.index):
-        print(f"\n!! Warning: Could not match the micrographs of {len(importedparticles.index)-matched_count} particles. Their original values in {column} have been kept.\n")
-
-    # Update values in importedparticles using lookup_dict
-    importedparticles[column] = importedparticles.apply(
-        lambda row: lookup_dict[row['_rlnMicrographNameSimple']] if row['_rlnMatched'] else row[column], axis=1
-    )
-
-    # Drop the temporary '_rlnMicrographNameSimple' column
-    importedparticles.drop("_rlnMicrographNameSimple", axis=1, inplace=True)
-    importedparticles.drop("_rlnMatched", axis=1, inplace=True)
+        print(f"\n!! Warning: Could not match the micrographs of {len(importedparticles.index)-matched_count} particles. Their original values in {', '.join(columns)} have been kept.\n")
 
-    return(importedparticles)
+    return(joinvalues(importedparticles, importfrom_particles, rows, columns))
 
 """
 --expand_optics
@@ -369,8 +535,6 @@ def expandoptics(original_particles, original_metadata, newdata, newdata_metadat
         print("\n>> Error: the second star file doesn't have a _rlnMicrographName column.\n")
         sys.exit()
 
-    newmetadata = original_metadata
-
     opticsgroupnum = int(original_metadata[2].loc[original_metadata[2]["_rlnOpticsGroupName"] == opticsgrouptoexpand]["_rlnOpticsGroup"].tolist()[0])
     opticsgrouplist = original_metadata[2]["_rlnOpticsGroup"].tolist()
     opticsgrouplist = [int(o) for o in opticsgrouplist]
@@ -382,8 +546,7 @@ def expandoptics(original_particles, original_metadata, newdata, newdata_metadat
 
     #print(opticsgroupnum,opticsgrouplist,importopticsnums,totalimportoptics)
 
-    newoptics = original_metadata[2]
-    #print(newoptics["_rlnOpticsGroup"])
+    #print(original_metadata[2]["_rlnOpticsGroup"])
 
     torepeat = []
     for i,o in enumerate(opticsgrouplist):
@@ -399,7 +562,9 @@ def expandoptics(original_particles, original_metadata, newdata, newdata_metadat
         #opticsgrouplist[i]+=totalimportoptics
 
     #print(torepeat)
-    newoptics["times"] = torepeat
+
+    #The optics table of the metadata is shared with the original, so the new one is made from a new dataframe
+    newoptics = original_metadata.optics.assign(times=torepeat)
 
     newoptics=newoptics.loc[newoptics.index.repeat(newoptics.times)].reset_index(drop=True)
 
@@ -418,47 +583,24 @@ def expandoptics(original_particles, original_metadata, newdata, newdata_metadat
 
     newoptics["_rlnOpticsGroupName"]=newopticsnames
 
-    newmetadata[2] = newoptics
+    newmetadata = original_metadata.replace(optics=newoptics)
 
     #print(newoptics)
 
-    #original_particles["_rlnOpticsGroup"] = pd.to_numeric(original_particles["_rlnOpticsGroup"], downcast="integer")
-
-    particleoptics = original_particles["_rlnOpticsGroup"].tolist()
-    newparticleoptics = [int(p) for p in particleoptics]
-
-    for i,p in enumerate(newparticleoptics):
-        if p <= opticsgroupnum:
-            continue
-        else:
-            newparticleoptics[i]=str(int(p+totalimportoptics-1))
-
-    original_particles["_rlnOpticsGroup"] = newparticleoptics
+    #The optics groups after the expanded one are moved up by the number of new groups, and the groups
+    #of the second star file are moved up to start at the expanded one. Groups that don't move keep their text.
+    particleoptics = pd.to_numeric(original_particles["_rlnOpticsGroup"]).to_numpy()
+    moved = particleoptics > opticsgroupnum
+    renumberedoptics = original_particles["_rlnOpticsGroup"].where(~moved, (particleoptics + totalimportoptics - 1).astype(str))
 
-    ###############
+    renumberedparticles = original_particles.assign(_rlnOpticsGroup=renumberedoptics)
 
-    #print(newdata)
+    newdataoptics = pd.to_numeric(newdata["_rlnOpticsGroup"]).to_numpy()
+    newdata = newdata.assign(_rlnOpticsGroup=(newdataoptics + opticsgroupnum - 1).astype(str))
 
-    newdataoptics = newdata["_rlnOpticsGroup"].tolist()
-    newdataoptics = [int(p) for p in newdataoptics]
+    expandedparticles = importmicvalues(renumberedparticles, newdata, ["_rlnOpticsGroup"])
 
-    for i,p in enumerate(newdataoptics):
-        newdataoptics[i]=str(int(p+opticsgroupnum-1))
-
-    newdata["_rlnOpticsGroup"] = newdataoptics
-
-    #print(newdata)
-
-    ####
-
-    #print(original_particles["_rlnOpticsGroup"].head())
-
-    expandedparticles = importmicvalues(original_particles, newdata, "_rlnOpticsGroup")
-
-    totaldifferent = 0
-    for i, j in zip(original_particles.iterrows(), expandedparticles.iterrows()):
-        if i[1]["_rlnOpticsGroup"] != j[1]["_rlnOpticsGroup"]:
-            totaldifferent += 1
+    totaldifferent = int((expandedparticles["_rlnOpticsGroup"].to_numpy(dtype=object) != original_particles["_rlnOpticsGroup"].to_numpy(dtype=object)).sum())
 
     print("\n>> The number of particles that have acquired a new optics group number = " + str(totaldifferent) + "\n")
 
@@ -555,25 +697,18 @@ def remove_poses(particles, metadata, outputname, relegateflag):
     plt.show()
 
 
-def extractoptics(particles, metadata, queryexact):
-
-    params = argparser.argparse()
-    if params["parser_column"] != "" and params["parser_query"] != "":
-
-        query = params["parser_query"]
-        escape = ",/"
-        query = str.replace(params["parser_query"],escape, ",")
-        query = query.split("/")
-        for i,q in enumerate(query):
-            query[i] = str.replace(q,",", "/")
+def extractoptics(particles, metadata, query):
 
-        column = params["parser_column"].split("/")
+    """
+    Returns the particles in the optics groups that match the query (a Query, see parsequery()) in the optics table,
+    the metadata with only those optics groups, and the number of particles.
+    """
 
-    if len(column)>1:
+    if len(query.columns)>1:
         print("\n>> Error: you have specified two columns. Only specify one if you're extracting from a subset of the data using a query.\n")
         sys.exit()
-    else:
-        column = makefullname(column[0])
+
+    column = query.columns[0]
 
     opticsheaders = metadata[1]
     opticsdata = metadata[2]
@@ -582,33 +717,19 @@ def extractoptics(particles, metadata, queryexact):
         print(f"\n>> Error: {column} is not in your optics table.\n")
         sys.exit()
 
-    itisnumeric = True
-    try:
-        pd.to_numeric(opticsdata[column], downcast="float")
-    except ValueError:
-        itisnumeric = False
-
-    params = argparser.argparse()
-
-    if not queryexact and itisnumeric:
+    if not query.exact and isnumeric(opticsdata[column]):
         print("\n----------------------------------------------------------------------")        
         print("\n>> Warning: it looks like this column has numbers but you haven't specified the exact option (--e).\n   Make sure that this is the behavior you intended.\n")
         print("----------------------------------------------------------------------")
 
-    if not queryexact:
-        matching_opticsnumbers = opticsdata[opticsdata[column].str.contains('|'.join(query))]['_rlnOpticsGroup']
-        non_repeating_values_set = list(set(matching_opticsnumbers))
-
-    else:
-        matching_opticsnumbers = opticsdata[opticsdata[column].isin(query)]['_rlnOpticsGroup']
-        non_repeating_values_set = list(set(matching_opticsnumbers))
+    matching_opticsnumbers = opticsdata[querymask(opticsdata[column], query.values, query.exact)]['_rlnOpticsGroup']
+    non_repeating_values_set = list(set(matching_opticsnumbers))
 
     if len(non_repeating_values_set) == 0:
         print("\n>> Error: No optics groups matched the optics query.\n")
         sys.exit()
 
-    toconcat = [particles[particles["_rlnOpticsGroup"] == q] for q in non_repeating_values_set]
-    newparticles = pd.concat(toconcat)
+    newparticles = particles[querymask(particles["_rlnOpticsGroup"], non_repeating_values_set, True)]
 
     if newparticles.empty:
         print("\n>> Error: No particles matched the optics query.\n")
@@ -618,9 +739,15 @@ def extractoptics(particles, metadata, queryexact):
 
     newopticsdata = opticsdata[opticsdata['_rlnOpticsGroup'].isin(non_repeating_values_set)]
     
-    return(newparticles, [metadata[0], metadata[1], newopticsdata, metadata[3], metadata[4]], extractednumber)
+    return(newparticles, metadata.replace(optics=newopticsdata), extractednumber)
 
 def makefullname(col):
+
+    """
+    Returns the full name of a column (_rlnXXX) whether it was passed as _rlnXXX, rlnXXX or XXX.
+    This is used for every column name passed on the command line (see decisiontree.py) and by parsequery().
+    """
+
     if col.startswith("_rln"):
         return(col)
     elif col.startswith("rln"):
@@ -271,7 +271,7 @@ def classproportion(particles, columns, query, queryexact, outtype):
 
     #Use extractparticles() to get the subset of particles that contain the queries since those are
     #the only relevant ones when calculating the proportions
-    subsetparticles, totalsubset = particleplay.extractparticles(particles, columns, query, queryexact)
+    subsetparticles, totalsubset = particleplay.extractparticles(particles, columns, query, queryexact, warn=False)
 
     #If no particles match the queries, then the returned dataframe will be empty, so we can't continue
     if len(subsetparticles.index) == 0:
@@ -398,46 +398,39 @@ def comparecoords(file1parts, file2parts, numtoplot, circlesize):
         print("\n>> Error: the star file does not have a _rlnMicrographName column.\n")
         sys.exit()
 
-    #It makes this easier later if we remove the path to the micrograph name
-    #(i.e. everything before the last '/'). The original micrograph name is preserved
-    #in _rlnMicrographNameOriginal
-    file1parts["_rlnMicrographNameOriginal"] = file1parts["_rlnMicrographName"]
-    file1parts["_rlnMicrographName"] = file1parts["_rlnMicrographName"].str.split('/').str[-1]
-
-    #Generate a groupby object that is grouped by micrographs since we want to
-    #treat each micrograph independently
-    file1mics = file1parts.groupby(["_rlnMicrographName"])
-
     #Check that the coordinate columns exist
     if "_rlnCoordinateX" not in file1parts or "_rlnCoordinateY" not in file1parts:
         print("\n>> Error: the star file does not have the coordinate columns.\n")
         sys.exit()
 
-    #get_loc finds the index of the column for retrieval later down the function
-    #Consider simplifying this such that the columns are called directly.
-    file1originalmics = file1parts.columns.get_loc("_rlnMicrographNameOriginal")+1
-    file1xloc = file1parts.columns.get_loc("_rlnCoordinateX")+1
-    file1yloc = file1parts.columns.get_loc("_rlnCoordinateY")+1
-
-    #Do the same for the second star file if it has values. The original micrograph names don't 
-    #need to be preserved.
+    #Do the same for the second star file if it has values.
     if not file2parts.empty:
         
         if "_rlnMicrographName" not in file2parts:
             print("\n>> Error: the second star file does not have a _rlnMicrographName column.\n")
             sys.exit()
 
-        file2parts["_rlnMicrographName"] = file2parts["_rlnMicrographName"].str.split('/').str[-1]
-
-        file2mics = file2parts.groupby(["_rlnMicrographName"])
-
         #Check that the coordinate columns exist
         if "_rlnCoordinateX" not in file2parts or "_rlnCoordinateY" not in file2parts:
             print("\n>> Error: the second star file does not have a _rlnMicrographName column.\n")
             sys.exit()
 
-        file2xloc = file2parts.columns.get_loc("_rlnCoordinateX")+1
-        file2yloc = file2parts.columns.get_loc("_rlnCoordinateY")+1
+    #Go through the particles micrograph by micrograph. The micrographs are matched between the star files
+    #by their names without the path (i.e. everything before the last '/'), see particleplay.micindex()
+    file1index = particleplay.micindex(file1parts)
+    file1order, file1offsets = particleplay.micgroups(file1index["namecodes"][file1index["codes"]], len(file1index["names"]))
+    file1coords = file1parts[["_rlnCoordinateX","_rlnCoordinateY"]].to_numpy(dtype=float)
+
+    #We need the micrographs with the full path to source them
+    file1originalmics = file1parts["_rlnMicrographName"].to_numpy(dtype=object)
+
+    if not file2parts.empty:
+        file2index = particleplay.micindex(file2parts)
+        file2order, file2offsets = particleplay.micgroups(file2index["namecodes"][file2index["codes"]], len(file2index["names"]))
+        file2coords = file2parts[["_rlnCoordinateX","_rlnCoordinateY"]].to_numpy(dtype=float)
+
+        #The position of each micrograph in the second star file, or -1 if it has no particles there
+        file2mics = pd.Index(file2index["names"]).get_indexer(file1index["names"])
 
     #Generate a figure instance
     fig = plt.figure()
@@ -451,60 +444,44 @@ def comparecoords(file1parts, file2parts, numtoplot, circlesize):
 
     count=0
 
-    #Loop through the micrographs since it's a groupby object
-    #Consider revising with "for idm, file1mic in file1mics" to avoid
-    #having to use get_loc above.
-    for file1mic in file1mics:
+    #Loop through the micrographs
+    for m in range(len(file1index["names"])):
+
+        file1rows = file1order[file1offsets[m]:file1offsets[m+1]]
+
+        #Micrographs without particles are not plotted
+        if len(file1rows) == 0:
+            continue
 
         count+=1
 
         #Check if the second star file has particles in this micrograph
         #We will store this information in a "skipflag" True/False variable
-        if not file2parts.empty:
-            try:
-                 #If get_group succeeds, then it exists, skipflag is False
-                file2mic = file2mics.get_group(file1mic[0])
-                skipflag = False
-
-            #If it fails, skipflag is True
-            except KeyError:
-                skipflag = True
-        
+        if not file2parts.empty and file2mics[m] != -1:
+            file2rows = file2order[file2offsets[file2mics[m]]:file2offsets[file2mics[m]+1]]
+            skipflag = False
+
         #If there was no second file to begin with, skipflag is True
         else:
             skipflag = True
-            
-        #Since we didn't expand the file1mics groupby object, file1mic[0] is the micrograph name
-        mic = file1mic[0] #.split("/")[-1]
         
         #Generate the figure instance for this micrograph
         fig, ax = plt.subplots(figsize=(22.52,16.36))
         
-        #Since we didn't expand the file1mics groupby object, file1mic[1] contains the data for
-        #that micrograph. This can be iterated through with.itertuples()
-        for file1part in file1mic[1].itertuples():
-
-            #We found the location of the CoordinateX and CoordinateY columns above
-            #These need to be turned to floats since they come in as strings
-            x1 = float(file1part[file1xloc])
-            y1 = float(file1part[file1yloc])
-
-            #These are now plotted normally with the arbitrary circlesize calculated above
+        #These are now plotted normally with the arbitrary circlesize calculated above
+        for x1, y1 in file1coords[file1rows]:
             plt.scatter(x1,y1, color='red', facecolors='none', s=circlesize, alpha=0.7, linewidth = 4)
 
         #If there is a second star file and there are particles on this micrograph, do the same
         if not skipflag:
 
-            for file2part in file2mic.itertuples():
-
-                x2 = float(file2part[file2xloc])
-                y2 = float(file2part[file2yloc])
+            for x2, y2 in file2coords[file2rows]:
 
                 #The circle size is made slightly bigger so you can see it
                 plt.scatter(x2,y2, color='blue', facecolors='none', s=circlesize, alpha=0.7, linewidth = 3.5, linestyle='dashed')
 
         #We need the micrograph with the full path to source it
-        themic = file1part[file1originalmics]
+        themic = file1originalmics[file1rows[-1]]
 
         #Check if it exists. If it is a relative path, you need to run the command from the right location
         if not os.path.isfile(themic):
@@ -554,7 +531,7 @@ def comparecoords(file1parts, file2parts, numtoplot, circlesize):
             plt.imshow(data1, 'gray', origin='lower', vmin=np.percentile(np.ndarray.flatten(data1), 10), vmax=np.percentile(np.ndarray.flatten(data1), 90))
 
         #The lines below just dress up the plot
-        plt.title(file1part[file1originalmics], fontsize = 20)
+        plt.title(themic, fontsize = 20)
         plt.xlabel("Pixels", fontsize = 24)
         plt.ylabel("Pixels", fontsize = 24)
         plt.xticks(fontsize = 24)
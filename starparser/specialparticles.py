@@ -1,314 +1,255 @@
 import numpy as np
 import pandas as pd
 import sys
+from scipy.spatial import cKDTree
 
-"""
---extract_if_nearby
-"""
-def findnearby(coreparticles,nearparticles,threshdist):
+from starparser import particleplay
+
+def coordinates(particles):
 
     """
-    coreparticles comes from --i and nearparticles comes from --f
-    Workflow: go micrograph by micrograph and find the nearest distance to
-    particles in the second file, then compare that to the threshold requested
+    Returns the x,y coordinates of the particles as an array of floats (i.e. [[x1,y1], [x2,y2], etc.])
     """
 
-    #It makes this easier later if we remove the path to the micrograph name
-    #(i.e. everything before the last '/'). This name is stored in a new column
-    coreparticles["_rlnMicrographNameSimple"] = coreparticles['_rlnMicrographName'].str.split('/').str[-1]
-    nearparticles["_rlnMicrographName"] = nearparticles["_rlnMicrographName"].str.split('/').str[-1]
-
-    #Create a grouby object that is grouped by micrographs
-    coremicrographs = coreparticles.groupby(["_rlnMicrographNameSimple"])
-
-    #get_loc finds the index of the column for retrieval later down the function
-    #(Consider simplifying this such that the columns are called directly.)
-    coremicloc = coreparticles.columns.get_loc("_rlnMicrographName")+1
-    corexloc = coreparticles.columns.get_loc("_rlnCoordinateX")+1
-    coreyloc = coreparticles.columns.get_loc("_rlnCoordinateY")+1
-    corenameloc = coreparticles.columns.get_loc("_rlnImageName")+1
-    
-    #Do the same for the second star file
-    nearmicrographs = nearparticles.groupby(["_rlnMicrographName"])
-    nearxloc = nearparticles.columns.get_loc("_rlnCoordinateX")+1
-    nearyloc = nearparticles.columns.get_loc("_rlnCoordinateY")+1
-
-    #Initialize a list that will store particles that do not have a neighbor
-    #in the second star file (i.e the second file lacks particles in that micrograph)
-    noparts=[]
-
-    #This will store the particles that are too far
-    farparts=[]
-
-    #This will store all the nearest distances for plotting later
-    alldistances=[]
-
-    #Iterate through the micrographs from the first star file
-    for coremicrograph in coremicrographs:
-        
-        #To check if there are particles in the second star file for this micrograph,
-        #we will try to get_group that micrograph, if it fails, there are none
-        try:
-            nearmicrograph = nearmicrographs.get_group(coremicrograph[0])
-
-        #It is bad practice to have a naked exception here. Works for now. Consider revising.
-        except:
-
-            #If there are no particles in the second file, store all the particles from 
-            #the first file in the noparts list.
-            for coreparticle in coremicrograph[1].itertuples():
-                noparts.append(coreparticle[corenameloc])
-
-            #Continue allows us to exit this iteration of the for loop
-            #and continue to the next micrograph
-            continue 
-        
-        #Now that we have the particles from the same micrograph, we can calculate
-        #nearest distances, one particle at a time.
-        for coreparticle in coremicrograph[1].itertuples():
-
-            """
-            Our goal is to calculate the distance between the current particle and all particles
-            from the second file, allowing us to find the one that has the smallest distance
-            """
-
-            #Get the x and y coordinate for this particle. They come in as strings
-            #so we have to convert them to float
-            x1 = float(coreparticle[corexloc])
-            y1 = float(coreparticle[coreyloc])
-            
-            #We will store the x,y coordinates of all particles in the second
-            #star file in this list
-            nearparticlelocs=[]
-
-            #This one-liner (1) loops through particles in the second star file (2) turns the
-            #x,y coordinates into floats and (3) adds it to the nearparticlelocs list
-            #(i.e. [[x2,y2], [x3,y3], etc.])
-            [nearparticlelocs.append([float(n[nearxloc]),float(n[nearyloc])]) for n in nearmicrograph.itertuples()]
-
-            """
-            Instead of calculating one-by-one the distance between the x1,y1 and 
-            each coordinate in the second micrograph, we can turn the list into an
-            array and use numpy to apply the distance equation to the whole array
-            """
-            #Turn it into an array
-            nearparticlelocs = np.asarray(nearparticlelocs)
-            #calculate the distances in one go
-            distances = np.sqrt(np.sum((nearparticlelocs - [x1,y1])**2, axis=1))
-
-            #Find the minimum from the array of distances
-            mindistance = np.min(distances)
-
-            #Store the nearest distance in alldistances
-            alldistances.append(mindistance)
-
-            #If the nearest distance is further than the requested threshold,
-            #it goes in the farparts list
-            if mindistance > threshdist:
-                farparts.append(coreparticle[corenameloc])
+    return(particles[["_rlnCoordinateX","_rlnCoordinateY"]].to_numpy(dtype=np.float64))
 
+def stackmics(coords, codes, spacing):
 
     """
-    We now have a list of particles whose nearest neighbor is too far (farparts)
-    and a list of particles that don't have a corresponding neighbor (noparts)
+    Returns the coordinates with a third one that puts every micrograph (codes) on its own plane, spacing apart.
+    As long as spacing is larger than any distance within a micrograph, the nearest particles in these coordinates
+    are always on the same micrograph, so one KD-tree can be used for all the micrographs at once.
     """
 
+    return(np.column_stack([coords, codes * spacing]))
+
+def micspacing(coords, radius=0):
+
     """
-    With dataframes, stating dataframe1 = dataframe2 only creates
-    a reference. Therefore, we must create a copy if we want to leave
-    the original dataframe unmodified.
+    Returns a spacing for stackmics() that is further apart than any two of the coordinates can be,
+    and than radius (the distance that is searched within).
     """
-    farparticles = coreparticles.copy()
 
-    #We can use pandas to only keep particles that are in the farparts list
-    farparticles = farparticles[farparticles['_rlnImageName'].isin(farparts)]
+    return(max(2 * (np.nanmax(coords) - np.nanmin(coords)), radius) + 1)
 
-    #The same thing for the close particles
-    closeparticles = coreparticles.copy()
+def nearestparticles(coreparticles, nearparticles, workers=1):
 
-    #but in this case, we want the opposite (hence the tilde ~)
-    closeparticles = closeparticles[~closeparticles['_rlnImageName'].isin(farparts)]
+    """
+    Finds the nearest particle in nearparticles for every particle in coreparticles, on the micrograph with the same name
+    (without the path). Returns the position of the nearest particle in nearparticles and its distance for every particle,
+    which are -1 and NaN for particles whose micrograph has no particles in nearparticles.
+    All the particles are looked up at once in a KD-tree of nearparticles (see stackmics()), with workers threads.
+    """
 
-    #Particles that didn't have a corresponding neighbor should be removed from
-    #both dataframes since they are neither far nor close.
-    if len(noparts) != 0:
-        farparticles = farparticles[~farparticles['_rlnImageName'].isin(noparts)]
-        closeparticles = closeparticles[~closeparticles['_rlnImageName'].isin(noparts)]
+    coreindex = particleplay.micindex(coreparticles)
+    nearindex = particleplay.micindex(nearparticles)
 
-    print("\n>> Out of " + str(len(coreparticles.index)) + ", the subsets have:\n-FAR: " + str(len(farparticles.index)) + " particles\n-CLOSE: " + str(len(closeparticles.index)) + " particles\n-NO-MATCH: " + str(len(noparts)) + " particles\n")
+    #The micrograph of every particle as a position in the micrograph names of the second star file
+    nearmics = pd.Index(nearindex["names"]).get_indexer(coreindex["names"])
+    corecodes = nearmics[coreindex["namecodes"][coreindex["codes"]]]
+    nearcodes = nearindex["namecodes"][nearindex["codes"]]
 
-    #We can remove the new column we made above before returning the dataframes
-    closeparticles.drop("_rlnMicrographNameSimple", axis=1, inplace=True)
-    farparticles.drop("_rlnMicrographNameSimple", axis=1, inplace=True)
+    corecoords = coordinates(coreparticles)
+    nearcoords = coordinates(nearparticles)
 
-    return(farparticles, closeparticles, alldistances)
+    nearest = np.full(len(coreparticles.index), -1, dtype=np.intp)
+    distances = np.full(len(coreparticles.index), np.nan)
+
+    matched = np.flatnonzero(corecodes != -1)
+
+    if len(matched) == 0:
+        return(nearest, distances)
+
+    #Looking the particles up micrograph by micrograph is several times faster than in the order of the file
+    matched = matched[np.argsort(corecodes[matched], kind="stable")]
+
+    spacing = micspacing(np.concatenate([corecoords[matched], nearcoords]))
+
+    #The tree is made faster without balancing, which makes little difference to looking particles up in it
+    tree = cKDTree(stackmics(nearcoords, nearcodes, spacing), balanced_tree=False, compact_nodes=False)
+    found = tree.query(stackmics(corecoords[matched], corecodes[matched], spacing), workers=workers)[1]
+
+    #The distances are calculated again from the x,y coordinates alone
+    nearest[matched] = found
+    distances[matched] = np.sqrt(np.sum((nearcoords[found] - corecoords[matched])**2, axis=1))
+
+    return(nearest, distances)
 
 """
---fetch_from_nearby
+--extract_if_nearby
 """
-def fetchnearby(coreparticles,nearparticles,threshdist,columnstoretrieve):
+def findnearby(coreparticles,nearparticles,threshdist,workers=1):
 
-    #Create a grouby object that is grouped by micrographs
-    coremicrographs = coreparticles.groupby(["_rlnMicrographName"])
+    """
+    coreparticles comes from --i and nearparticles comes from --f
+    Workflow: find the nearest particle in the second file on the same micrograph (see nearestparticles()),
+    then compare its distance to the threshold requested. workers is the number of threads to look them up with.
+    """
 
-    #get_loc finds the index of the column for retrieval later down the function
-    #(Consider simplifying this such that the columns are called directly.)
-    coremicloc = coreparticles.columns.get_loc("_rlnMicrographName")+1
-    corexloc = coreparticles.columns.get_loc("_rlnCoordinateX")+1
-    coreyloc = coreparticles.columns.get_loc("_rlnCoordinateY")+1
-    corenameloc = coreparticles.columns.get_loc("_rlnImageName")+1
+    #Particles that do not have a neighbor in the second star file
+    #(i.e the second file lacks particles in that micrograph) have a distance of NaN
+    mindistances = nearestparticles(coreparticles, nearparticles, workers)[1]
 
-    #Do the same for the second star file
-    nearmicrographs = nearparticles.groupby(["_rlnMicrographName"])
-    nearxloc = nearparticles.columns.get_loc("_rlnCoordinateX")+1
-    nearyloc = nearparticles.columns.get_loc("_rlnCoordinateY")+1
+    noparts = np.isnan(mindistances)
 
-    #Initialize a list that will store particles that do not have a neighbor
-    #in the second star file (i.e the second file lacks particles in that micrograph)
-    noparts=[]
+    #If the nearest distance is further than the requested threshold, the particle is far
+    #(NaN is never larger, so particles without a neighbor are neither far nor close)
+    far = mindistances > threshdist
 
-    #This will store the particles that are too far
-    farparts=[]
+    farparticles = coreparticles[far]
+    closeparticles = coreparticles[~far & ~noparts]
+
+    print("\n>> Out of " + str(len(coreparticles.index)) + ", the subsets have:\n-FAR: " + str(len(farparticles.index)) + " particles\n-CLOSE: " + str(len(closeparticles.index)) + " particles\n-NO-MATCH: " + str(int(noparts.sum())) + " particles\n")
+
+    #All the nearest distances for plotting
+    alldistances = mindistances[~noparts]
+
+    return(farparticles, closeparticles, alldistances)
+
+"""
+--fetch_from_nearby
+"""
+def fetchnearby(coreparticles,nearparticles,threshdist,columnstoretrieve,workers=1):
 
-    #We'll initialize a dataframe that's identical to the original one
-    #that we will modify in the loop below
     """
-    With dataframes, stating dataframe1 = dataframe2 only creates
-    a reference. Therefore, we must create a copy if we want to leave
-    the original dataframe unmodified.
+    Copies the values of the columns in columnstoretrieve from the nearest particle in nearparticles (see nearestparticles())
+    to every particle in coreparticles whose nearest particle is within threshdist. The other particles are left out.
+    workers is the number of threads to look up the nearest particles with.
     """
-    stolenparticles = coreparticles.copy()
-
-    #Loop through the micrographs
-    for coremicrograph in coremicrographs:
-
-        #To check if there are particles in the second star file for this micrograph,
-        #we will try to get_group that micrograph, if it fails, there are none
-        try:
-            nearmicrograph = nearmicrographs.get_group(coremicrograph[0])
-
-        #It is bad practice to have a naked exception here. Works for now. Consider revising.
-        except:
-
-            #If there are no particles in the second file, store all the particles from 
-            #the first file in the noparts list.
-            for coreparticle in coremicrograph[1].itertuples():
-                noparts.append(coreparticle[corenameloc])
-
-            #Continue allows us to exit this iteration of the for loop
-            #and continue to the next micrograph
-            continue 
-        
-        for coreparticle in coremicrograph[1].itertuples():
-            x1 = float(coreparticle[corexloc])
-            y1 = float(coreparticle[coreyloc])
-            nearparticlelocs=[]
-            [nearparticlelocs.append([float(n[nearxloc]),float(n[nearyloc])]) for n in nearmicrograph.itertuples()]
-            nearparticlelocs = np.asarray(nearparticlelocs)
-            distances = np.sqrt(np.sum((nearparticlelocs - [x1,y1])**2, axis=1))
-            mindistance = np.min(distances)
-
-            if mindistance > threshdist:
-                farparts.append(coreparticle[corenameloc])
-            else:
-                nearestid = np.argmin(distances)
-                for c in columnstoretrieve:
-                    nearcoldata = nearmicrograph.iloc[nearestid][c]
-                    stolenparticles.iloc[coreparticle[0]][c] = nearcoldata
-
-    stolenparticles = stolenparticles[~stolenparticles['_rlnImageName'].isin(farparts)]
-    if len(noparts) != 0:
-        stolenparticles = stolenparticles[~stolenparticles['_rlnImageName'].isin(noparts)]
-
-    print("\n>> " + str(len(stolenparticles.index)) + " out of " + str(len(coreparticles.index)) + " (" + str(round(100*(len(stolenparticles.index)/len(coreparticles.index)),1)) + "%) " + "had neighbors close enough to fetch from. " + str(len(farparts)) + " were too far and " + str(len(noparts)) + " did not have neighbors.")
+
+    nearest, distances = nearestparticles(coreparticles, nearparticles, workers)
+
+    #Particles that do not have a neighbor in the second star file (i.e the second file lacks particles in that micrograph)
+    noparts = nearest == -1
+
+    #Particles whose nearest neighbor is too far
+    farparts = distances > threshdist
+
+    keep = ~noparts & ~farparts
+
+    #The values of each column are taken from the nearest particles all at once
+    stolenparticles = coreparticles[keep]
+    found = nearest[keep]
+    stolenparticles = stolenparticles.assign(**{c: nearparticles[c].array.take(found) for c in columnstoretrieve})
+
+    print("\n>> " + str(len(stolenparticles.index)) + " out of " + str(len(coreparticles.index)) + " (" + str(round(100*(len(stolenparticles.index)/len(coreparticles.index)),1)) + "%) " + "had neighbors close enough to fetch from. " + str(int(farparts.sum())) + " were too far and " + str(int(noparts.sum())) + " did not have neighbors.")
 
     return(stolenparticles)
 
 """
 --extract_clusters
 """
-def getcluster(particles,threshold,minimum):
-
-    #~needs explanation~#
-
-    uniquemics = particles.groupby(["_rlnMicrographName"])
-    xloc = particles.columns.get_loc("_rlnCoordinateX")+1
-    yloc = particles.columns.get_loc("_rlnCoordinateY")+1
-    nameloc = particles.columns.get_loc("_rlnImageName")+1
-
-    keep = []
-    for mic in uniquemics:
-        coords = []
-        names = []
-        for particle in mic[1].itertuples():
-            x = float(particle[xloc])
-            y = float(particle[yloc])
-            coords.append([x,y])
-            names.append(particle[nameloc])
-        coords = np.asarray(coords)
-        for i in range(0,len(coords)):
-            distances = np.sqrt(np.sum((coords - [coords[i]])**2, axis=1))
-            distances = distances[np.logical_and(distances <= threshold, distances > 0)]
-            if len(distances) >= minimum:
-                keep.append(names[i])
-
-    if len(keep) == 0:
+def getcluster(particles,threshold,minimum,workers=1):
+
+    """
+    Keeps the particles that have at least minimum other particles within threshold on the same micrograph.
+    Particles at exactly the same position aren't counted as neighbors. The neighbors of all the particles are
+    counted at once in a KD-tree (see stackmics()) with workers threads. The number of particles with each number
+    of neighbors is printed so that threshold and minimum can be chosen without running this again.
+    """
+
+    index = particleplay.micindex(particles)
+    coords = coordinates(particles)
+
+    if len(coords) == 0:
         print(">> Error: no particles were retained based on the criteria.\n")
         sys.exit()
-    elif len(keep) == len(particles.index):
+
+    #The particles are looked up micrograph by micrograph, which is several times faster than in the order of the file
+    order = np.argsort(index["codes"], kind="stable")
+    stacked = stackmics(coords[order], index["codes"][order], micspacing(coords, threshold))
+    tree = cKDTree(stacked, balanced_tree=False, compact_nodes=False)
+
+    neighbors = np.empty(len(order), dtype=np.intp)
+    neighbors[order] = tree.query_ball_point(stacked, threshold, return_length=True, workers=workers) - samepositions(stacked)
+
+    printneighbors(neighbors, threshold, minimum)
+
+    keep = neighbors >= minimum
+
+    if not keep.any():
+        print(">> Error: no particles were retained based on the criteria.\n")
+        sys.exit()
+    elif keep.all():
         print(">> Error: all particles were retained. No star file will be output.\n")
         sys.exit()
 
+    particles_purged = particles[keep]
+
+    return(particles_purged)
+
+def samepositions(coords):
+
     """
-    With dataframes, stating dataframe1 = dataframe2 only creates
-    a reference. Therefore, we must create a copy if we want to leave
-    the original dataframe unmodified.
+    Returns the number of particles at exactly the same position as every particle (including itself), which are
+    within any distance of it. Usually each particle is alone, so only the duplicated positions are counted.
     """
-    particles_purged = particles.copy()
 
-    toconcat = [particles_purged[particles_purged["_rlnImageName"] == q] for q in keep]
+    counts = np.ones(len(coords), dtype=np.intp)
+    duplicated = pd.DataFrame(coords).duplicated(keep=False).to_numpy()
 
-    particles_purged = pd.concat(toconcat)
+    if duplicated.any():
+        inverse, sizes = np.unique(coords[duplicated], axis=0, return_inverse=True, return_counts=True)[1:]
+        counts[duplicated] = sizes[inverse.ravel()]
 
-    return(particles_purged)
+    return(counts)
+
+def printneighbors(neighbors, threshold, minimum):
+
+    """
+    Prints how many particles have each number of neighbors (see getcluster()), up to twice the minimum.
+    """
+
+    largest = max(2*minimum, 10)
+    counts = np.bincount(np.minimum(neighbors, largest), minlength=largest+1)
+
+    print(">> Number of particles by number of neighbors within " + str(threshold) + " pixels:\n")
+    for n, c in enumerate(counts):
+        label = str(n) if n < largest else str(n) + "+"
+        print("   " + label.rjust(len(str(largest))+1) + ": " + str(c) + ("  <- minimum" if n == minimum else ""))
+    print("")
 
 """
 --extract_minimum
 """
-def extractwithmin(particles,minimum):
+def extractwithmin(particles,minimum,countsname=None):
 
-    #~needs explanation~#
+    """
+    Keeps the particles of the micrographs that have more than minimum particles, in their original order.
+    The particles are counted per micrograph from particleplay.micindex(). If countsname is given, the number of
+    particles in every micrograph is also written to it, one micrograph per line.
+    """
 
-    uniquemics = particles.groupby(["_rlnMicrographName"])
-    nameloc = particles.columns.get_loc("_rlnImageName")+1
+    index = particleplay.micindex(particles)
+    counts = np.bincount(index["codes"], minlength=len(index["mics"]))
 
-    keep = []
-    badmics = 0
-    for mic in uniquemics:
-        if len(mic[1]) > minimum:
-            for particle in mic[1].itertuples():
-                keep.append(particle[nameloc])
-        else:
-            badmics+=1
+    if countsname is not None:
+        writecounts(index["mics"], counts, countsname)
 
-    if len(keep) == 0:
+    #The number of particles in every particle's micrograph
+    keep = counts[index["codes"]] > minimum
+    badmics = int((counts <= minimum).sum())
+
+    if not keep.any():
         print("\n>> Error: no particles were retained based on the criteria.\n")
         sys.exit()
-    elif len(keep) == len(particles.index):
+    elif keep.all():
         print("\n>> Error: all particles were retained. No star file will be output.")
         sys.exit()
 
     print(">> " + str(badmics) + " micrographs don't meet the criteria.\n")
 
+    particles_purged = particles[keep]
+
+    return(particles_purged)
+
+def writecounts(mics, counts, countsname):
+
     """
-    With dataframes, stating dataframe1 = dataframe2 only creates
-    a reference. Therefore, we must create a copy if we want to leave
-    the original dataframe unmodified.
+    Writes the number of particles in every micrograph (see extractwithmin()) as tab-separated lines.
     """
-    particles_purged = particles.copy()
-
-    toconcat = [particles_purged[particles_purged["_rlnImageName"] == q] for q in keep]
 
-    particles_purged = pd.concat(toconcat)
+    with open(countsname, "w") as output:
+        output.writelines(m + "\t" + str(c) + "\n" for m, c in zip(mics, counts))
 
-    return(particles_purged)
\ No newline at end of file
+    print(">> Wrote the number of particles in every micrograph\n-->> Output file: " + countsname + "\n")
@@ -1,48 +1,73 @@
 from starparser import particleplay
 from starparser import fileparser
 import sys
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 def splitparts(particles,numsplits):
 
+    """
+    Returns the particles split into numsplits parts of about the same size without separating the particles of a micrograph.
+    The micrographs are kept in the order they first appear in, so they do not need to be sorted, and each part ends at
+    the micrograph boundary closest to where an equal split would have ended. The particles keep their order in each part.
+    """
+
     totalparticles = len(particles.index)
 
-    splitnum = int(totalparticles/numsplits)
+    index = particleplay.micindex(particles)
+    order, offsets = particleplay.micgroups(index["codes"], len(index["mics"]))
+    counts = np.diff(offsets)
+
+    #Only the micrographs that have particles are split up
+    present = np.flatnonzero(counts)
+    totalmics = len(present)
 
-    start = 0
-    end = splitnum
+    #The micrographs in the order they first appear, and the number of particles before each boundary between them
+    appearance = present[np.argsort(order[offsets[present]], kind="stable")]
+    edges = np.zeros(totalmics + 1, dtype=np.intp)
+    np.cumsum(counts[appearance], out=edges[1:])
 
-    splitstars = []
+    #Each part ends at whichever boundary is closest to where it would end in an equal split
+    targets = totalparticles * np.arange(1, numsplits) / numsplits
+    after = np.searchsorted(edges, targets)
+    before = after - 1
+    cuts = np.where(targets - edges[before] < edges[after] - targets, before, after)
 
-    for i in range(numsplits):
+    #A part can't be empty, which happens when a micrograph has more particles than a part would
+    cuts = np.unique(np.clip(cuts, 1, totalmics - 1)) if totalmics > 1 else np.array([], dtype=np.intp)
+    numparts = len(cuts) + 1
 
-        currentmic = particles["_rlnMicrographName"][end]
-        
-        j = end
+    if numparts < numsplits:
+        print("\n>> Warning: the particles could only be split into " + str(numparts) + " parts without separating the particles of a micrograph.")
 
-        if j != totalparticles:
+    #The part of every micrograph, and then of every particle
+    micparts = np.zeros(len(index["mics"]), dtype=np.intp)
+    micparts[appearance] = np.searchsorted(cuts, np.arange(totalmics), side="right")
 
-            while particles["_rlnMicrographName"][j] == particles["_rlnMicrographName"][end]:
-                j+=1
-                if j == totalparticles:
-                    break
+    partorder, partoffsets = particleplay.micgroups(micparts[index["codes"]], numparts)
 
-        end = j
+    return([particles.iloc[partorder[partoffsets[i]:partoffsets[i+1]]] for i in range(numparts)])
 
-        splitstars.append(particles.iloc[start:end,:])
+def writeparts(splitstars, metadata, outputnames, relegateflag, workers=1):
 
-        start = j
-        end = j+splitnum
+    """
+    Writes the parts from splitparts() to their star files, workers of them at the same time.
+    """
 
-        if end > totalparticles-1:
-            end = totalparticles-1
+    if workers < 2:
+        for s, outputname in zip(splitstars, outputnames):
+            fileparser.writestar(s, metadata, outputname, relegateflag)
+        return
 
-    return(splitstars)
+    #Errors in writestar() (sys.exit()) are raised again here when the results are collected
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda s, outputname: fileparser.writestar(s, metadata, outputname, relegateflag), splitstars, outputnames))
 
 def splitbyoptics(particles,metadata,queryexact):
     print("")
     for n,o in zip(metadata[2]["_rlnOpticsGroup"],metadata[2]["_rlnOpticsGroupName"]):
         subsetoptics, subsetopticslength = particleplay.extractparticles(particles,["_rlnOpticsGroup"],[n],queryexact)
-        newmetadata = [metadata[0], metadata[1], metadata[2][metadata[2]["_rlnOpticsGroupName"] == o], metadata[3], metadata[4]]
+        newmetadata = metadata.replace(optics=metadata.optics[metadata.optics["_rlnOpticsGroupName"] == o])
         print(">> Optics group " + str(n) + " has " + str(subsetopticslength) + " particles.")
         fileparser.writestar(subsetoptics, newmetadata, o+".star", False)
 
@@ -0,0 +1,266 @@
+import sys
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+"""
+This is an opt-in cache of parsed star files (see fileparser.getparticles(cache=True)), so that commands that are run
+one after the other on the same star file don't have to parse its text every time.
+
+Every cached star file gets a folder in the cache directory with:
+    header.json: the key of the star file, its metadata list, the block that the particles were read from, and the columns
+    <n>.codes.npy: for each column, the position of every row's value in the list of unique values, memory-mapped when read
+    <n>.values.txt: for each column, the unique values, one per line
+
+The key is the path, size and modification time of the star file, along with a hash of its first and last bytes,
+so that a star file that was overwritten is parsed again. Hashing the whole file would take as long as parsing it.
+
+The cache directory is $STARPARSER_CACHE_DIR (~/.cache/starparser by default) and its total size is kept below
+$STARPARSER_CACHE_SIZE (e.g. 500M or 20G, 20G by default) by removing the least recently used star files first.
+"""
+
+"""
+The number of bytes at the start and at the end of the star file that are hashed for the key
+"""
+HASHSIZE = 1 << 20
+
+"""
+The version of the format of the cache, which is part of the key so that older caches are ignored
+"""
+CACHEVERSION = 1
+
+def cachedir():
+
+    """
+    Returns the directory where the cache is kept.
+    """
+
+    return(os.environ.get("STARPARSER_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "starparser"))
+
+def cachelimit():
+
+    """
+    Returns the maximum total size of the cache in bytes, which can be passed with a K, M, G or T suffix.
+    """
+
+    limit = os.environ.get("STARPARSER_CACHE_SIZE", "20G").strip().upper()
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+    try:
+        if limit[-1:] in units:
+            return(int(float(limit[:-1]) * units[limit[-1]]))
+        return(int(float(limit)))
+    except ValueError:
+        print("\n>> Error: could not understand the cache size \"" + limit + "\" (e.g. 500M or 20G).\n")
+        sys.exit()
+
+def filekey(filename):
+
+    """
+    Returns the key that a cached star file has to match (see the top of this file).
+    """
+
+    stat = os.stat(filename)
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename,mode='rb') as file:
+        digest.update(file.read(HASHSIZE))
+        if stat.st_size > HASHSIZE:
+            file.seek(max(HASHSIZE, stat.st_size - HASHSIZE))
+            digest.update(file.read(HASHSIZE))
+
+    return({"path": os.path.abspath(filename), "size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": digest.hexdigest(), "version": CACHEVERSION})
+
+def entrypath(filename, mode):
+
+    """
+    Returns the folder of a star file in the cache. Files read with and without --opticsless (mode) are cached separately.
+    """
+
+    name = hashlib.blake2b((os.path.abspath(filename) + "\n" + mode).encode(), digest_size=10).hexdigest()
+
+    return(os.path.join(cachedir(), name))
+
+def lookup(filename, mode):
+
+    """
+    Returns the cache entry of a star file (the contents of header.json, with the folder in "folder") or None
+    if the star file isn't in the cache or has changed since it was cached.
+    """
+
+    folder = entrypath(filename, mode)
+    headerfile = os.path.join(folder, "header.json")
+
+    try:
+        with open(headerfile) as file:
+            entry = json.load(file)
+    except (OSError, ValueError):
+        return(None)
+
+    if entry.get("key") != filekey(filename):
+        return(None)
+
+    #The modification time of header.json is used to find the least recently used star files in evict()
+    try:
+        os.utime(headerfile)
+    except OSError:
+        pass
+
+    entry["folder"] = folder
+
+    return(entry)
+
+def newentry(filename, mode, metadata, block):
+
+    """
+    Returns a new cache entry for a star file without any columns yet. Nothing is written until store() is called.
+    metadata is the metadata (a fileparser.StarFile) from fileparser.getparticles() and block is the block the particles are read from.
+    """
+
+    version, opticsheaders, optics, particlesheaders, tablename = metadata
+
+    return({"key": filekey(filename),
+            "folder": entrypath(filename, mode),
+            "metadata": {"version": version, "opticsheaders": opticsheaders, "optics": optics.to_numpy(dtype=object).tolist(),
+                         "particlesheaders": particlesheaders, "tablename": tablename},
+            "block": block,
+            "rows": None,
+            "columns": {}})
+
+def getmetadata(entry):
+
+    """
+    Returns the fields of the metadata of a cache entry, in the order of the arguments of fileparser.StarFile.
+    """
+
+    m = entry["metadata"]
+    optics = pd.DataFrame(m["optics"], columns=m["opticsheaders"], dtype=str)
+
+    return([list(m["version"]), list(m["opticsheaders"]), optics, list(m["particlesheaders"]), m["tablename"]])
+
+def store(entry, items):
+
+    """
+    Adds the columns of a dataframe to a cache entry and writes them to the cache. Each column is stored as the
+    positions of its values in the list of its unique values (see the top of this file).
+    Returns False if the cache could not be written.
+    """
+
+    folder = entry["folder"]
+
+    try:
+
+        #A new entry replaces whatever was cached for the star file before
+        if not entry["columns"]:
+            shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder, exist_ok=True)
+
+        for c in items.columns:
+
+            if c in entry["columns"]:
+                continue
+
+            codes, values = pd.factorize(items[c].to_numpy(dtype=object))
+
+            #The smallest integer type that fits the number of unique values
+            codes = codes.astype(np.min_scalar_type(max(len(values) - 1, 0)))
+
+            n = len(entry["columns"])
+            files = {"codes": str(n) + ".codes.npy", "values": str(n) + ".values.txt"}
+
+            #Everything is written to a temporary file first so that a partially written file is never read
+            with open(os.path.join(folder, files["codes"] + ".tmp"), mode='wb') as file:
+                np.save(file, codes)
+            with open(os.path.join(folder, files["values"] + ".tmp"), mode='w', encoding="utf-8") as file:
+                file.write("\n".join(values))
+            for f in files.values():
+                os.replace(os.path.join(folder, f + ".tmp"), os.path.join(folder, f))
+
+            entry["columns"][c] = files
+
+        entry["rows"] = len(items.index)
+
+        with open(os.path.join(folder, "header.json.tmp"), mode='w') as file:
+            json.dump({k: v for k,v in entry.items() if k != "folder"}, file)
+        os.replace(os.path.join(folder, "header.json.tmp"), os.path.join(folder, "header.json"))
+
+    except OSError:
+        print("\n>> Warning: could not write to the cache in " + cachedir() + ".\n")
+        return(False)
+
+    evict(keep=folder)
+
+    return(True)
+
+def readcolumns(entry, columns):
+
+    """
+    Returns a dataframe of the cached columns of a cache entry, with the values as text.
+    """
+
+    folder = entry["folder"]
+    items = {}
+
+    for c in columns:
+
+        files = entry["columns"][c]
+        codes = np.load(os.path.join(folder, files["codes"]), mmap_mode="r")
+
+        with open(os.path.join(folder, files["values"]), encoding="utf-8") as file:
+            values = np.array(file.read().split("\n"), dtype=object)
+
+        items[c] = pd.array(values[codes], dtype=str) if len(codes) else pd.array([], dtype=str)
+
+    return(pd.DataFrame(items, index=pd.RangeIndex(entry["rows"]), columns=columns))
+
+def foldersize(folder):
+
+    """
+    Returns the total size of the files in a folder of the cache.
+    """
+
+    size = 0
+    for f in os.scandir(folder):
+        try:
+            size += f.stat().st_size
+        except OSError:
+            pass
+
+    return(size)
+
+def evict(keep=None):
+
+    """
+    Removes the least recently used star files from the cache until it is smaller than cachelimit().
+    The folder in keep (i.e. the star file that was just cached) is not removed.
+    """
+
+    limit = cachelimit()
+    folders = []
+
+    try:
+        for f in os.scandir(cachedir()):
+            if f.is_dir():
+                try:
+                    used = os.stat(os.path.join(f.path, "header.json")).st_mtime
+                except OSError:
+                    used = 0
+                folders.append((used, f.path, foldersize(f.path)))
+    except OSError:
+        return
+
+    total = sum(f[2] for f in folders)
+
+    for used, folder, size in sorted(folders):
+
+        if total <= limit:
+            break
+
+        if folder == keep:
+            continue
+
+        shutil.rmtree(folder, ignore_errors=True)
+        total -= size
@@ -0,0 +1,68 @@
+import pytest
+
+from starparser import argparser
+from starparser import decisiontree
+from starparser import fileparser
+
+"""
+--stream reads the particles a chunk at a time, which has to give the same star file as reading all of them at once
+"""
+
+HEADER = """
+# version 30001
+
+data_optics
+
+loop_
+_rlnOpticsGroupName #1
+_rlnOpticsGroup #2
+_rlnImagePixelSize #3
+opticsGroup1 1 1.000000
+
+# version 30001
+
+data_particles
+
+loop_
+_rlnMicrographName #1
+_rlnDefocusU #2
+_rlnOpticsGroup #3
+"""
+
+"""
+Most chunks of 7 rows have defocus values that fit in float32, but a few don't, so the whole column is float64
+"""
+DEFOCUS = ["13834.5", "22000.25", "18000.75", "25000.5", "15500.125", "21000.0", "19999.5"] * 6 + ["20751.482982", "18311.097213", "24150.731148"]
+
+def makestar(path):
+    rows = [f"mic_{i % 5}.mrc\t{d}\t1" for i, d in enumerate(DEFOCUS)]
+    path.write_text(HEADER + "\n".join(rows) + "\n")
+    return(str(path))
+
+def runboth(tmp_path, options):
+
+    """
+    Returns the text of the star files written with and without --stream (7 particles at a time).
+    """
+
+    filename = makestar(tmp_path / "particles.star")
+    whole = str(tmp_path / "whole.star")
+    streamed = str(tmp_path / "streamed.star")
+
+    params = argparser.parseline("--i " + filename + " --o " + whole + " " + options)
+    decisiontree.checkparams(params)
+    particles, metadata = fileparser.getparticles(filename)
+    particles, metadata, relegateflag = decisiontree.runoperation(params, filename, particles, metadata)
+    fileparser.writestar(particles, metadata, whole, relegateflag)
+
+    params = argparser.parseline("--i " + filename + " --o " + streamed + " --stream " + options)
+    decisiontree.checkparams(params)
+    decisiontree.runstream(params, rows=7)
+
+    with open(whole) as a, open(streamed) as b:
+        return(a.read(), b.read())
+
+@pytest.mark.parametrize("options", ["--operate DefocusU*1.5", "--operate DefocusU+0.1", "--limit DefocusU/lt/20751.482982", "--limit DefocusU/ge/19999.5"])
+def test_stream_matches(tmp_path, options):
+    whole, streamed = runboth(tmp_path, options)
+    assert streamed == whole